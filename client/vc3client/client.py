@@ -57,6 +57,17 @@ class VC3ClientAPI(object):
         self.ic = infoclient.InfoClient(self.config)
         self.log = logging.getLogger('vc3client')
 
+    def batch(self):
+        '''
+        Returns context manager collecting entity stores and deletes, which are 
+        applied together, or not at all, when the block exits. E.g.
+        
+            with client.batch() as b:
+                nodeset.store(b)
+                cluster.store(b)
+        '''
+        return self.ic.batch()
+
     ################################################################################
     #                           Policy related checks
     ################################################################################
@@ -67,11 +78,8 @@ class VC3ClientAPI(object):
         :param user: name from User object (e.g. User.name)
         :return: True if user has a validated allocation
         """
-        allocations = self.listAllocations()
-        for allocation in allocations:
-            if user == allocation.owner and allocation.state == "validated":
-                return True
-        return False
+        allocations = self.ic.queryentities(Allocation, where={ 'owner' : user, 'state' : 'validated' }, fields=['name'])
+        return len(allocations) > 0
 
     def __has_project(self, user=None):
         """
@@ -80,10 +88,10 @@ class VC3ClientAPI(object):
         :param user: name from User object (e.g. User.name)
         :return: True if user is owns a project or is a project member
         """
-        projects = self.listProjects()
-        for project in projects:
-            if user == project.owner or user in project.members:
-                return True
+        if self.ic.queryentities(Project, where={ 'owner' : user }, fields=['name']):
+            return True
+        if self.ic.queryentities(Project, where={ 'members' : user }, fields=['name']):
+            return True
         return False
 
     def __valid_user(self, user=None):
@@ -143,7 +151,7 @@ class VC3ClientAPI(object):
                   docurl = docurl
                   )
         u.storenew = True
-        self.log.debug("Creating user object: %s " % u)
+        self.log.debug("Creating user object: %s ", u)
         return u
     
         
@@ -156,18 +164,26 @@ class VC3ClientAPI(object):
         user.store(self.ic)
           
 
-    def listUsers(self):
+    def listUsers(self, lazy=False):
         '''
         Returns list of all valid users as a list of User objects. 
 
+        :param bool lazy: Return a generator of entity views instead (see InfoClient.listentities)
         :return: return description
         :rtype: List of User objects. 
         
         '''
-        return self.ic.listentities(User)
+        return self.ic.listentities(User, lazy=lazy)
        
     def getUser(self, username):
         return self.ic.getentity(User , username)
+
+    def getUsers(self, usernames):
+        '''
+        Returns list of User objects for the given names, fetched in one call.
+        Raises InfoEntityMissingException if any of them does not exist. 
+        '''
+        return self.ic.getentities(User, usernames)
     
     def deleteUser(self, username):
         self.ic.deleteentity( User, username)
@@ -213,7 +229,7 @@ class VC3ClientAPI(object):
         p.addUser(owner)
 
         p.storenew = True
-        self.log.debug("Created project object: %s " % p)
+        self.log.debug("Created project object: %s ", p)
         return p
 
     def storeProject(self, project, policy_user=None):
@@ -224,7 +240,7 @@ class VC3ClientAPI(object):
         :param str policy_user: The VC3 user name of the user trying this operation
         :return: None
         '''
-        self.log.debug("Storing project %s" % project)
+        self.log.debug("Storing project %s", project)
         if policy_user is not None and policy_user != project.owner:
             raise PermissionDenied("{0} is not the project owner".format(policy_user))
         project.store(self.ic)
@@ -236,14 +252,14 @@ class VC3ClientAPI(object):
         :param str user
         :param str policy_user: The VC3 user name of the user trying this operation
         '''
-        self.log.debug("Looking up user %s project %s " % (user, project))
+        self.log.debug("Looking up user %s project %s ", user, project)
         po = self.getProject(project)
         if po is None:
             self.log.warning("Could not find project object %s " % (po,))
         else:
             if policy_user is not None and po.owner != policy_user:
                 raise PermissionDenied("{0} is not the project owner".format(policy_user))
-            self.log.debug("Adding user %s to project object %s " % (user, po))
+            self.log.debug("Adding user %s to project object %s ", user, po)
             po.addUser(user)
             self.storeProject(po)        
 
@@ -253,12 +269,12 @@ class VC3ClientAPI(object):
         :param str user
         :param str policy_user: The VC3 user name of the user trying this operation
         '''
-        self.log.debug("Looking up user %s project %s " % (user, project))
+        self.log.debug("Looking up user %s project %s ", user, project)
         po = self.getProject(project)
         if po is None:
             self.log.warning("Could not find project object %s " % (po,))
         else:
-            self.log.debug("Removing user %s from project object %s " % (user, po))
+            self.log.debug("Removing user %s from project object %s ", user, po)
             if policy_user is not None:
                 if po.owner != policy_user and user not in po.members:
                     err_msg = "{0} is not allowed ".format(policy_user)
@@ -268,7 +284,7 @@ class VC3ClientAPI(object):
 
             po.removeUser(user)
             self.storeProject(po)
-        self.log.debug("Removing user %s from project object %s " % (user, po))
+        self.log.debug("Removing user %s from project object %s ", user, po)
         po.removeUser(user)
         self.storeProject(po)
 
@@ -278,7 +294,7 @@ class VC3ClientAPI(object):
         :param str allocation:
         :param str policy_user: The VC3 user name of the user trying this operation
         '''
-        self.log.debug("Looking up allocation %s project %s " % (allocation, projectname))
+        self.log.debug("Looking up allocation %s project %s ", allocation, projectname)
         if policy_user is not None:
             alloc = self.getAllocation(allocation)
             if policy_user != alloc.owner:
@@ -288,7 +304,7 @@ class VC3ClientAPI(object):
         if po is None:
             self.log.warning("Could not find project object %s " % (po,))
         else:
-            self.log.debug("Adding allocation %s to project object %s " % (allocation, po))
+            self.log.debug("Adding allocation %s to project object %s ", allocation, po)
             po.addAllocation(allocation)
             self.storeProject(po)
         
@@ -298,7 +314,7 @@ class VC3ClientAPI(object):
         :param str allocation
         :param str policy_user: The VC3 user name of the user trying this operation
         '''
-        self.log.debug("Looking up allocation %s project %s " % (allocation, projectname))
+        self.log.debug("Looking up allocation %s project %s ", allocation, projectname)
         if policy_user is not None:
             alloc = self.getAllocation(allocation)
             if policy_user != alloc.owner:
@@ -309,17 +325,22 @@ class VC3ClientAPI(object):
         if po is None:
             self.log.warning("Could not find project object %s " % (po,))
         else:
-            self.log.debug("Removing allocation %s from project object %s " % (allocation, po))
+            self.log.debug("Removing allocation %s from project object %s ", allocation, po)
             po.removeAllocation(allocation)
             self.storeProject(po)
 
-    def listProjects(self, policy_user=None):
+    def listProjects(self, policy_user=None, where=None, lazy=False):
         """
         :param str policy_user: The VC3 user name of the user trying this operation
+        :param dict where: Only projects with these attribute values (see InfoClient.listentities)
+        :param bool lazy: Return a generator of entity views instead (see InfoClient.listentities)
         """
         if policy_user is not None and not self.__valid_user(policy_user):
             raise PermissionDenied(policy_user + "is not a valid user")
-        return self.ic.listentities(Project)
+        return self.ic.listentities(Project, where=where, lazy=lazy)
+
+    def listProjectNames(self, where=None):
+        return self.ic.listnames(Project, where=where)
        
     def getProject(self, projectname, policy_user=None):
         """
@@ -335,9 +356,7 @@ class VC3ClientAPI(object):
         """
         if policy_user is not None and not self.__valid_user(policy_user):
             raise PermissionDenied(policy_user + "is not a valid user")
-        projects = self.listProjects()
-        filtered = [ p for p in projects if ownername == p.owner ]
-        return filtered
+        return self.listProjects(where={ 'owner' : ownername })
 
     def getProjectsOfUser(self, username, policy_user=None):
         """
@@ -345,9 +364,7 @@ class VC3ClientAPI(object):
         """
         if policy_user is not None and not self.__valid_user(policy_user):
             raise PermissionDenied(policy_user + "is not a valid user")
-        projects = self.listProjects()
-        filtered = [ p for p in projects if username in p.members ]
-        return filtered
+        return self.listProjects(where={ 'members' : username })
 
     def deleteProject(self, projectname, policy_user=None):
         """
@@ -427,19 +444,22 @@ class VC3ClientAPI(object):
                       organization = organization                      
                        )
         r.storenew = True
-        self.log.debug("Creating Resource object: %s " % r)
+        self.log.debug("Creating Resource object: %s ", r)
         return r
     
     
     def storeResource(self, resource):
         resource.store(self.ic)
     
-    def listResources(self):
-        return self.ic.listentities(Resource)
+    def listResources(self, lazy=False):
+        return self.ic.listentities(Resource, lazy=lazy)
        
     def getResource(self, resourcename):
         return self.ic.getentity(Resource, resourcename)
 
+    def getResources(self, resourcenames):
+        return self.ic.getentities(Resource, resourcenames)
+
     def deleteResource(self, resourcename):
         self.ic.deleteentity( Resource, resourcename)
 
@@ -475,7 +495,7 @@ class VC3ClientAPI(object):
                         privtoken=privtoken,
                         )
         ao.storenew = True
-        self.log.debug("Creating Allocation object: %s " % ao)
+        self.log.debug("Creating Allocation object: %s ", ao)
         return ao
 
     def storeAllocation(self, allocation, policy_user=None):
@@ -508,8 +528,11 @@ class VC3ClientAPI(object):
                 pass
         allocation.store(self.ic)
 
-    def listAllocations(self):
-        return self.ic.listentities( Allocation )
+    def listAllocations(self, where=None, lazy=False):
+        return self.ic.listentities( Allocation, where=where, lazy=lazy)
+
+    def listAllocationNames(self, where=None):
+        return self.ic.listnames(Allocation, where=where)
        
     def getAllocation(self, allocationname):
         return self.ic.getentity( Allocation, allocationname)
@@ -600,9 +623,10 @@ class VC3ClientAPI(object):
                                        "be a project member")
         cluster.store(self.ic)
     
-    def listClusters(self, policy_user=None):
+    def listClusters(self, policy_user=None, lazy=False):
         """
         :param str policy_user: The VC3 user name of the user trying this operation
+        :param bool lazy: Return a generator of entity views instead (see InfoClient.listentities)
         """
         if policy_user is not None:
             if not self.__valid_user(policy_user):
@@ -618,7 +642,7 @@ class VC3ClientAPI(object):
                 raise PermissionDenied(policy_user +
                                        "needs a valid allocation or " +
                                        "be a project member")
-        return self.ic.listentities(Cluster)
+        return self.ic.listentities(Cluster, lazy=lazy)
        
     def getCluster(self, clustername):
         return self.ic.getentity(Cluster, clustername)
@@ -696,15 +720,18 @@ class VC3ClientAPI(object):
                       docurl = docurl
                        )
         ns.storenew = True
-        self.log.debug("Created Nodeinfo object: %s" % ns)
+        self.log.debug("Created Nodeinfo object: %s", ns)
         return ns 
     
-    def listNodeinfos(self):
-        return self.ic.listentities(Nodeinfo)
+    def listNodeinfos(self, lazy=False):
+        return self.ic.listentities(Nodeinfo, lazy=lazy)
        
     def getNodeinfo(self, nodeinfoName):
         return self.ic.getentity(Nodeinfo, nodeinfoName)
 
+    def getNodeinfos(self, nodeinfoNames):
+        return self.ic.getentities(Nodeinfo, nodeinfoNames)
+
     def deleteNodeinfo(self, nodeinfoName):
         self.ic.deleteentity(Nodeinfo, nodeinfoName)
     
@@ -750,15 +777,28 @@ class VC3ClientAPI(object):
                       docurl = docurl
                        )
         ns.storenew = True
-        self.log.debug("Created Nodeset object: %s" % ns)
+        self.log.debug("Created Nodeset object: %s", ns)
         return ns 
     
-    def listNodesets(self):
-        return self.ic.listentities(Nodeset)
+    def listNodesets(self, where=None, lazy=False):
+        return self.ic.listentities(Nodeset, where=where, lazy=lazy)
+
+    def listNodesetNames(self, where=None):
+        return self.ic.listnames(Nodeset, where=where)
+
+    def queryNodesets(self, where=None, fields=None):
+        '''
+        Returns list of dictionaries with attributes <fields> of the nodesets
+        matching <where>. See InfoClient.queryentities().
+        '''
+        return self.ic.queryentities(Nodeset, where=where, fields=fields)
        
     def getNodeset(self, nodesetname):
         return self.ic.getentity(Nodeset, nodesetname)
 
+    def getNodesets(self, nodesetnames):
+        return self.ic.getentities(Nodeset, nodesetnames)
+
     def deleteNodeset(self, nodesetname):
         self.ic.deleteentity(Nodeset, nodesetname)
     
@@ -797,18 +837,21 @@ class VC3ClientAPI(object):
                         docurl = docurl
                         )
         e.storenew = True
-        self.log.debug("Creating Environment object: %s " % e)
+        self.log.debug("Creating Environment object: %s ", e)
         return e
     
     def storeEnvironment(self, environment):
         environment.store(self.ic)
     
-    def listEnvironments(self):
-        return self.ic.listentities(Environment)
+    def listEnvironments(self, lazy=False):
+        return self.ic.listentities(Environment, lazy=lazy)
        
     def getEnvironment(self, environmentname):
         return self.ic.getentity(Environment, environmentname)
 
+    def getEnvironments(self, environmentnames):
+        return self.ic.getentities(Environment, environmentnames)
+
     def deleteEnvironment(self, environmentname):
         self.ic.deleteentity(Environment , environmentname)
 
@@ -857,7 +900,7 @@ class VC3ClientAPI(object):
                     organization = organization
                     )
         r.storenew = True
-        self.log.debug("Creating Request object: %s " % r)
+        self.log.debug("Creating Request object: %s ", r)
         return r
     
     def storeRequest(self, request, policy_user=None):
@@ -876,9 +919,26 @@ class VC3ClientAPI(object):
 
         request.store(self.ic)
 
+    def patchRequest(self, requestname, path, value):
+        '''
+        Sets only the part of a request at <path>, a list of nested attribute names, 
+        e.g. ['statusraw', factoryid]. A value of None removes it. 
+        '''
+        self.ic.patchentity(Request, requestname, path, value)
+
+
+    def listRequests(self, where=None, lazy=False):
+        return self.ic.listentities(Request, where=where, lazy=lazy)
 
-    def listRequests(self):
-        return self.ic.listentities(Request)
+    def listRequestNames(self, where=None):
+        return self.ic.listnames(Request, where=where)
+
+    def queryRequests(self, where=None, fields=None):
+        '''
+        Returns list of dictionaries with attributes <fields> of the requests
+        matching <where>. See InfoClient.queryentities().
+        '''
+        return self.ic.queryentities(Request, where=where, fields=fields)
        
     def getRequest(self, requestname, policy_user=None):
         """
@@ -901,23 +961,22 @@ class VC3ClientAPI(object):
                 raise PermissionDenied(policy_user + "is not the request owner")
             else:
 
+                # cloned cluster, its nodesets and the request go in one call, 
+                # so a failure cannot leave some of them behind.
                 try:
-                    if request.cluster:
-                        self.log.debug('Deleting cloned cluster template %s' % request.cluster)
-                        cluster = self.ic.getentity(Cluster, request.cluster)
-
-                    for nodeset in cluster.nodesets:
-                        try:
-                            self.log.debug('Deleting cloned nodeset %s' % nodeset)
-                            self.deleteNodeset(nodeset)
-                        except Exception, e:
-                            self.log.error('Could not delete cloned nodeset %s' % nodeset)
-                            raise e
-
-                    self.deleteCluster(request.cluster)
+                    with self.batch() as b:
+                        if request.cluster:
+                            self.log.debug('Deleting cloned cluster template %s', request.cluster)
+                            cluster = self.ic.getentity(Cluster, request.cluster)
+                            for nodeset in cluster.nodesets:
+                                self.log.debug('Deleting cloned nodeset %s', nodeset)
+                                b.deleteentity(Nodeset, nodeset)
+                            b.deleteentity(Cluster, request.cluster)
+                        b.deleteentity(Request, requestname)
                 except Exception, e:
-                    self.log.error('Could not delete cloned cluster %s' % request.cluster)
+                    self.log.error('Could not delete request %s with its cloned cluster %s' % (requestname, request.cluster))
                     raise e
+                return
 
         self.ic.deleteentity( Request, requestname)
 
@@ -1020,7 +1079,7 @@ class VC3ClientAPI(object):
                 buf   = StringIO.StringIO(self.decode(r.authconf))
                 cs = buf.read()
         else:
-            self.log.debug("No request with name %s" % requestname)
+            self.log.debug("No request with name %s", requestname)
         return cs
 
 
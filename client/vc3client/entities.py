@@ -80,7 +80,10 @@ class User(InfoEntity):
         self.sshpubstring = sshpubstring
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
+
+    def loaded(self):
+        self.allocations = []
 
 
     def addAllocation(self, allocation):
@@ -91,10 +94,10 @@ class User(InfoEntity):
         if self.allocations is None:
             self.allocations = []
 
-        self.log.debug("Adding allocation %s to project" % allocation)
+        self.log.debug("Adding allocation %s to project", allocation)
         if allocation not in self.allocations:
             self.allocations.append(allocation)
-        self.log.debug("Allocations now %s" % self.allocations)
+        self.log.debug("Allocations now %s", self.allocations)
         
 
     def removeAllocation(self, allocation):
@@ -105,12 +108,12 @@ class User(InfoEntity):
         if self.allocations is None:
             self.allocations = []
 
-        self.log.debug("Removing allocation %s to project" % allocation)
+        self.log.debug("Removing allocation %s to project", allocation)
         if allocation not in self.allocations:
             self.log.debug("Allocation %s did not belong to project")
         else:
             self.allocations.remove(allocation)
-            self.log.debug("Allocations now %s" % self.allocations)
+            self.log.debug("Allocations now %s", self.allocations)
 
 
 class Project(InfoEntity):
@@ -179,7 +182,15 @@ class Project(InfoEntity):
         self.url = url
         self.docurl = docurl
         self.organization = organization
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
+
+    def loaded(self):
+        if self.members is not None:
+            members = []
+            for m in self.members:
+                if m not in members:
+                    members.append(m)
+            object.__setattr__(self, 'members', members)
  
     def addUser(self, user):
         '''
@@ -188,12 +199,12 @@ class Project(InfoEntity):
         if self.members is None:
             self.members = []
 
-        self.log.debug("Adding user %s to project" % user)
+        self.log.debug("Adding user %s to project", user)
         if user not in self.members:
             ulist = self.members
             ulist.append(user)
             self.members = ulist
-        self.log.debug("Members now %s" % self.members)
+        self.log.debug("Members now %s", self.members)
         
 
     def removeUser(self, user):
@@ -203,14 +214,14 @@ class Project(InfoEntity):
         if self.members is None:
             self.members = []
 
-        self.log.debug("Removing user %s to project" % user)
+        self.log.debug("Removing user %s to project", user)
         if user not in self.members:
             self.log.debug("User %s did not belong to project")
         else:
             ulist = self.members
             ulist.remove(user)
             self.members = ulist
-            self.log.debug("Members now %s" % self.members)
+            self.log.debug("Members now %s", self.members)
 
     def addAllocation(self, allocation):
         '''
@@ -219,12 +230,12 @@ class Project(InfoEntity):
         if self.allocations is None:
             self.allocations = []
 
-        self.log.debug("Adding allocation %s to project" % allocation)
+        self.log.debug("Adding allocation %s to project", allocation)
         if allocation not in self.allocations:
             alist = self.allocations
             alist.append(allocation)
             self.allocations = alist
-        self.log.debug("Allocations now %s" % self.allocations)
+        self.log.debug("Allocations now %s", self.allocations)
         
 
     def removeAllocation(self, allocation):
@@ -234,14 +245,14 @@ class Project(InfoEntity):
         if self.allocations is None:
             self.allocations = []
 
-        self.log.debug("Removing allocation %s from project" % allocation)
+        self.log.debug("Removing allocation %s from project", allocation)
         if allocation not in self.allocations:
             self.log.debug("Allocation %s did not belong to project")
         else:
             alist = self.allocations
             alist.remove(allocation)
             self.allocations = alist
-            self.log.debug("Allocations now %s" % self.allocations)
+            self.log.debug("Allocations now %s", self.allocations)
 
 class Resource(InfoEntity):
     '''
@@ -338,7 +349,7 @@ class Resource(InfoEntity):
         self.pubtokendocurl = pubtokendocurl
         self.organization = organization
 
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 
 class Allocation(InfoEntity):
@@ -425,7 +436,7 @@ class Allocation(InfoEntity):
         self.sectype = sectype
         self.pubtoken = pubtoken
         self.privtoken = privtoken
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 class Policy(InfoEntity):
     '''
@@ -472,7 +483,7 @@ class Policy(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 
 class Nodeinfo(InfoEntity):
@@ -540,7 +551,7 @@ class Nodeinfo(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 class Nodeset(InfoEntity):
     '''
@@ -633,7 +644,7 @@ class Nodeset(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
    
       
@@ -692,7 +703,7 @@ class Cluster(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
     def addNodeset(self, nodesetname ):
         if self.nodesets is None:
@@ -710,7 +721,7 @@ class Cluster(InfoEntity):
 
 
         if nodesetname not in self.nodesets:
-            self.log.debug("Nodeset %s did not belong to Cluster" % nodesetname)
+            self.log.debug("Nodeset %s did not belong to Cluster", nodesetname)
         else:
             nlist = self.nodesets
             nlist.remove(nodesetname)
@@ -791,7 +802,7 @@ class Environment(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 
 class Request(InfoEntity):
@@ -907,7 +918,13 @@ class Request(InfoEntity):
         self.url = url
         self.docurl = docurl
         self.organization = organization
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
+
+    def loaded(self):
+        if self.allocations is None:
+            object.__setattr__(self, 'allocations', [])
+        if self.environments is None:
+            object.__setattr__(self, 'environments', [])
 
 
 class Provisioner(InfoEntity):
@@ -963,7 +980,7 @@ class Provisioner(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
 class PrivateToken(InfoEntity):
     '''
@@ -1009,7 +1026,7 @@ class PrivateToken(InfoEntity):
         self.displayname = displayname
         self.url = url
         self.docurl = docurl
-        self.log.debug("Entity created: %s" % self)
+        self.log.debug("Entity created: %s", self)
 
         
 if __name__ == '__main__':
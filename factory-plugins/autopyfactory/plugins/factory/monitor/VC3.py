@@ -51,12 +51,15 @@ from ConfigParser import SafeConfigParser
 
 from vc3client.client import VC3ClientAPI
 from vc3infoservice.infoclient import  InfoMissingPairingException, InfoConnectionFailure
+from vc3infoservice.core import ChangeTracker
 
 from autopyfactory.interfaces import MonitorInterface
 from autopyfactory.interfaces import _thread
 
 from libfactory.info import StatusInfo, IndexByKey, IndexByKeyRemap, Count, TotalRunningTimeFromRunningAndFinishedJobs, MissingKeyException
 
+# Request states nothing happens in until the request itself changes. 
+TERMINAL = ['terminated', 'failure']
 
 
 class _vc3(_thread, MonitorInterface):
@@ -85,6 +88,11 @@ class _vc3(_thread, MonitorInterface):
 
         self.vc3api = VC3ClientAPI(cp)
 
+        # Requests in a TERMINAL state are only updated again if they change or every 
+        # monitor.vc3.coldpasses cycles. 
+        coldpasses = config.generic_get('Factory', 'monitor.vc3.coldpasses', 'getint', default_value=10)
+        self.tracker = ChangeTracker(coldpasses)
+
         self.log.info('Factory monitor: Object initialized.')
 
 
@@ -183,9 +191,19 @@ class _vc3(_thread, MonitorInterface):
 
         try:
             requests_l = self.vc3api.listRequests()
+            self.tracker.newpass([ request.name for request in requests_l ])
             for request in requests_l:
+                fp = None
+                if request.state in TERMINAL:
+                    fp = ChangeTracker.fingerprint(request.state, request.action)
+                if not self.tracker.changed(request.name, fp):
+                    continue
                 self.log.info('Updating request = %s' %request.name)
                 self.updateRequest(request, processed_info_d)
+                if fp is not None:
+                    self.tracker.handled(request.name, fp, cold=True)
+                else:
+                    self.tracker.forget(request.name)
         except InfoConnectionFailure:
             self.log.warning('Could not connect to infoservice to update status of requests.')
 
@@ -270,10 +288,14 @@ class _vc3(_thread, MonitorInterface):
                 except MissingKeyException, ex:
                     self.log.warning('detected MissingKey Exception with content "%s". Continuing.' %ex)
 
-        request.statusraw = statusraw
+        if (request.statusraw or {}).get(factoryid) == statusraw[factoryid]:
+            self.log.debug('Status of request %s has not changed.' % request.name)
+            return
+
+        # only this factory's subtree is sent, so other factories' entries are kept
         self.log.info('Updating Request object %s with new info %s' % (request.name, 
-                                                                       request.statusraw))
-        self.vc3api.storeRequest(request)     
+                                                                       statusraw))
+        self.vc3api.patchRequest(request.name, ['statusraw', factoryid], statusraw[factoryid])
         
         self.log.debug('Leaving')
 
@@ -0,0 +1,94 @@
+#!/bin/env python
+#
+# Test of the infoservice change feed.
+#
+#   Stores, changes and deletes N entities through an InfoHandler with the Memory
+#   plugin, remembering MAXDELETED deleted names, and checks that:
+#     - getchanges() since a revision returns the entities changed and deleted after it,
+#     - the feed keeps no more than MAXDELETED deleted names,
+#     - a revision older than a forgotten deletion gets the whole document,
+#     - an entity stored again after its deletion is reported as changed,
+#     - getrevisions() returns the revisions getchanges() does.
+#
+#   Usage:  changestest.py [N]
+#
+import json
+import logging
+import sys
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.infoservice import InfoHandler
+
+MAXDELETED = 10
+
+
+def makehandler():
+    config = ConfigParser()
+    config.add_section('persistence')
+    config.set('persistence', 'plugin', 'Memory')
+    config.set('persistence', 'changes_deleted', str(MAXDELETED))
+    config.add_section('plugin-memory')
+    return InfoHandler(config)
+
+
+def store(ih, name, state):
+    ih.storeentity('request', name, json.dumps({ name : { 'name' : name, 'state' : state }}))
+
+
+def changes(ih, since):
+    return json.loads(ih.getchanges('request', since, 0))
+
+
+def check(label, ok):
+    print("%-60s %s" % (label, ok and 'OK' or 'FAIL'))
+    return ok
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    n = 100
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    ih = makehandler()
+    results = []
+
+    for i in range(n):
+        store(ih, 'request%d' % i, 'new')
+    first = changes(ih, 0)
+    results.append(check("since 0 gets the whole document", first['reset'] and len(first['changed']) == n))
+
+    rev = first['revision']
+    ih.mergeentity('request', 'request0', json.dumps({ 'request0' : { 'state' : 'running' }}))
+    ih.deleteentity('request', 'request1')
+    d = changes(ih, rev)
+    results.append(check("changes since a revision", not d['reset'] and d['changed'].keys() == ['request0']
+                                                     and d['deleted'] == ['request1']))
+
+    rev = d['revision']
+    for i in range(2, n):
+        ih.deleteentity('request', 'request%d' % i)
+    results.append(check("at most %d deleted names kept (%d)" % (MAXDELETED, len(ih.changes.deleted['request'])),
+                         len(ih.changes.deleted['request']) == MAXDELETED))
+    d = changes(ih, rev)
+    results.append(check("a revision before a forgotten deletion gets the document",
+                         d['reset'] and d['changed'].keys() == ['request0']))
+
+    recent = changes(ih, d['revision'] - MAXDELETED)
+    results.append(check("recent deletions are still reported (%d)" % len(recent['deleted']),
+                         not recent['reset'] and len(recent['deleted']) == MAXDELETED))
+
+    rev = d['revision']
+    store(ih, 'request%d' % (n - 1), 'new')
+    d = changes(ih, rev)
+    results.append(check("an entity stored again is reported as changed",
+                         d['changed'].keys() == ['request%d' % (n - 1)] and d['deleted'] == []
+                         and len(ih.changes.deleted['request']) == MAXDELETED - 1))
+
+    revisions = json.loads(ih.getrevisions(['request', 'user']))
+    results.append(check("revisions without the entities",
+                         revisions == { 'request' : d['revision'],
+                                        'user'    : json.loads(ih.getchanges('user', 0, 0))['revision'] }))
+
+    if not all(results):
+        sys.exit(1)
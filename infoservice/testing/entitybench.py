@@ -0,0 +1,161 @@
+#!/bin/env python
+#
+# Memory and time benchmark of InfoEntity objects.
+#
+#   Loads N request-like entities with objectFromDict(), changes one attribute on each
+#   and computes getDiffInfo(), with the current slot-based InfoEntity and with a copy
+#   of the previous dict-based one (per-object __dict__, _diffmap counters, __init__
+#   run for every loaded object). Memory is the size of the objects' own storage: the
+#   object, its __dict__, the change counters and the snapshot, not the shared values.
+#
+#   Usage:  entitybench.py [N] [rounds]
+#
+import hashlib
+import json
+import logging
+import random
+import sys
+import time
+
+from vc3infoservice.core import InfoEntity
+
+STATES = ['new', 'validated', 'configured', 'pending', 'running', 'terminating', 'terminated']
+ATTRIBUTES = ['name', 'state', 'owner', 'action', 'state_reason', 'expiration', 'project',
+              'queuesconf', 'authconf', 'statusraw', 'statusinfo', 'headnode', 'cluster',
+              'policy', 'allocations', 'environments', 'description', 'displayname', 'url',
+              'docurl', 'organization']
+
+
+class OldEntity(object):
+    '''
+    InfoEntity change tracking and loading as they were.
+    '''
+    infoattributes = []
+    intattributes = []
+
+    def __setattr__(self, name, value):
+        log = logging.getLogger()
+        if name in self.__class__.infoattributes:
+            try:
+                diffmap = self._diffmap
+            except AttributeError:
+                diffmap = {}
+                for at in self.__class__.infoattributes:
+                    diffmap[at] = 0
+                object.__setattr__(self,'_diffmap', diffmap)
+            diffmap[name] += 1
+        else:
+            log.debug('non-infoattribute %s', name)
+        object.__setattr__(self, name, value)
+
+    def getDiffInfo(self):
+        snapshot = self._snapshot
+        return [ a for a in self.__class__.infoattributes if self.fingerprint(getattr(self, a, None)) != snapshot.get(a) ]
+
+    def snapshot(self):
+        fp = {}
+        for a in self.__class__.infoattributes:
+            fp[a] = self.fingerprint(getattr(self, a, None))
+        object.__setattr__(self, '_snapshot', fp)
+
+    @classmethod
+    def fingerprint(cls, value):
+        return hashlib.md5(json.dumps(value, sort_keys=True)).digest()
+
+    @classmethod
+    def objectFromDict(cls, d):
+        log = logging.getLogger()
+        args = {}
+        for key in cls.infoattributes:
+            try:
+                args[key] = d[key]
+            except KeyError, e:
+                args[key] = None
+        eo = cls(**args)
+        eo.snapshot()
+        return eo
+
+
+def requestinit(self, **kw):
+    self.log = logging.getLogger()
+    for a in ATTRIBUTES:
+        setattr(self, a, kw.get(a))
+
+
+class OldRequest(OldEntity):
+    infokey = 'request'
+    infoattributes = ATTRIBUTES
+    __init__ = requestinit
+
+
+class NewRequest(InfoEntity):
+    infokey = 'request'
+    infoattributes = ATTRIBUTES
+    __init__ = requestinit
+
+
+def makedocs(n):
+    rnd = random.Random(0)
+    docs = []
+    for i in range(n):
+        name = 'request%d' % i
+        d = dict([ (a, None) for a in ATTRIBUTES ])
+        d.update({ 'name'         : name,
+                   'state'        : rnd.choice(STATES),
+                   'owner'        : 'user%d' % (i % 50),
+                   'project'      : 'project%d' % (i % 30),
+                   'cluster'      : 'cluster%d' % (i % 20),
+                   'allocations'  : [ 'user%d.resource%d' % (i % 50, j) for j in range(3) ],
+                   'environments' : [ 'env%d' % (i % 9) ],
+                   'statusraw'    : { 'factory1' : dict([ ('nodeset%d' % j, { 'running' : j, 'idle' : i % 5 }) for j in range(4) ]) },
+                   'queuesconf'   : 'x' * 2000,
+                   'authconf'     : 'y' * 1000,
+                   })
+        docs.append(d)
+    return docs
+
+
+def footprint(olist):
+    total = 0
+    for o in olist:
+        total += sys.getsizeof(o)
+        for a in ['__dict__', '_diffmap', '_snapshot']:
+            v = getattr(o, a, None)
+            if v is not None:
+                total += sys.getsizeof(v)
+    return total
+
+
+def run(klass, docs, rounds):
+    load = 0.0
+    diff = 0.0
+    for i in range(rounds):
+        start = time.time()
+        olist = [ klass.objectFromDict(d) for d in docs ]
+        load += time.time() - start
+        start = time.time()
+        for o in olist:
+            o.state = 'running'
+            o.getDiffInfo()
+        diff += time.time() - start
+    print("%-10s %5d entities  load %8.2fms  change+diff %8.2fms  storage %6d bytes/entity" % (klass.__name__,
+                                                                                              len(docs),
+                                                                                              1000.0 * load / rounds,
+                                                                                              1000.0 * diff / rounds,
+                                                                                              footprint(olist) / len(olist)))
+    return load + diff
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    n = 2000
+    rounds = 10
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    docs = makedocs(n)
+    old = run(OldRequest, docs, rounds)
+    new = run(NewRequest, docs, rounds)
+    print("speedup %.1fx" % (old / new))
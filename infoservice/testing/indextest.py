@@ -0,0 +1,108 @@
+#!/bin/env python
+#
+# Test and benchmark of the infoservice attribute indexes.
+#
+#   Fills a request key with N entities, changes them through the InfoHandler write
+#   calls, and checks that filtered queries answered from the indexes return the same as
+#   a full scan. Then times the queries both ways.
+#
+#   Usage:  indextest.py [plugin] [N]
+#
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.infoservice import InfoHandler
+
+STATES = ['new', 'validated', 'configured', 'pending', 'running', 'terminating', 'terminated']
+NQUERIES = 200
+
+
+def makehandler(plugin, tmpdir, indexes):
+    config = ConfigParser()
+    config.add_section('persistence')
+    config.set('persistence', 'plugin', plugin)
+    config.set('persistence', 'indexes', indexes)
+    psect = 'plugin-%s' % plugin.lower()
+    config.add_section(psect)
+    os.mkdir(tmpdir)
+    config.set(psect, 'filename', os.path.join(tmpdir, 'infoservice.%s' % plugin.lower()))
+    return InfoHandler(config)
+
+
+def fill(ih, n):
+    rnd = random.Random(0)
+    for i in range(n):
+        name = 'request%d' % i
+        ih.storeentity('request', name, json.dumps({ name : { 'name'    : name,
+                                                              'state'   : rnd.choice(STATES),
+                                                              'owner'   : 'user%d' % (i % 50),
+                                                              'members' : [ 'user%d' % (i % 7), 'user%d' % (i % 11) ],
+                                                              'statusraw' : 'x' * 200 }}))
+    # changes through every write path
+    for i in range(0, n, 3):
+        name = 'request%d' % i
+        ih.mergeentity('request', name, json.dumps({ name : { 'state' : rnd.choice(STATES) }}))
+    for i in range(1, n, 10):
+        ih.deleteentity('request', 'request%d' % i)
+    ops = []
+    for i in range(2, n, 10):
+        name = 'request%d' % i
+        ops.append({ 'op' : 'merge', 'key' : 'request', 'entityname' : name, 'data' : { name : { 'members' : [ 'user99' ] }}})
+    ih.batch(ops)
+
+
+def queries():
+    rnd = random.Random(1)
+    ql = []
+    for i in range(NQUERIES):
+        ql.append(rnd.choice([ [ 'state:%s' % rnd.choice(STATES) ],
+                               [ 'state:%s' % rnd.choice(STATES), 'owner:user%d' % rnd.randint(0, 49) ],
+                               [ 'members:user%d' % rnd.choice([1, 5, 99]) ],
+                               [ 'name:request%d' % rnd.randint(0, 10000) ],
+                               ]))
+    return ql
+
+
+def run(ih, ql):
+    start = time.time()
+    results = [ ih.querydocument('request', where, ['name', 'state']) for where in ql ]
+    return (results, time.time() - start)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    plugin = 'Memory'
+    n = 5000
+    if len(sys.argv) > 1:
+        plugin = sys.argv[1]
+    if len(sys.argv) > 2:
+        n = int(sys.argv[2])
+
+    ql = queries()
+    tmpdir = tempfile.mkdtemp(prefix='indextest')
+    try:
+        indexed = makehandler(plugin, os.path.join(tmpdir, 'a'), 'request.state, request.owner, request.members')
+        scanned = makehandler(plugin, os.path.join(tmpdir, 'b'), '')
+        fill(indexed, n)
+        fill(scanned, n)
+        (ir, it) = run(indexed, ql)
+        (sr, st) = run(scanned, ql)
+        ok = [ json.loads(a) for a in ir ] == [ json.loads(b) for b in sr ]
+        print("%-10s %s: %d queries over %d entities, indexed %.3fs, full scan %.3fs" % (plugin,
+                                                                                          ok and 'OK  ' or 'FAIL',
+                                                                                          NQUERIES, n, it, st))
+        for ih in [indexed, scanned]:
+            if hasattr(ih.persist, 'shutdown'):
+                ih.persist.shutdown()
+        if not ok:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,88 @@
+#!/bin/env python
+#
+# Benchmark of the JSON codecs for infoservice documents.
+#
+#   Builds a request document of N requests, each like the payloadbench entity (base64
+#   queuesconf/authconf) with a statusraw of several factories and nodesets, and times
+#   encoding and decoding it with every codec available here, the one picked by
+#   vc3infoservice.core first. The pretty-printed encoding DiskDump used to write on
+#   every store is timed as well. The statusraw timestamps and loads are floats that need
+#   17 significant digits, so a codec that rounds them shows as MISMATCH. Each JSON
+#   library found is also put through jsonroundtrips(), which vc3infoservice.core uses
+#   to leave out libraries that change floats or text.
+#
+#   Usage:  jsonbench.py [N] [rounds]
+#
+import importlib
+import json
+import logging
+import sys
+import time
+
+from vc3infoservice.core import JSONCODECS, JSONCODEC, jsonpretty, jsonroundtrips
+
+from payloadbench import makeentity, BENCHENTITY
+
+NFACTORIES = 3
+NNODESETS = 4
+
+
+def makedocument(n):
+    template = makeentity()[BENCHENTITY]
+    doc = {}
+    for i in range(n):
+        name = 'request%d' % i
+        e = dict(template)
+        e.update({ 'name'         : name,
+                   'owner'        : 'user%d' % (i % 50),
+                   'cluster'      : 'cluster%d' % (i % 20),
+                   'project'      : 'project%d' % (i % 30),
+                   'allocations'  : [ 'user%d.resource%d' % (i % 50, j) for j in range(3) ],
+                   'environments' : [ 'env%d' % (i % 9) ],
+                   'headnode'     : 'request%d-headnode' % i,
+                   'statusraw'    : dict([ ('factory%d' % f,
+                                            dict([ ('nodeset%d' % s, { 'running' : s, 'idle' : i % 5, 'error' : 0,
+                                                                       'node_number' : 10, 'requested' : 10,
+                                                                       'timestamp' : 1500000000.1 + i,
+                                                                       'load'      : 0.1 * s + 0.2 })
+                                                   for s in range(NNODESETS) ]))
+                                          for f in range(NFACTORIES) ]),
+                   })
+        doc[name] = e
+    return { 'request' : doc }
+
+
+def timeit(label, rounds, f):
+    start = time.time()
+    for i in range(rounds):
+        r = f()
+    return (time.time() - start, r)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    n = 200
+    rounds = 20
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    for (name, encode, decode) in [ ('ujson', 'dumps', 'loads'), ('simplejson', 'dumps', 'loads') ]:
+        try:
+            m = importlib.import_module(name)
+        except ImportError:
+            continue
+        print("%-12s round trip of floats and text %s" % (name, jsonroundtrips(getattr(m, encode), getattr(m, decode))
+                                                           and 'OK' or 'MISMATCH, not used'))
+
+    doc = makedocument(n)
+    print("document of %d requests, codec in use: %s" % (n, JSONCODEC))
+    (pt, pretty) = timeit('pretty', rounds, lambda: jsonpretty(doc))
+    print("%-12s encode %8.2fms %9d bytes" % ('pretty', 1000.0 * pt / rounds, len(pretty)))
+    for (name, encode, decode) in JSONCODECS:
+        (et, jd) = timeit(name, rounds, lambda: encode(doc))
+        (dt, d) = timeit(name, rounds, lambda: decode(jd))
+        ok = d == doc and json.loads(jd) == doc
+        print("%-12s encode %8.2fms %9d bytes  decode %8.2fms  %s" % (name, 1000.0 * et / rounds, len(jd),
+                                                                        1000.0 * dt / rounds, ok and 'OK' or 'MISMATCH'))
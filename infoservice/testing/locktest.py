@@ -0,0 +1,123 @@
+#!/bin/env python
+#
+# Stress test for infoservice locking.
+#
+#   Hammers InfoHandler.mergeentity() from many threads, each thread updating its own
+#   attribute of one shared entity, and checks that no update was lost. Run once per
+#   persistence plugin.
+#
+#   Usage:  locktest.py [plugin1 plugin2 ...]     (default: all plugins)
+#
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.core import KeyLockManager
+from vc3infoservice.infoservice import InfoHandler
+
+NTHREADS = 30
+NMERGES = 200
+PLUGINS = ['Memory', 'DiskDump', 'Journal', 'SQLite']
+
+
+def makehandler(plugin, tmpdir):
+    config = ConfigParser()
+    config.add_section('persistence')
+    config.set('persistence', 'plugin', plugin)
+    psect = 'plugin-%s' % plugin.lower()
+    config.add_section(psect)
+    config.set(psect, 'filename', os.path.join(tmpdir, 'infoservice.%s' % plugin.lower()))
+    return InfoHandler(config)
+
+
+def mergetest(plugin):
+    tmpdir = tempfile.mkdtemp(prefix='locktest')
+    try:
+        ih = makehandler(plugin, tmpdir)
+        ih.storeentity('request', 'vc', json.dumps({ 'vc' : { 'name' : 'vc' }}))
+
+        def worker(i):
+            for j in range(NMERGES):
+                ih.mergeentity('request', 'vc', json.dumps({ 'vc' : { 't%d' % i : j }}))
+                # readers of the same and of other keys run alongside the writers
+                json.loads(ih.getentity('request', 'vc'))
+                ih.getdocument('nodes')
+
+        start = time.time()
+        threads = [ threading.Thread(target=worker, args=(i,)) for i in range(NTHREADS) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        final = json.loads(ih.getentity('request', 'vc'))
+        lost = [ i for i in range(NTHREADS) if final.get('t%d' % i) != NMERGES - 1 ]
+        if lost:
+            print("%-10s FAIL: updates lost for threads %s" % (plugin, lost))
+        else:
+            print("%-10s OK:   %d merges in %.2fs" % (plugin, NTHREADS * NMERGES, elapsed))
+        return not lost
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def keylocktest():
+    '''
+    Read-modify-write of a counter under the write lock, plus a check that a reader of one
+    key does not block a writer of another.
+    '''
+    locks = KeyLockManager()
+    store = { 'count' : 0 }
+
+    def increment():
+        for j in range(NMERGES):
+            locks.acquire_write('request')
+            try:
+                n = store['count']
+                time.sleep(0)
+                store['count'] = n + 1
+            finally:
+                locks.release_write('request')
+
+    threads = [ threading.Thread(target=increment) for i in range(NTHREADS) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ok = store['count'] == NTHREADS * NMERGES
+
+    locks.acquire_read('request')
+    done = threading.Event()
+    def otherkey():
+        locks.acquire_write('nodes')
+        locks.release_write('nodes')
+        done.set()
+    threading.Thread(target=otherkey).start()
+    parallel = done.wait(5)
+    locks.release_read('request')
+
+    print("%-10s %s: counter %d/%d, other key writable while read-locked: %s" % ('KeyLock',
+                                                                                   ok and parallel and 'OK  ' or 'FAIL',
+                                                                                   store['count'],
+                                                                                   NTHREADS * NMERGES,
+                                                                                   parallel))
+    return ok and parallel
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    plugins = sys.argv[1:] or PLUGINS
+    results = [ keylocktest() ]
+    for p in plugins:
+        results.append(mergetest(p))
+    if not all(results):
+        sys.exit(1)
@@ -0,0 +1,102 @@
+#!/bin/env python
+#
+# Benchmark of log formatting cost in InfoClient.listentities().
+#
+#   Lists N request-like entities with debug logging off, once through the current
+#   listentities() (lazy log arguments, per-entity lines guarded by isEnabledFor) and
+#   once through a copy of the previous loop, which built every message with '%' before
+#   handing it to the logger. The document is served from memory, so the times are the
+#   client-side cost only.
+#
+#   Usage:  logbench.py [N] [rounds]
+#
+import logging
+import random
+import sys
+import time
+
+from vc3infoservice.core import InfoEntity
+from vc3infoservice.infoclient import InfoClient
+
+STATES = ['new', 'validated', 'configured', 'pending', 'running', 'terminating', 'terminated']
+
+
+class BenchRequest(InfoEntity):
+    infokey = 'request'
+    infoattributes = ['name', 'state', 'owner', 'members', 'cluster', 'statusraw', 'queuesconf']
+    intattributes = []
+    validvalues = {}
+
+    def __init__(self, name, state, owner, members, cluster, statusraw, queuesconf):
+        self.log = logging.getLogger()
+        self.name = name
+        self.state = state
+        self.owner = owner
+        self.members = members
+        self.cluster = cluster
+        self.statusraw = statusraw
+        self.queuesconf = queuesconf
+
+
+def makedoc(n):
+    rnd = random.Random(0)
+    doc = {}
+    for i in range(n):
+        name = 'request%d' % i
+        doc[name] = { 'name'       : name,
+                      'state'      : rnd.choice(STATES),
+                      'owner'      : 'user%d' % (i % 50),
+                      'members'    : [ 'user%d' % (i % 7), 'user%d' % (i % 11) ],
+                      'cluster'    : 'cluster%d' % (i % 20),
+                      'statusraw'  : { 'factory1' : { 'nodeset%d' % j : { 'running' : j, 'idle' : i % 5 } for j in range(4) } },
+                      'queuesconf' : 'x' * 2000,
+                      }
+    return doc
+
+
+def eagerlist(ic, klass):
+    '''
+    listentities() as it was, formatting each message before the level check.
+    '''
+    infokey = klass.infokey
+    ic.log.debug("Listing class %s with infokey %s " % (klass.__name__, infokey))
+    docobj = ic.getdocumentdict(infokey)
+    ic.log.debug("Got document object: %s " % docobj)
+    olist = []
+    for oname in docobj.keys():
+        ic.log.debug("Getting objectname %s" % oname)
+        ed = docobj[oname]
+        eo = klass.objectFromDict(ed)
+        ic.log.debug("Appending eo %s" % eo)
+        olist.append(eo)
+    return olist
+
+
+def timeit(label, rounds, f):
+    start = time.time()
+    for i in range(rounds):
+        olist = f()
+    elapsed = time.time() - start
+    print("%-8s %4d rounds of %5d entities %8.3fs %8.2fms/round" % (label, rounds, len(olist),
+                                                                     elapsed, 1000.0 * elapsed / rounds))
+    return elapsed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    n = 1000
+    rounds = 20
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    doc = makedoc(n)
+    # An InfoClient that never touches the network; only listentities() is exercised.
+    ic = InfoClient.__new__(InfoClient)
+    ic.log = logging.getLogger()
+    ic.getdocumentdict = lambda key: doc
+
+    e = timeit('eager', rounds, lambda: eagerlist(ic, BenchRequest))
+    l = timeit('lazy', rounds, lambda: ic.listentities(BenchRequest))
+    print("speedup %.1fx" % (e / l))
@@ -4,8 +4,11 @@
 #
 #
 
+import copy
 import logging
 import pprint
+import sys
+import time
 
 class InfoHandler(object):
     '''
@@ -90,6 +93,83 @@ class InfoHandler(object):
             return dest
 
 
+    def recursivemerge(self, src, dest):
+            ''' 
+            InfoHandler.merge() as it was before the iterative rewrite, for comparison. 
+            '''
+            key = None
+            self.log.debug("Handling merging %s into %s " % (src, dest))
+            try:
+                if dest is None or isinstance(dest, str) or isinstance(dest, unicode) or isinstance(dest, int) \
+                             or isinstance(dest, long) or isinstance(dest, float):
+                    dest = src
+                elif isinstance(dest, list):
+                    if isinstance(src, list):
+                        for item in src:
+                            if item not in dest:
+                                dest.append(item)
+                    else:
+                        self.log.error("Refusing to add non-list %s to list %s" % (src, dest))
+                elif isinstance(dest, dict):
+                    if isinstance(src, dict):
+                        for key in src:
+                            if key in dest:
+                                dest[key] = self.recursivemerge(src[key], dest[key])
+                            else:
+                                dest[key] = src[key]
+                    elif src is None:
+                        dest = None
+                    else:
+                        self.log.warning("Cannot merge non-dict %s into dict %s" % (src, dest))
+                else:
+                    raise Exception('NOT IMPLEMENTED "%s" into "%s"' % (src, dest))
+            except TypeError, e:
+                raise Exception('TypeError "%s" in key "%s" when merging "%s" into "%s"' % (e, key, src, dest))
+            return dest
+
+    def mergebench(self, nentities=2000, nmembers=500):
+        '''
+        Times recursivemerge() against the current InfoHandler.merge() merging a document 
+        of <nentities> entities, each with member lists of <nmembers>, into one with 
+        overlapping lists, and checks that both give the same result. 
+        '''
+        from vc3infoservice.infoservice import InfoHandler as ServiceHandler
+
+        dest = {}
+        src = {}
+        for i in range(nentities):
+            name = 'project%d' % i
+            dest[name] = { 'name'    : name,
+                           'owner'   : 'user%d' % i,
+                           'members' : [ 'user%d' % j for j in range(nmembers) ],
+                           'allocations' : [ 'user%d.resource%d' % (j, j % 10) for j in range(nmembers / 10) ],
+                           'statusraw' : { 'factory1' : { 'nodeset%d' % j : { 'running' : j } for j in range(10) } },
+                           }
+            src[name] = { 'state'   : 'validated',
+                          'members' : [ 'user%d' % j for j in range(nmembers / 2, nmembers + nmembers / 2) ],
+                          'statusraw' : { 'factory2' : { 'nodeset0' : { 'running' : 1 } } },
+                          }
+        # no persistence needed, only merge() and its logger
+        sh = ServiceHandler.__new__(ServiceHandler)
+        sh.log = self.log
+
+        (s1, d1) = (copy.deepcopy(src), copy.deepcopy(dest))
+        start = time.time()
+        r1 = self.recursivemerge(s1, d1)
+        told = time.time() - start
+
+        (s2, d2) = (copy.deepcopy(src), copy.deepcopy(dest))
+        start = time.time()
+        r2 = sh.merge(s2, d2)
+        tnew = time.time() - start
+
+        print("%d entities, %d members: recursive %.3fs, iterative %.3fs, speedup %.1fx, same result: %s" % (nentities,
+                                                                                                               nmembers,
+                                                                                                               told,
+                                                                                                               tnew,
+                                                                                                               told / tnew,
+                                                                                                               r1 == r2))
+
     def mergetest(self):
         '''
     
@@ -161,8 +241,14 @@ if __name__ == '__main__':
     FORMAT='%(asctime)s (UTC) [ %(levelname)s ] %(name)s %(filename)s:%(lineno)d %(funcName)s(): %(message)s'
     logging.basicConfig(format=FORMAT)
     log = logging.getLogger()
-    log.setLevel(logging.DEBUG)
     ih = InfoHandler()
-    ih.mergetest()
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        # Usage: mergetest.py bench [nentities [nmembers]]
+        log.setLevel(logging.WARNING)
+        args = [ int(a) for a in sys.argv[2:4] ]
+        ih.mergebench(*args)
+    else:
+        log.setLevel(logging.DEBUG)
+        ih.mergetest()
     
     
\ No newline at end of file
@@ -0,0 +1,109 @@
+#!/bin/env python
+#
+# Benchmark of PUT/POST payload transports.
+#
+#   Builds a request entity with base64 queuesconf/authconf blobs, the largest kind the
+#   master stores, and compares the bytes sent when the JSON goes URL-encoded in the
+#   query string (the old transport), as request body, and as gzip-compressed body.
+#
+#   If an infoclient config file is given, also times merges of that entity against a
+#   running infoservice with each transport.
+#
+#   Usage:  payloadbench.py [infoclient.conf] [N]
+#
+import base64
+import json
+import logging
+import random
+import sys
+import time
+import urllib
+import zlib
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.infoclient import InfoClient
+from vc3infoservice.core import InfoEntityExistsException
+
+BENCHKEY = 'benchmark'
+BENCHENTITY = 'payloadbench'
+NSECTIONS = 40
+
+
+def makeentity():
+    rnd = random.Random(0)
+    queues = []
+    auth = []
+    for i in range(NSECTIONS):
+        queues.append('''[%s-nodeset%d-allocation%d]
+enabled = True
+vc3.queue.name = %s-nodeset%d
+batchsubmitplugin = CondorSSHRemoteManager
+batchsubmit.condorsshremotemanager.user = user%d
+batchsubmit.condorsshremotemanager.batch = slurm
+executable.arguments = --server=%s.virtualclusters.org:9618 --collector-timeout 60 --worker-timeout 600
+sched.keepnrunning.keep_running = %d
+''' % (BENCHENTITY, i, i, BENCHENTITY, i, i, BENCHENTITY, i * 3))
+        auth.append('''[allocation%d]
+plugin = SSH
+type = ssh-rsa
+privatekey = %s
+''' % (i, base64.b64encode(''.join([ chr(rnd.randint(0, 255)) for j in range(1200) ]))))
+    return { BENCHENTITY : { 'name'       : BENCHENTITY,
+                             'state'      : 'running',
+                             'queuesconf' : base64.b64encode(''.join(queues)),
+                             'authconf'   : base64.b64encode(''.join(auth)),
+                             }}
+
+
+def gzipped(s):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(s) + c.flush()
+
+
+def sizes(jdoc):
+    query = urllib.urlencode({ 'data' : jdoc })
+    print("%-24s %9d bytes" % ('query parameter', len(query)))
+    print("%-24s %9d bytes" % ('request body', len(jdoc)))
+    print("%-24s %9d bytes" % ('gzip request body', len(gzipped(jdoc))))
+
+
+def timeit(label, n, f):
+    start = time.time()
+    for i in range(n):
+        r = f()
+        if r.status_code != 200:
+            raise Exception("%s: HTTP status %d" % (label, r.status_code))
+    elapsed = time.time() - start
+    print("%-24s %6d calls %8.3fs %8.2fms/call" % (label, n, elapsed, 1000.0 * elapsed / n))
+
+
+def live(conffile, n, entity):
+    cp = ConfigParser()
+    cp.read(conffile)
+    ic = InfoClient(cp)
+    try:
+        ic._storeentitydict(BENCHKEY, entity)
+    except InfoEntityExistsException:
+        pass
+
+    u = "https://%s:%s/info?key=%s&entityname=%s" % (ic.infohost, ic.httpsport, BENCHKEY, BENCHENTITY)
+    jdoc = json.dumps(entity)
+    timeit('query parameter', n, lambda: ic.session.put(u, params={ 'data' : jdoc }))
+    ic.compress = False
+    timeit('request body', n, lambda: ic.session.put(u, **ic._body(jdoc)))
+    ic.compress = True
+    timeit('gzip request body', n, lambda: ic.session.put(u, **ic._body(jdoc)))
+
+    ic.deleteentity(type('Bench', (object,), { 'infokey' : BENCHKEY }), BENCHENTITY)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    entity = makeentity()
+    sizes(json.dumps(entity))
+    if len(sys.argv) > 1:
+        n = 50
+        if len(sys.argv) > 2:
+            n = int(sys.argv[2])
+        live(sys.argv[1], n, entity)
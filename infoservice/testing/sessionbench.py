@@ -0,0 +1,67 @@
+#!/bin/env python
+#
+# Benchmark of connection reuse in InfoClient.
+#
+#   Against a running infoservice (e.g. a local CherryPy instance started with
+#   etc/vc3-infoservice.conf), fetches the same entity N times with a new connection
+#   per call, as InfoClient used to, and N times through InfoClient's shared session.
+#   The difference is mostly the TCP connect and mutual-TLS handshake.
+#
+#   Usage:  sessionbench.py [infoclient.conf] [N]
+#
+
+import json
+import logging
+import os
+import sys
+import time
+
+import requests
+from ConfigParser import ConfigParser
+
+from vc3infoservice.infoclient import InfoClient
+from vc3infoservice.core import InfoEntityExistsException
+
+BENCHKEY = 'benchmark'
+BENCHENTITY = 'sessionbench'
+
+
+def timeit(label, n, f):
+    start = time.time()
+    for i in range(n):
+        r = f()
+        if r.status_code not in [200, 304]:
+            raise Exception("%s: HTTP status %d" % (label, r.status_code))
+    elapsed = time.time() - start
+    print("%-32s %6d calls %8.3fs %8.2fms/call" % (label, n, elapsed, 1000.0 * elapsed / n))
+    return elapsed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    conffile = os.path.expanduser("~/git/vc3-infoservice/etc/vc3-infoclient.conf")
+    n = 200
+    if len(sys.argv) > 1:
+        conffile = sys.argv[1]
+    if len(sys.argv) > 2:
+        n = int(sys.argv[2])
+
+    cp = ConfigParser()
+    cp.read(conffile)
+    ic = InfoClient(cp)
+
+    try:
+        ic._storeentitydict(BENCHKEY, { BENCHENTITY : { 'name' : BENCHENTITY, 'state' : 'new' }})
+    except InfoEntityExistsException:
+        pass
+
+    u = "https://%s:%s/info?key=%s&entityname=%s" % (ic.infohost, ic.httpsport, BENCHKEY, BENCHENTITY)
+    cert = (ic.certfile, ic.keyfile)
+
+    fresh = timeit('new connection per call', n,
+                   lambda: requests.get(u, verify=ic.chainfile, cert=cert))
+    pooled = timeit('shared session (keep-alive)', n,
+                    lambda: ic.session.get(u))
+    print("speedup: %.1fx" % (fresh / pooled))
+
+    ic.deleteentity(type('Bench', (object,), { 'infokey' : BENCHKEY }), BENCHENTITY)
@@ -9,9 +9,70 @@ __maintainer__ = "John Hover"
 __email__ = "jhover@bnl.gov"
 __status__ = "Production"
 
+import hashlib
+import json
 import logging
 import random
 import string
+import threading
+import time
+
+from collections import OrderedDict
+
+# Module logger, looked up once rather than on every attribute assignment.
+log = logging.getLogger()
+
+# Values InfoEntity.fingerprint() takes as they are. 
+SCALARTYPES = (basestring, bool, int, long, float)
+FINGERPRINTENCODER = json.JSONEncoder(sort_keys=True)
+
+
+# Value a JSON library must encode to a str and decode back unchanged to be used: 
+# floats that need 17 significant digits, and non-ASCII text. 
+JSONCHECK = { 'floats' : [ 0.30000000000000004, 1.0 / 3, 1500000000.25, 1e-07 ],
+              'text'   : u'caf\u00e9 \u4e2d',
+              'others' : [ None, True, 0, -1, 2 ** 40 ] }
+
+def jsonroundtrips(encode, decode):
+    try:
+        jd = encode(JSONCHECK)
+        return isinstance(jd, str) and decode(jd) == JSONCHECK
+    except Exception:
+        return False
+
+def _jsoncodecs():
+    '''
+    Returns list of (name, encode, decode) for the JSON libraries that can be 
+    imported and pass jsonroundtrips(), fastest first. The standard library json 
+    is always last. 
+    '''
+    codecs = []
+    try:
+        import ujson
+        codecs.append(('ujson', ujson.dumps, ujson.loads))
+    except ImportError:
+        pass
+    try:
+        import simplejson
+        from simplejson import _speedups
+        codecs.append(('simplejson', simplejson.JSONEncoder(separators=(',', ':')).encode, simplejson.loads))
+    except ImportError:
+        pass
+    for (name, encode, decode) in list(codecs):
+        if not jsonroundtrips(encode, decode):
+            log.debug("JSON library %s does not keep floats or text unchanged, not used.", name)
+            codecs.remove((name, encode, decode))
+    codecs.append(('json', json.JSONEncoder(separators=(',', ':')).encode, json.loads))
+    return codecs
+
+# JSON codec used for documents by InfoHandler, InfoClient and the persistence plugins. 
+# Encoding is compact; jsonpretty() is for output meant to be read. Decode errors are 
+# ValueError, whichever library is used.  
+JSONCODECS = _jsoncodecs()
+(JSONCODEC, jsonencode, jsondecode) = JSONCODECS[0]
+
+def jsonpretty(obj):
+    return json.dumps(obj, sort_keys=True, indent=4, separators=(',', ': '))
 
 class InfoConnectionFailure(Exception):
     '''
@@ -69,15 +130,13 @@ class InfoAttributeFacade(object):
    
     '''
     def __init__(self, parent, attrname):
-        log = logging.getLogger()  
         object.__setattr__(self, '_parent', parent)
         object.__setattr__(self, '_attrname', attrname)
-        log.debug("Facade made for attribute %s parent %s" % (attrname, parent))
+        log.debug("Facade made for attribute %s parent %s", attrname, parent)
 
     def __setattr__(self, name, value):
         '''
         '''
-        log = logging.getLogger()        
         if name in self.__class__.infoattributes:
             try:
                 diffmap = self._diffmap
@@ -87,9 +146,9 @@ class InfoAttributeFacade(object):
                     diffmap[at] = 0
                 object.__setattr__(self,'_diffmap', diffmap)
             diffmap[name] += 1
-            log.debug('infoattribute %s incremented to %s' % ( name, diffmap[name] ) )            
+            log.debug('infoattribute %s incremented to %s', name, diffmap[name])            
         else:
-            log.debug('non-infoattribute %s' % name)
+            log.debug('non-infoattribute %s', name)
         object.__setattr__(self, name, value)
 
     def __getattr__(self, attrname):
@@ -98,12 +157,40 @@ class InfoAttributeFacade(object):
 
 
 
+class InfoEntityType(type):
+    '''
+    Metaclass for InfoEntity. Gives every entity class a __slots__ entry for each of its
+    info attributes, so instances hold their values in fixed slots rather than a 
+    per-object dict, and a map from info attribute to its bit in the change masks. 
+    
+    A class that defines __slots__ itself is left as it is. Attributes that are not 
+    info attributes still work, through the __dict__ slot of InfoEntity, which is only
+    allocated for objects that use one. 
+    '''
+    def __new__(mcs, name, bases, namespace):
+        if '__slots__' not in namespace:
+            infoattributes = namespace.get('infoattributes')
+            if infoattributes is None:
+                infoattributes = getattr(bases[0], 'infoattributes', [])
+            taken = set()
+            for b in bases:
+                for k in b.__mro__:
+                    taken.update(getattr(k, '__slots__', ()))
+            namespace['__slots__'] = tuple([ a for a in infoattributes if a not in taken and a not in namespace ])
+        cls = type.__new__(mcs, name, bases, namespace)
+        cls._attrbits = dict([ (a, 1 << i) for (i, a) in enumerate(cls.infoattributes) ])
+        return cls
+
+
 class InfoEntity(object):
     '''
     Template for Information entities. Common functions. 
     Classes that inherit from InfoEntity must set class variables to describe handling. 
 
     '''
+    __metaclass__ = InfoEntityType
+    __slots__ = ('log', 'storenew', '_setbits', '_dirtybits', '_snapshot', '__dict__', '__weakref__')
+
     infokey = 'unset'
     infoattributes = []
     intattributes = []
@@ -112,21 +199,17 @@ class InfoEntity(object):
 
     def __setattr__(self, name, value):
         '''
-        _difflist   List of (info)attributes that have been changed (not just 
-                    initialized once.  
+        _setbits    Bitmask of info attributes set at least once. 
+        _dirtybits  Bitmask of info attributes that have been changed (not just 
+                    initialized once).  
         '''
-        log = logging.getLogger()        
-        if name in self.__class__.infoattributes:
-            try:
-                diffmap = self._diffmap
-            except AttributeError:
-                diffmap = {}
-                for at in self.__class__.infoattributes:
-                    diffmap[at] = 0
-                object.__setattr__(self,'_diffmap', diffmap)
-            diffmap[name] += 1
-        else:
-            log.debug('non-infoattribute %s' % name)
+        bit = self._attrbits.get(name)
+        if bit is not None:
+            setbits = getattr(self, '_setbits', 0)
+            if setbits & bit:
+                object.__setattr__(self, '_dirtybits', getattr(self, '_dirtybits', 0) | bit)
+            else:
+                object.__setattr__(self, '_setbits', setbits | bit)
         object.__setattr__(self, name, value)
 
     #def __getattr__(self, name):
@@ -152,17 +235,19 @@ class InfoEntity(object):
 
     def getDiffInfo(self):
         '''
-        Return a list of info attributes which have been set > 1 time. 
+        Return a list of info attributes whose value changed since the entity was 
+        loaded or last stored, or, for entities not loaded from the infoservice, 
+        which have been set > 1 time. 
         '''
-        retlist = []
         try:
-            diffmap = self._diffmap
+            snapshot = self._snapshot
         except AttributeError:
-            pass
-        for a in diffmap.keys():
-            if diffmap[a] > 1:
-                retlist.append(a)
-        return retlist
+            snapshot = None
+        if snapshot is not None:
+            return [ a for a in self.__class__.infoattributes if self.fingerprint(getattr(self, a, None)) != snapshot.get(a) ]
+
+        dirtybits = getattr(self, '_dirtybits', 0)
+        return [ a for a in self.__class__.infoattributes if dirtybits & self._attrbits[a] ]
 
         
     def __repr__(self):
@@ -197,11 +282,31 @@ class InfoEntity(object):
             self.log.debug("newonly not set, doing all values...")
             for attrname in self.infoattributes:
                 d[self.name][attrname] = getattr(self, attrname)
-        self.log.debug("Returning dict: %s" % d)
+        self.log.debug("Returning dict: %s", d)
         return d    
 
+    def snapshot(self):
+        '''
+        Records a fingerprint of each info attribute value, against which getDiffInfo()
+        tells real changes, including changes made in place to list or dict values. 
+        '''
+        fp = {}
+        for a in self.__class__.infoattributes:
+            fp[a] = self.fingerprint(getattr(self, a, None))
+        object.__setattr__(self, '_snapshot', fp)
+
+    @classmethod
+    def fingerprint(cls, value):
+        '''
+        Plain values are their own fingerprint. Lists and dicts, which can be changed
+        in place, are fingerprinted by a digest of their sorted JSON. 
+        '''
+        if value is None or isinstance(value, SCALARTYPES):
+            return value
+        return (hashlib.md5(FINGERPRINTENCODER.encode(value)).digest(),)
+
     def setState(self, newstate):
-        self.log.debug("%s object name=%s %s ->%s" % (self.__class__.__name__, self.name, self.state, newstate) )
+        self.log.debug("%s object name=%s %s ->%s", self.__class__.__name__, self.name, self.state, newstate)
         self.state = newstate
     
 
@@ -220,13 +325,17 @@ class InfoEntity(object):
         #resources = infoclient.getdocumentobject(key=keystr)
         if hasattr(self, 'storenew'):
             entdict = self.makeDictObject(newonly=False)
-            self.log.debug("Dict obj: %s" % entdict)
+            self.log.debug("Dict obj: %s", entdict)
             infoclient._storeentitydict(keystr, entdict )
         else:
             entdict = self.makeDictObject(newonly=True)
-            self.log.debug("Dict obj: %s" % entdict)
+            if not entdict[self.name]:
+                self.log.debug("No attribute of %s %s changed. Nothing to store.", self.__class__.__name__, self.name)
+                return
+            self.log.debug("Dict obj: %s", entdict)
             infoclient._mergeentitydict(keystr, entdict )
-        self.log.debug("Stored entity %s in key %s" % (self.name, keystr))
+        self.snapshot()
+        self.log.debug("Stored entity %s in key %s", self.name, keystr)
 
     def addAcl(self, aclstring):
         pass    
@@ -238,17 +347,17 @@ class InfoEntity(object):
         '''
         Make new identical object with new name attribute. 
         '''
-        self.log.debug("making clone of %s object name=%s " % (self.__class__.__name__, self.name) )
+        self.log.debug("making clone of %s object name=%s ", self.__class__.__name__, self.name)
         dictobject = self.makeDictObject()  # has name as index of attribute dict
         dict = dictobject[self.name]
         if newname is not None:
             dict['name'] = newname
         else:
             dict['name'] = self.generateName()
-        self.log.debug('new dict is %s' % dict)    
+        self.log.debug('new dict is %s', dict)    
         newobj = self.__class__.objectFromDict(dict)
         newobj.storenew = True
-        self.log.debug('new object is %s' % newobj)
+        self.log.debug('new object is %s', newobj)
         return newobj
     
     
@@ -259,10 +368,10 @@ class InfoEntity(object):
         '''
         self.log.debug("Generating name...")
         randomstr = InfoEntity.randomChars(length)
-        self.log.debug("Got random part %s" % randomstr)
+        self.log.debug("Got random part %s", randomstr)
         newname = ""
         for na in self.__class__.nameattributes:
-            self.log.debug("Building name with %s " % na)
+            self.log.debug("Building name with %s ", na)
             newname += InfoEntity.normalizeAttribute(getattr(self, na))
         newname += "-%s" % randomstr
         return newname
@@ -279,56 +388,445 @@ class InfoEntity(object):
             }
 
         '''
-        log = logging.getLogger()
         log.debug("Making object from dictionary...")
         #name = dict.keys()[0]
         #d = dict[name]
         d = dict
-        args = {}
+        eo = cls.__new__(cls)
+        setslot = object.__setattr__
         for key in cls.infoattributes:
             try:
-                args[key] = d[key]
+                value = d[key]
             except KeyError, e:
-                args[key] = None
-                log.warning("Document object does not have a '%s' key" % e.args[0])
+                value = None
+                log.warning("Document object does not have a '%s' key", e.args[0])
+            setslot(eo, key, value)
         for key in cls.intattributes:
-            try:
-                if args[key] is not None:
-                    args[key] = int(args[key])
-            except KeyError, e:
-                log.warning("Document object does not have a '%s' key" % e.args[0])
-        eo = cls(**args)
+            value = getattr(eo, key, None)
+            if value is not None:
+                setslot(eo, key, int(value))
+        setslot(eo, 'log', log)
+        setslot(eo, '_setbits', (1 << len(cls.infoattributes)) - 1)
+        eo.loaded()
+        eo.snapshot()
         log.debug("Successfully made object from dictionary, returning...")
         return eo
+
+    def loaded(self):
+        '''
+        Called on objects made by objectFromDict(), which sets the info attributes 
+        directly and does not run __init__. Classes whose __init__ does more than 
+        assign its arguments override this to do the same for loaded objects. 
+        '''
+        pass
     
     @classmethod
     def randomChars(cls, length=5):
-        log = logging.getLogger()
         log.debug("Generating random chars...")
         randomstr = ''.join([random.choice(string.ascii_lowercase) for n in xrange(length)])
         return randomstr
         
     @classmethod
     def normalizeAttribute(cls, value):
-        log = logging.getLogger()
-        log.debug("Normalizing %s " % value)
+        log.debug("Normalizing %s ", value)
         v = str(value)
         v = v.lower()
         v = v.replace(" ","")
         v= v[0:16]
-        log.debug("Value normalized to %s" % v)
+        log.debug("Value normalized to %s", v)
         return v
       
 
+class ChangeTracker(object):
+    '''
+    Remembers, per entity name, a fingerprint of the inputs an entity was last handled
+    with, so a task run every cycle can skip entities whose inputs have not changed.
+
+    Entities handled with cold=True, those in a state nothing more happens in, are
+    parked: besides a change of their fingerprint, which for them should leave out 
+    inputs shared with other entities, they are handled only once every <coldpasses>
+    passes. A fingerprint of None means the entity is always handled. 
+    '''
+    def __init__(self, coldpasses=10):
+        self.lock = threading.Lock()
+        self.coldpasses = coldpasses
+        self.passes = 0
+        self.seen = {}      # { entityname : fingerprint it was last handled with }
+        self.cold = {}      # { entityname : pass it was parked at }
+
+    @classmethod
+    def fingerprint(cls, *values):
+        return hashlib.md5(FINGERPRINTENCODER.encode(values)).digest()
+
+    def newpass(self, names):
+        '''
+        Starts a pass over the entities <names>, and forgets any others. 
+        '''
+        with self.lock:
+            self.passes += 1
+            names = set(names)
+            for d in [self.seen, self.cold]:
+                for n in [ n for n in d if n not in names ]:
+                    del d[n]
+
+    def changed(self, name, fp):
+        '''
+        True if <name> has to be handled in this pass. 
+        '''
+        with self.lock:
+            if fp is None or self.seen.get(name) != fp:
+                return True
+            if name in self.cold:
+                return (self.passes - self.cold[name]) % self.coldpasses == 0
+            return False
+
+    def handled(self, name, fp, cold=False):
+        with self.lock:
+            self.seen[name] = fp
+            if not cold:
+                self.cold.pop(name, None)
+            elif name not in self.cold:
+                self.cold[name] = self.passes
+
+    def forget(self, name):
+        with self.lock:
+            self.seen.pop(name, None)
+            self.cold.pop(name, None)
+
+    def counts(self):
+        with self.lock:
+            return (len(self.seen), len(self.cold))
+
+
 class InfoPersistencePlugin(object):
+    '''
+    Base for persistence back ends. All plugins provide the document interface:
+
+        getdocument(key)            -> dict of all entities in <key>
+        storedocument(key, doc)
+
+    Plugins that can read and write a single entity without touching the rest of its
+    document set entitylevel = True and implement getentity(), storeentity() and
+    deleteentity(). InfoHandler then uses those for entity operations, so their cost 
+    depends on the size of the entity, not of the document.  
+    '''
+    entitylevel = False
 
     def __init__(self, parent, config, section ):
         self.log = logging.getLogger()
-        self.lock = MockLock()
+        self.locks = KeyLockManager()
         self.parent = parent
         self.config = config
         self.section = section
 
+    def getentity(self, key, entityname):
+        '''
+        Returns Python object for entity <entityname> in <key>.
+        Raises KeyError if there is no such entity.
+        '''
+        raise NotImplementedError
+
+    def storeentity(self, key, entityname, entity):
+        '''
+        Creates or replaces entity <entityname> in <key>.
+        '''
+        raise NotImplementedError
+
+    def deleteentity(self, key, entityname):
+        '''
+        Deletes entity <entityname> in <key> and returns its last value.
+        Raises KeyError if there is no such entity.
+        '''
+        raise NotImplementedError
+
+class RWLock(object):
+    '''
+    Reader/writer lock. Any number of readers may hold it at once, writers hold it alone. 
+    Waiting writers are preferred over new readers, so a steady stream of GETs 
+    cannot starve an update. Not re-entrant. 
+    '''
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waitingwriters = 0
+
+    def acquire_read(self):
+        self.cond.acquire()
+        try:
+            while self.writer or self.waitingwriters > 0:
+                self.cond.wait()
+            self.readers += 1
+        finally:
+            self.cond.release()
+
+    def release_read(self):
+        self.cond.acquire()
+        try:
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def acquire_write(self):
+        self.cond.acquire()
+        try:
+            self.waitingwriters += 1
+            while self.writer or self.readers > 0:
+                self.cond.wait()
+            self.waitingwriters -= 1
+            self.writer = True
+        finally:
+            self.cond.release()
+
+    def release_write(self):
+        self.cond.acquire()
+        try:
+            self.writer = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+class KeyLockManager(object):
+    '''
+    Reader/writer locks per info key (document). Operations on different keys run in 
+    parallel; writes only serialize against reads and writes of the same key. 
+    
+    Every key operation also holds a store-wide lock in read mode, so that 
+    acquire_exclusive() can stop all of them, e.g. to snapshot the whole store. 
+    
+    With perkey=False all keys share a single lock, for back ends whose every write
+    touches the whole store. 
+    '''
+    def __init__(self, perkey=True):
+        self.perkey = perkey
+        self.storelock = RWLock()
+        self.keylocks = {}
+        self.keylockslock = threading.Lock()
+
+    def _keylock(self, key):
+        self.keylockslock.acquire()
+        try:
+            try:
+                return self.keylocks[key]
+            except KeyError:
+                kl = RWLock()
+                self.keylocks[key] = kl
+                return kl
+        finally:
+            self.keylockslock.release()
+
+    def acquire_read(self, key):
+        self.storelock.acquire_read()
+        if self.perkey:
+            self._keylock(key).acquire_read()
+
+    def release_read(self, key):
+        if self.perkey:
+            self._keylock(key).release_read()
+        self.storelock.release_read()
+
+    def acquire_write(self, key):
+        if self.perkey:
+            self.storelock.acquire_read()
+            self._keylock(key).acquire_write()
+        else:
+            self.storelock.acquire_write()
+
+    def release_write(self, key):
+        if self.perkey:
+            self._keylock(key).release_write()
+            self.storelock.release_read()
+        else:
+            self.storelock.release_write()
+
+    def acquire_write_many(self, keys):
+        '''
+        Write-locks several keys for one operation. Key locks are taken in sorted 
+        order and the store-wide lock only once, so concurrent callers cannot deadlock 
+        with each other or with acquire_exclusive().
+        '''
+        if self.perkey:
+            self.storelock.acquire_read()
+            for key in sorted(set(keys)):
+                self._keylock(key).acquire_write()
+        else:
+            self.storelock.acquire_write()
+
+    def release_write_many(self, keys):
+        if self.perkey:
+            for key in sorted(set(keys), reverse=True):
+                self._keylock(key).release_write()
+            self.storelock.release_read()
+        else:
+            self.storelock.release_write()
+
+    def acquire_exclusive(self):
+        self.storelock.acquire_write()
+
+    def release_exclusive(self):
+        self.storelock.release_write()
+
+
+class AttributeIndex(object):
+    '''
+    In-memory inverted indexes on entity attributes, per info key: 
+        { key : { attribute : { value : set(entitynames) } } }
+    A list attribute is indexed under each of its elements. Values are indexed as
+    strings, as they come in query conditions. 
+
+    Kept up to date by calling update() for every stored or deleted entity, under 
+    the key's write lock. lookup() is called under the key's read lock. 
+    '''
+    def __init__(self, attributes):
+        '''
+        <attributes> is a list of (key, attribute) to index. 
+        '''
+        self.postings = {}
+        # { key : { entityname : [ (attribute, value), ... ] } }, to drop old postings
+        self.entries = {}
+        for (key, attribute) in attributes:
+            self.postings.setdefault(key, {})[attribute] = {}
+            self.entries.setdefault(key, {})
+
+    def indexed(self, key, attribute):
+        return attribute in self.postings.get(key, {})
+
+    def lookup(self, key, attribute, value):
+        '''
+        Returns set of names of entities in <key> whose <attribute> matches <value>. 
+        '''
+        return set(self.postings[key][attribute].get(value, ()))
+
+    def update(self, key, entityname, entity):
+        '''
+        Re-indexes entity <entityname> of <key> with its new value <entity>, 
+        or removes it if <entity> is None. 
+        '''
+        if key not in self.postings:
+            return
+        attrindexes = self.postings[key]
+        for (attribute, value) in self.entries[key].pop(entityname, []):
+            names = attrindexes[attribute][value]
+            names.discard(entityname)
+            if not names:
+                del attrindexes[attribute][value]
+        if entity is None:
+            return
+        entries = []
+        for attribute in attrindexes.keys():
+            v = entity.get(attribute)
+            if v is None:
+                continue
+            if not isinstance(v, list):
+                v = [v]
+            for value in set([ unicode(x) for x in v ]):
+                attrindexes[attribute].setdefault(value, set()).add(entityname)
+                entries.append((attribute, value))
+        self.entries[key][entityname] = entries
+
+    def reindex(self, key, doc):
+        '''
+        Replaces everything indexed for <key> with the entities of document <doc>. 
+        '''
+        if key not in self.postings:
+            return
+        for entityname in self.entries[key].keys():
+            self.update(key, entityname, None)
+        for entityname in doc.keys():
+            self.update(key, entityname, doc[entityname])
+
+
+class ChangeFeed(object):
+    '''
+    Revision counter per info key, with the revision at which each entity last 
+    changed, so callers can ask what changed after a revision they have seen and wait 
+    for the next change. 
+
+    Revisions start at the startup time in milliseconds, so those seen before a restart 
+    are older than any handed out after it, and are answered with the whole document. 
+
+    Only the last <maxdeleted> deleted names of a key are remembered. A revision older 
+    than the deletion of a forgotten name is answered with the whole document as well. 
+    '''
+    def __init__(self, maxdeleted=1000):
+        self.cond = threading.Condition(threading.Lock())
+        self.startrev = int(time.time() * 1000)
+        self.maxdeleted = maxdeleted
+        self.revisions = {}   # { key : current revision }
+        self.entities = {}    # { key : { entityname : revision of last change } } of existing entities
+        self.deleted = {}     # { key : OrderedDict { entityname : revision of deletion } }, oldest first
+        self.horizon = {}     # { key : revision of the last deletion forgotten }
+        self.replacedat = {}  # { key : revision of last whole-document write }
+
+    def revision(self, key):
+        return self.revisions.get(key, self.startrev)
+
+    def changed(self, key, entityname, deleted=False):
+        self.cond.acquire()
+        try:
+            rev = self.revision(key) + 1
+            self.revisions[key] = rev
+            if deleted:
+                self.entities.get(key, {}).pop(entityname, None)
+                names = self.deleted.setdefault(key, OrderedDict())
+                names.pop(entityname, None)
+                names[entityname] = rev
+                while len(names) > self.maxdeleted:
+                    self.horizon[key] = names.popitem(last=False)[1]
+            else:
+                self.deleted.get(key, {}).pop(entityname, None)
+                self.entities.setdefault(key, {})[entityname] = rev
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def replaced(self, key):
+        self.cond.acquire()
+        try:
+            rev = self.revision(key) + 1
+            self.revisions[key] = rev
+            self.replacedat[key] = rev
+            self.entities[key] = {}
+            self.deleted[key] = OrderedDict()
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def since(self, key, rev):
+        '''
+        Returns (current revision, names of entities changed after <rev>). The names 
+        are None if they cannot be told and the whole document has to be sent. 
+        '''
+        self.cond.acquire()
+        try:
+            current = self.revision(key)
+            if rev < self.startrev or rev > current or rev < max(self.replacedat.get(key, 0), self.horizon.get(key, 0)):
+                return (current, None)
+            names = [ n for (n, r) in self.entities.get(key, {}).iteritems() if r > rev ]
+            names.extend([ n for (n, r) in self.deleted.get(key, {}).iteritems() if r > rev ])
+            return (current, names)
+        finally:
+            self.cond.release()
+
+    def wait(self, key, rev, timeout):
+        '''
+        Waits up to <timeout> seconds until <key> has a revision newer than <rev>. 
+        '''
+        deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while self.revision(key) == rev:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        finally:
+            self.cond.release()
+
+
 class MockLock(object):
     '''
     Provided as a convenience for persistence back ends that don't require atomic operations. 
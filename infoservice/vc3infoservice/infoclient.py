@@ -9,7 +9,6 @@ __email__ = "jhover@bnl.gov"
 __status__ = "Production"
 
 import base64
-import json
 import logging
 import logging.handlers
 import requests
@@ -17,10 +16,13 @@ import urllib
 import os
 import platform
 import sys
+import threading
 import time
 import traceback
 import warnings
+import zlib
 
+from collections import OrderedDict
 from random import choice
 from string import ascii_uppercase
 from optparse import OptionParser
@@ -39,9 +41,13 @@ except AttributeError:
     pass
 
 from vc3infoservice.core import InfoEntity  
+from vc3infoservice.core import jsonencode, jsondecode, jsonpretty
 from vc3infoservice.core import InfoConnectionFailure, InfoMissingPairingException, InfoEntityUpdateMissingException, InfoEntityMissingException, InfoEntityExistsException
 
 
+# smallest PUT/POST body worth compressing
+COMPRESSMIN = 1024
+
 TESTKEY='testkey'
 TESTDOC='''{ 
                 {"jhoverproject": 
@@ -77,6 +83,32 @@ class InfoClient(object):
         self.httpport  = int(config.get('netcomm','httpport'))
         self.httpsport = int(config.get('netcomm','httpsport'))
         self.infohost  = config.get('netcomm','infohost')
+
+        # One session for all calls, so connections (and their TLS handshakes) are 
+        # reused. Only its connection pool is shared between threads, which is safe. 
+        self.poolsize = 10
+        if config.has_option('netcomm', 'poolsize'):
+            self.poolsize = int(config.get('netcomm', 'poolsize'))
+        self.session = requests.Session()
+        self.session.verify = self.chainfile
+        self.session.cert = (self.certfile, self.keyfile)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.poolsize)
+        self.session.mount('https://', adapter)
+
+        # JSON sent with PUT/POST goes in the request body. If compress is set, bodies 
+        # larger than COMPRESSMIN bytes are sent gzip-compressed.
+        self.compress = False
+        if config.has_option('netcomm', 'compress'):
+            self.compress = config.getboolean('netcomm', 'compress')
+
+        # last response per GET URL, revalidated with If-None-Match. Only the 
+        # <cachesize> most recently used URLs are kept. 
+        #   { url : [ etag, text, parsed ] }
+        self.cachesize = 200
+        if config.has_option('netcomm', 'cachesize'):
+            self.cachesize = int(config.get('netcomm', 'cachesize'))
+        self.cache = OrderedDict()
+        self.cachelock = threading.Lock()
       
         self.log.debug("Client initialized.")
 
@@ -95,11 +127,11 @@ class InfoClient(object):
                                                          key,
                                                          ename
                                                          )
-        self.log.debug("Trying to store entity %s at %s" % (edict, u))
-        jdoc = json.dumps(edict)
-        self.log.debug("Entity converted to JSON: '%s'" % jdoc)
+        self.log.debug("Trying to store entity %s at %s", edict, u)
+        jdoc = jsonencode(edict)
+        self.log.debug("Entity converted to JSON: '%s'", jdoc)
         try:
-            r = requests.post(u, verify=self.chainfile, cert=(self.certfile, self.keyfile), params={'data' : jdoc})
+            r = self.session.post(u, **self._body(jdoc))
             self.log.debug(r.status_code)
             if r.status_code == 405 :
                 raise InfoEntityExistsException("Attempted to store an Entity that already exists. Name: %s" % ename)
@@ -117,38 +149,102 @@ class InfoClient(object):
                             entityname
                             )
         try:
-            r = requests.get(u, verify=self.chainfile, cert=(self.certfile, 
-                                                             self.keyfile))
+            (r, entry) = self._conditionalget(u)
             if r.status_code == 405 :
                 raise InfoEntityMissingException("Attempted to get an Entity that doesn't exist. Name: %s" % entityname)
-            out = self.stripquotes(r.text)
-            parsed = json.loads(out)
-            #pretty = json.dumps(parsed, indent=4, sort_keys=True)
-            return parsed
+            return self._parsed(r, entry)
         except requests.exceptions.ConnectionError, ce:
             self.log.error('Connection failure. %s' % ce)
             raise InfoConnectionFailure(str(ce))
 
 
-    def listentities(self, klass):
+    def _getentitiesdict(self, pairs):
+        '''
+        Get several entities, possibly of different keys, in one call. 
+        <pairs> is a list of (key, entityname). Returns dictionary 
+            { key : { entityname : entitydict } }
+        Missing entities are left out. 
+        '''
+        u = "https://%s:%s/info/batch?entities=%s" % (self.infohost, 
+                                                      self.httpsport,
+                                                      urllib.quote(jsonencode([ list(p) for p in pairs ]))
+                                                      )
+        try:
+            (r, entry) = self._conditionalget(u)
+            return self._parsed(r, entry)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+
+    def getentities(self, entityclass, entitynames):
+        '''
+        Returns list of valid instance objects of <entityclass>, one per name in <entitynames>,
+        fetched with a single call. Raises InfoEntityMissingException if any is missing. 
+        '''
+        klass = entityclass
+        infokey = klass.infokey
+        if not entitynames:
+            return []
+        ed = self._getentitiesdict([ (infokey, n) for n in entitynames ]).get(infokey, {})
+        olist = []
+        for n in entitynames:
+            try:
+                olist.append(klass.objectFromDict(ed[n]))
+            except KeyError:
+                raise InfoEntityMissingException("Attempted to get an Entity that doesn't exist. Name: %s" % n)
+        return olist
+
+    def getentitymap(self, classnames):
+        '''
+        Fetches entities of different classes with a single call. 
+        <classnames> is a list of (entityclass, entityname). Returns dictionary 
+            { (entityclass, entityname) : object }
+        Missing entities are left out. 
+        '''
+        if not classnames:
+            return {}
+        d = self._getentitiesdict([ (klass.infokey, n) for (klass, n) in classnames ])
+        omap = {}
+        for (klass, n) in classnames:
+            try:
+                omap[(klass, n)] = klass.objectFromDict(d[klass.infokey][n])
+            except KeyError:
+                pass
+        return omap
+
+    def listentities(self, klass, where=None, lazy=False):
         '''
         Return list of instance objects for all <entityclass> entities in infoservice. 
         
+        Optionally, only those matching <where>, a dictionary { attribute : value }, 
+        evaluated by the infoservice. A list attribute matches if it contains the value. 
+
+        With lazy=True, returns a generator of EntityView instead, which builds each 
+        entity object only when one of its attributes other than name is used. The 
+        document is still fetched by this call. 
         '''
         #m = sys.modules[__name__] 
         #klass = getattr(m, entityclass)
         infokey = klass.infokey
-        self.log.debug("Listing class %s with infokey %s " % (klass.__name__, infokey))     
-        docobj = self.getdocumentdict(infokey)
-        self.log.debug("Got document object: %s " % docobj)
+        self.log.debug("Listing class %s with infokey %s ", klass.__name__, infokey)     
+        if where is None:
+            docobj = self.getdocumentdict(infokey)
+        else:
+            docobj = self._querydocumentdict(infokey, where)
+        # per-entity debug lines are skipped outright unless debug logging is on
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.log.debug("Got document object: %s ", docobj)
+        if lazy:
+            return ( EntityView(klass, oname, ed) for (oname, ed) in (docobj or {}).iteritems() )
         olist = []
         try:
             for oname in docobj.keys():
-                    self.log.debug("Getting objectname %s" % oname)
                     #s = "{ '%s' : %s }" % (oname, docobj[infokey][oname] )
                     ed = docobj[oname]
                     eo = klass.objectFromDict(ed)
-                    self.log.debug("Appending eo %s" % eo)
+                    if debug:
+                        self.log.debug("Appending eo %s", eo)
                     olist.append(eo)
         except KeyError, e:
             self.log.warning("Document has no key '%s'", e.args[0])
@@ -156,6 +252,29 @@ class InfoClient(object):
             self.log.warning("Document object empty.")
         return olist
 
+    def listnames(self, klass, where=None):
+        '''
+        Return list of the names of <entityclass> entities in infoservice, optionally
+        only of those matching <where> (as in listentities()). Only the names are 
+        sent by the infoservice. 
+        '''
+        infokey = klass.infokey
+        self.log.debug("Listing names of class %s with infokey %s where %s", klass.__name__, infokey, where)
+        return self._querydocumentdict(infokey, where, []).keys()
+
+
+    def queryentities(self, klass, where=None, fields=None):
+        '''
+        Return list of entity dictionaries of <entityclass> entities matching <where> 
+        (as in listentities()), with only the attributes in list <fields>. 
+        
+        Dictionaries rather than objects are returned, as an object made from some 
+        of the attributes could not safely be stored back. 
+        '''
+        infokey = klass.infokey
+        self.log.debug("Querying class %s with infokey %s where %s for fields %s", klass.__name__, infokey, where, fields)
+        docobj = self._querydocumentdict(infokey, where, fields)
+        return docobj.values()
 
     def getentity(self, entityclass, entityname):
         '''
@@ -164,10 +283,10 @@ class InfoClient(object):
         '''
         klass = entityclass
         infokey = klass.infokey
-        self.log.debug("Getting %s entity %s with infokey %s " % (entityclass, entityname, infokey))     
+        self.log.debug("Getting %s entity %s with infokey %s ", entityclass, entityname, infokey)     
         eobj = self._getentitydict(infokey, entityname)
-        self.log.debug("Type of eobj is %s" % type(eobj))
-        self.log.debug("Got entity object: %s " % eobj)
+        self.log.debug("Type of eobj is %s", type(eobj))
+        self.log.debug("Got entity object: %s ", eobj)
         eo = klass.objectFromDict(eobj)
         return eo
 
@@ -181,11 +300,11 @@ class InfoClient(object):
                                                          key,
                                                          ename
                                                          )
-        self.log.debug("Trying to merge dict %s at %s" % (edict, u))
-        jdoc = json.dumps(edict)
-        self.log.debug("Entity converted to JSON: '%s'" % jdoc)
+        self.log.debug("Trying to merge dict %s at %s", edict, u)
+        jdoc = jsonencode(edict)
+        self.log.debug("Entity converted to JSON: '%s'", jdoc)
         try:
-            r = requests.put(u, verify=self.chainfile, cert=(self.certfile, self.keyfile), params={'data' : jdoc})
+            r = self.session.put(u, **self._body(jdoc))
             self.log.debug(r.status_code)            
             if r.status_code == 405 :
                 raise InfoEntityUpdateMissingException("Attempted to update an Entity that doesn't exist. Name: %s" % ename)
@@ -195,6 +314,30 @@ class InfoClient(object):
             raise InfoConnectionFailure(str(ce))
 
     
+    def patchentity(self, entityclass, entityname, path, value):
+        '''
+        Sets the value at <path>, a list of nested attribute names, within an entity
+        to <value>, or removes it if <value> is None. Only that subtree is sent and 
+        replaced, e.g. 
+            patchentity(Request, 'myrequest', ['statusraw', factoryid], status)
+        '''
+        klass = entityclass
+        key = klass.infokey
+        pointer = ''.join([ '/' + self.encode_utf8(p).replace('~', '~0').replace('/', '~1') for p in path ])
+        u = "https://%s:%s/info?%s" % (self.infohost, 
+                                       self.httpsport,
+                                       urllib.urlencode([('key', key), ('entityname', entityname), ('path', pointer)])
+                                       )
+        self.log.debug("Trying to patch %s at %s", pointer, u)
+        try:
+            r = self.session.request('PATCH', u, **self._body(jsonencode(value)))
+            self.log.debug(r.status_code)
+            if r.status_code == 405 :
+                raise InfoEntityUpdateMissingException("Attempted to patch an Entity that doesn't exist, or a path through a non-dictionary. Name: %s" % entityname)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+
     def deleteentity(self, entityclass, entityname):
         '''
         deletes given entityname from key
@@ -207,7 +350,7 @@ class InfoClient(object):
                                                          entityname
                                                          )
         try:
-            r = requests.delete(u, verify=self.chainfile, cert=(self.certfile, self.keyfile))
+            r = self.session.delete(u)
             self.log.debug(r.status_code)            
             if r.status_code == 405 :
                 raise InfoEntityMissingException("Attempted to delete an Entity that doesn't exist. Name: %s" % entityname)
@@ -219,6 +362,102 @@ class InfoClient(object):
        
         
 
+    def batch(self):
+        '''
+        Returns an InfoBatch, to be used as context manager. Entity stores, merges and 
+        deletes done through it are collected and sent in a single call when the block 
+        exits, and are applied by the infoservice all together or not at all:
+        
+            with infoclient.batch() as b:
+                nodeset.store(b)
+                cluster.store(b)
+                b.deleteentity(Request, 'oldrequest')
+        '''
+        return InfoBatch(self)
+
+    def _sendbatch(self, ops):
+        '''
+        Sends list of batch operations (see InfoHandler.batch()) to the infoservice. 
+        Raises the exception the single call that failed would have raised. 
+        '''
+        u = "https://%s:%s/info/batch" % (self.infohost, 
+                                          self.httpsport
+                                          )
+        jops = jsonencode(ops)
+        self.log.debug("Sending batch of %d operations to %s", len(ops), u)
+        try:
+            r = self.session.post(u, **self._body(jops))
+            self.log.debug(r.status_code)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+        if r.status_code == 405:
+            failure = jsondecode(r.text)
+            op = ops[failure['index']]
+            self.log.debug("Batch not applied. Operation %s failed: %s", op, failure['reason'])
+            if op['op'] == 'store':
+                raise InfoEntityExistsException("Attempted to store an Entity that already exists. Name: %s" % op['entityname'])
+            elif op['op'] == 'merge':
+                raise InfoEntityUpdateMissingException("Attempted to update an Entity that doesn't exist. Name: %s" % op['entityname'])
+            else:
+                raise InfoEntityMissingException("Attempted to delete an Entity that doesn't exist. Name: %s" % op['entityname'])
+
+    def getchanges(self, key, since=0, timeout=30):
+        '''
+        Long-polls the infoservice for entities of <key> changed after revision <since>. 
+        Returns within <timeout> seconds the dictionary
+            { 'key' : <key>, 'revision' : <rev>, 'reset' : <bool>, 
+              'changed' : { entityname : entitydict }, 'deleted' : [ entityname, ... ] }
+        with empty 'changed' and 'deleted' if nothing changed. If 'reset' is true, 
+        'changed' is the whole document. Pass 'revision' as <since> of the next call. 
+        '''
+        u = "https://%s:%s/info/changes?key=%s&since=%d&timeout=%d" % (self.infohost, 
+                                                                      self.httpsport,
+                                                                      key,
+                                                                      since,
+                                                                      timeout
+                                                                      )
+        try:
+            r = self.session.get(u, timeout=timeout + 30)
+            return jsondecode(r.text)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+
+    def getrevisions(self, keys):
+        '''
+        Returns { key : revision } of the current revisions of <keys>, as getchanges() 
+        returns them, without fetching any entities. 
+        '''
+        u = "https://%s:%s/info/revisions?keys=%s" % (self.infohost, 
+                                                      self.httpsport,
+                                                      urllib.quote(','.join(keys))
+                                                      )
+        try:
+            r = self.session.get(u)
+            return jsondecode(r.text)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+
+    def watch(self, entityclass, since=0, timeout=30):
+        '''
+        Generator reacting to changes of <entityclass> entities as they happen. Yields
+            (revision, changed, deleted, reset)
+        with <changed> a list of instance objects and <deleted> a list of names, on 
+        every change and, with empty lists, at least every <timeout> seconds. The first 
+        yield (since=0) has all entities, with reset set. 
+
+            for (rev, changed, deleted, reset) in infoclient.watch(Request):
+                ...
+        '''
+        klass = entityclass
+        while True:
+            d = self.getchanges(klass.infokey, since, timeout)
+            since = d['revision']
+            changed = [ klass.objectFromDict(ed) for ed in d['changed'].values() ]
+            yield (since, changed, d['deleted'], d['reset'])
+
 ################################################################################
 #                     Category document-oriented methods
 ################################################################################
@@ -233,7 +472,9 @@ class InfoClient(object):
                             key
                             )
         try:
-            r = requests.get(u, verify=self.chainfile, cert=(self.certfile, self.keyfile))
+            (r, entry) = self._conditionalget(u)
+            if entry is not None:
+                return entry[1]
             return r.text
         except requests.exceptions.ConnectionError, ce:
             self.log.error('Connection failure. %s' % ce)
@@ -249,9 +490,9 @@ class InfoClient(object):
                             self.httpsport,
                             key
                             )
-        self.log.debug("Trying to store document %s at %s" % (doc, u))
+        self.log.debug("Trying to store document %s at %s", doc, u)
         try:
-            r = requests.post(u, verify=self.chainfile, cert=(self.certfile, self.keyfile), params={'data' : doc})
+            r = self.session.post(u, **self._body(doc))
             self.log.debug(r.status_code)
         except requests.exceptions.ConnectionError, ce:
             self.log.error('Connection failure. %s' % ce)
@@ -262,12 +503,38 @@ class InfoClient(object):
         '''
         Get JSON doc and convert to Python and return. 
         '''
-        text = self.getdocument(key)
-        out = self.stripquotes(text)
-        parsed = json.loads(out)
-        pretty = json.dumps(parsed, indent=4, sort_keys=True)
-        return parsed
+        u = "https://%s:%s/info?key=%s" % (self.infohost, 
+                            self.httpsport,
+                            key
+                            )
+        try:
+            (r, entry) = self._conditionalget(u)
+            return self._parsed(r, entry)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
         
+    def _querydocumentdict(self, key, where=None, fields=None):
+        '''
+        Get entities of document <key> matching <where> { attribute : value }, 
+        projected to list <fields>, as dictionary { entityname : entitydict }.
+        '''
+        params = [ ('key', key) ]
+        for attribute in sorted((where or {}).keys()):
+            params.append(('where', self.encode_utf8('%s:%s' % (attribute, where[attribute]))))
+        if fields is not None:
+            params.append(('fields', ','.join(fields)))
+        u = "https://%s:%s/info?%s" % (self.infohost, 
+                                       self.httpsport,
+                                       urllib.urlencode(params)
+                                       )
+        try:
+            (r, entry) = self._conditionalget(u)
+            return self._parsed(r, entry)
+        except requests.exceptions.ConnectionError, ce:
+            self.log.error('Connection failure. %s' % ce)
+            raise InfoConnectionFailure(str(ce))
+
     def storedocumentdict(self, key, dict):
         '''
         Store Python dictionary in infoservice. 
@@ -278,8 +545,8 @@ class InfoClient(object):
             td[key] = dict
             dict = td
             
-        jstr = json.dumps(dict)
-        self.log.debug("JSON string: %s" % jstr)
+        jstr = jsonencode(dict)
+        self.log.debug("JSON string: %s", jstr)
         self.storedocument(key, jstr)
 
 
@@ -289,9 +556,9 @@ class InfoClient(object):
                             self.httpsport,
                             key
                             )
-        self.log.debug("Trying to merge document %s at %s" % (doc, u))
+        self.log.debug("Trying to merge document %s at %s", doc, u)
         try:
-            r = requests.put(u, verify=self.chainfile, cert=(self.certfile, self.keyfile), params={'data' : doc})
+            r = self.session.put(u, **self._body(doc))
             self.log.debug(r.status_code)
         
         except requests.exceptions.ConnectionError, ce:
@@ -302,7 +569,7 @@ class InfoClient(object):
         doc = self.getdocument(key = keys[0])
         if not doc:
             return None
-        ds = json.loads(doc)
+        ds = jsondecode(doc)
         good_keys = []
         for k in keys:
             if k in ds:
@@ -326,9 +593,9 @@ class InfoClient(object):
                                 self.httpsport,
                                 key
                                 )
-            self.log.debug("Trying to delete document at %s" % (path,))
+            self.log.debug("Trying to delete document at %s", path)
 
-            r = requests.delete(u, verify=self.chainfile, cert=(self.certfile, self.keyfile), params={'name' : path})
+            r = self.session.delete(u, params={'name' : path})
             self.log.debug(r.status_code)
         
         except IndexError, e:
@@ -347,16 +614,16 @@ class InfoClient(object):
         '''
         Establish a pairing entry
         '''
-        self.log.debug("Infoclient requestPairing for %s " % cnsubject)
+        self.log.debug("Infoclient requestPairing for %s ", cnsubject)
         pairingcode = self.generateCode(cnsubject)
-        self.log.debug("Generated code: %s " % pairingcode)
+        self.log.debug("Generated code: %s ", pairingcode)
         po = Pairing(name=cnsubject, 
                      state='new', 
                      acl=None, 
                      cn=cnsubject, 
                      pairingcode=pairingcode
                      )
-        self.log.debug("Made pairing request: %s" % po)
+        self.log.debug("Made pairing request: %s", po)
         po.store(self)
         self.log.debug("Stored in /info/pairing..")
         return pairingcode
@@ -373,10 +640,10 @@ class InfoClient(object):
                             self.httpsport,
                             pairingcode
                             )
-        self.log.debug("Attempting to get pairing via URL %s" % u)
+        self.log.debug("Attempting to get pairing via URL %s", u)
         try:
             r = requests.get(u, verify=self.chainfile)     
-            pe = json.loads(r.text)
+            pe = jsondecode(r.text)
             ecert = pe['cert']
             ekey = pe['key']
             cert = self.decode(ecert)
@@ -388,7 +655,7 @@ class InfoClient(object):
             raise InfoConnectionFailure("Connection Error.")
         
         except Exception, e:
-            self.log.debug('Other failure. Probably missing pairing. %s ' % e)
+            self.log.debug('Other failure. Probably missing pairing. %s ', e)
             raise InfoMissingPairingException("Missing pairing.")
             
             
@@ -399,6 +666,81 @@ class InfoClient(object):
 ################################################################################
 #                     Utility methods
 ################################################################################
+
+    def encode_utf8(self, s):
+        if isinstance(s, unicode):
+            return s.encode('utf-8')
+        return s
+
+    def _body(self, jdoc):
+        '''
+        Request arguments to send JSON string <jdoc> as body of a PUT or POST. 
+        '''
+        jdoc = self.encode_utf8(jdoc)
+        headers = { 'Content-Type' : 'application/json' }
+        if self.compress and len(jdoc) > COMPRESSMIN:
+            c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            jdoc = c.compress(jdoc) + c.flush()
+            headers['Content-Encoding'] = 'gzip'
+        return { 'data' : jdoc, 'headers' : headers }
+
+    def _conditionalget(self, u):
+        '''
+        GET <u>, revalidating any previously cached response with If-None-Match. 
+        Returns the response and the cache entry [etag, text, parsed] for <u>, or None
+        if the response is not cacheable. On 304 the entry is the cached one.  
+        '''
+        headers = {}
+        with self.cachelock:
+            entry = self.cache.pop(u, None)
+            if entry is not None:
+                self.cache[u] = entry
+        if entry is not None:
+            headers['If-None-Match'] = entry[0]
+        r = self.session.get(u, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            self.log.debug("Not modified: %s", u)
+            return (r, entry)
+        etag = r.headers.get('ETag')
+        with self.cachelock:
+            self.cache.pop(u, None)
+            if r.status_code == 200 and etag and self.cachesize > 0:
+                entry = [etag, r.text, None]
+                self.cache[u] = entry
+                while len(self.cache) > self.cachesize:
+                    self.cache.popitem(last=False)
+            else:
+                entry = None
+        return (r, entry)
+
+    def _parsed(self, r, entry):
+        '''
+        Python object for response <r>. Cached responses are parsed once, and a copy
+        of the parsed object returned, as callers may modify it. 
+        '''
+        if entry is None:
+            return jsondecode(self.stripquotes(r.text))
+        if entry[2] is None:
+            entry[2] = jsondecode(self.stripquotes(entry[1]))
+        return self.copytree(entry[2])
+
+    def copytree(self, o):
+        '''
+        Copy of a parsed JSON object. Much cheaper than copy.deepcopy() or re-parsing. 
+        '''
+        t = type(o)
+        if t is dict:
+            d = {}
+            for k, v in o.iteritems():
+                tv = type(v)
+                if tv is dict or tv is list:
+                    d[k] = self.copytree(v)
+                else:
+                    d[k] = v
+            return d
+        if t is list:
+            return [ self.copytree(v) if type(v) in (dict, list) else v for v in o ]
+        return o
        
     def stripquotes(self,s):
         rs = s.replace("'","")
@@ -412,7 +754,7 @@ class InfoClient(object):
 
 
     def testquery(self):
-        self.log.info("Testing storedocument. Doc = %s" % TESTDOC)
+        self.log.info("Testing storedocument. Doc = %s", TESTDOC)
         self.storedocument(key=TESTKEY,doc=TESTDOC)
         
         self.log.info("Testing getdocument...")
@@ -420,6 +762,74 @@ class InfoClient(object):
         self.log.info("Done.")
 
       
+class InfoBatch(object):
+    '''
+    Collects entity operations for InfoClient._sendbatch(). Offers the entity-writing 
+    calls of InfoClient, so it can be passed to InfoEntity.store() in its place. 
+    Nothing is sent if the block exits with an exception. 
+    '''
+    def __init__(self, infoclient):
+        self.log = logging.getLogger()
+        self.infoclient = infoclient
+        self.ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None and self.ops:
+            self.infoclient._sendbatch(self.ops)
+        return False
+
+    def _storeentitydict(self, key, edict):
+        ename = edict.keys()[0]
+        self.ops.append({ 'op' : 'store', 'key' : key, 'entityname' : ename, 'data' : edict })
+
+    def _mergeentitydict(self, key, edict):
+        ename = edict.keys()[0]
+        self.ops.append({ 'op' : 'merge', 'key' : key, 'entityname' : ename, 'data' : edict })
+
+    def deleteentity(self, entityclass, entityname):
+        self.ops.append({ 'op' : 'delete', 'key' : entityclass.infokey, 'entityname' : entityname })
+
+
+class EntityView(object):
+    '''
+    Stands for the entity <name> of class <klass> in lists returned by 
+    InfoClient.listentities(lazy=True). The name is available directly; any other
+    attribute, or method, makes the entity object from its dictionary, once, and 
+    is taken from it. Setting an attribute sets it on the entity object.  
+
+    Use entity() where the entity object itself is needed.  
+    '''
+    __slots__ = ('klass', 'name', '_dict', '_entity')
+
+    def __init__(self, klass, name, edict):
+        object.__setattr__(self, 'klass', klass)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, '_dict', edict)
+        object.__setattr__(self, '_entity', None)
+
+    def entity(self):
+        eo = self._entity
+        if eo is None:
+            eo = self.klass.objectFromDict(self._dict)
+            object.__setattr__(self, '_entity', eo)
+            object.__setattr__(self, '_dict', None)
+        return eo
+
+    def __getattr__(self, name):
+        return getattr(self.entity(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.entity(), name, value)
+
+    def __repr__(self):
+        if self._entity is None:
+            return "%s(name=%s, not loaded)" % (self.klass.__name__, self.name)
+        return repr(self._entity)
+
+
 class Pairing(InfoEntity):
     '''
     Represents a request and completed entry for a pairing.
@@ -525,6 +935,10 @@ John Hover <jhover@bnl.gov>
                           action="store", 
                           metavar="[resource|account|cluster|...]", 
                           help="Get info from store with provided key.")        
+        parser.add_option("--export", dest="exportkey", 
+                          action="store", 
+                          metavar="[resource|account|cluster|...]", 
+                          help="Print info from store with provided key as indented, sorted JSON, in the form --addfiles reads.")        
         parser.add_option("--deletesubtree", dest="deletesubtree", 
                           action="store", 
                           metavar="[resource|account|cluster|...]", 
@@ -581,16 +995,16 @@ John Hover <jhover@bnl.gov>
         envmsg = ''        
         for k in sorted(os.environ.keys()):
             envmsg += '\n%s=%s' %(k, os.environ[k])
-        self.log.debug('Environment : %s' %envmsg)
+        self.log.debug('Environment : %s', envmsg)
 
 
     def __platforminfo(self):
         '''
         display basic info about the platform, for debugging purposes 
         '''
-        self.log.info('platform: uname = %s %s %s %s %s %s' %platform.uname())
-        self.log.info('platform: platform = %s' %platform.platform())
-        self.log.info('platform: python version = %s' %platform.python_version())
+        self.log.info('platform: uname = %s %s %s %s %s %s', *platform.uname())
+        self.log.info('platform: platform = %s', platform.platform())
+        self.log.info('platform: python version = %s', platform.python_version())
         self._printenv()
 
     
@@ -614,29 +1028,34 @@ John Hover <jhover@bnl.gov>
             flist = self.options.addfiles.split(',')
             for fn in flist:
                 fname = fn.strip()
-                self.log.debug("Adding contents of file %s" % fname)
+                self.log.debug("Adding contents of file %s", fname)
                 jdoc = open(fname).read()
-                data = json.loads(jdoc)
-                pretty = json.dumps(data, indent=4, sort_keys=True)
+                data = jsondecode(jdoc)
+                pretty = jsonpretty(data)
                 self.log.debug(pretty)
                 k = data.keys()[0]
-                self.log.debug("key is %s" % k)
+                self.log.debug("key is %s", k)
                 self.ic.mergedocument(k,jdoc)
         
         if self.options.getkey:
             qkey = self.options.getkey.lower().strip()
-            self.log.debug("Getkey is %s, doing query" % qkey )
+            self.log.debug("Getkey is %s, doing query", qkey)
             out = self.ic.getdocument(qkey)
             print(out)
 
+        if self.options.exportkey:
+            qkey = self.options.exportkey.lower().strip()
+            self.log.debug("Exportkey is %s, doing query", qkey)
+            print(jsonpretty({ qkey : self.ic.getdocumentdict(qkey) }))
+
         if self.options.deletesubtree:
             dpath = self.options.deletesubtree.lower().strip()
-            self.log.debug("Deletesubtree is %s, doing query" % dpath )
+            self.log.debug("Deletesubtree is %s, doing query", dpath)
             out = self.ic.deletesubtree(dpath)
             print(out)
             
         if self.options.requestpairing:
-            self.log.debug("Setting up pairing for CN: %s"% self.options.requestpairing )
+            self.log.debug("Setting up pairing for CN: %s", self.options.requestpairing)
             code = self.ic.requestPairing(self.options.requestpairing)
             print("%s" % code)
         
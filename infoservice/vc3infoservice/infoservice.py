@@ -10,24 +10,27 @@ __status__ = "Production"
 
 
 import cherrypy
+import hashlib
 import logging
 import logging.handlers
 import os
 import platform
 import pwd
 import random
-import json
 import string
 import socket
 import sys
 import threading
 import time
 import traceback
+import zlib
 
 from optparse import OptionParser
 from ConfigParser import ConfigParser
 
 from vc3infoservice.core  import InfoEntityExistsException, InfoEntityMissingException
+from vc3infoservice.core  import AttributeIndex, ChangeFeed
+from vc3infoservice.core  import jsonencode, jsondecode
 
 # Since script is in package "vc3" we can know what to add to path for 
 # running directly during development
@@ -36,6 +39,12 @@ sys.path.append(libpath)
 
 import pluginmanager as pm
 
+# longest wait of a /info/changes long-poll, in seconds
+MAXCHANGESTIMEOUT = 60
+
+# attributes indexed if [persistence] indexes is not set
+DEFAULTINDEXES = 'request.state, project.owner, project.members, allocation.owner, allocation.state'
+
 class InfoHandler(object):
     '''
     Handles low-level operations and persistence of information 
@@ -65,8 +74,45 @@ class InfoHandler(object):
                                     name=pluginname, 
                                     config=self.config, 
                                     section=psect)
+        # backends that keep entities individually are used one entity at a time,
+        # instead of loading and re-storing the whole key document.
+        self.entitylevel = self.persist.entitylevel
+
+        # serialized JSON, with its ETag, of documents and entities as last returned by GET.
+        # Filled under the key's read lock, dropped under its write lock.
+        #   doccache    { key : (etag, json) }
+        #   entitycache { key : { entityname : (etag, json) } }
+        self.doccache = {}
+        self.entitycache = {}
+
+        # secondary indexes for querydocument(), e.g. request.state, project.owner 
+        self.index = AttributeIndex(self._indexattributes())
+        for key in self.index.postings.keys():
+            self.index.reindex(key, self.persist.getdocument(key))
+
+        # per-key revisions and changed entities, for getchanges()
+        maxdeleted = 1000
+        if self.config.has_option('persistence', 'changes_deleted'):
+            maxdeleted = self.config.getint('persistence', 'changes_deleted')
+        self.changes = ChangeFeed(maxdeleted)
         self.log.debug("Done initializing InfoHandler")
 
+    def _indexattributes(self):
+        '''
+        Returns list of (key, attribute) from [persistence] indexes, a comma-separated 
+        list of <key>.<attribute>. 
+        '''
+        indexes = DEFAULTINDEXES
+        if self.config.has_option('persistence', 'indexes'):
+            indexes = self.config.get('persistence', 'indexes')
+        attributes = []
+        for ka in indexes.split(','):
+            ka = ka.strip()
+            if ka:
+                (key, attribute) = ka.split('.', 1)
+                attributes.append((key, attribute))
+        return attributes
+
 ################################################################################
 #                     Entity-oriented methods
 ################################################################################
@@ -83,37 +129,44 @@ class InfoHandler(object):
                        }
                    }
         '''
-        self.log.debug("input JSON doc to merge is %s" % edoc)
-        entitydict = json.loads(edoc)
-        self.persist.lock.acquire()
+        self.log.debug("input JSON doc to merge is %s", edoc)
+        entitydict = jsondecode(edoc)
+        if self.entitylevel:
+            return self._storeentity(key, entityname, entitydict)
+        self.persist.locks.acquire_write(key)
         try:
+            self._invalidate(key, entityname)
             currentdoc = self.persist.getdocument(key)
             try:
                 existingentity = currentdoc[entityname]
                 cherrypy.response.status = 405
                 return "Attempt to create (POST) already-existing Entity. Name: %s. " % entityname
             except KeyError:
-                self.log.debug("No existing entity %s. As expected..." % entityname)
+                self.log.debug("No existing entity %s. As expected...", entityname)
                 pass
             
             self.log.debug("Merging entity with existing document.")
             newdoc = self.merge( entitydict, currentdoc)
             self.persist.storedocument(key, newdoc)
+            self._updated(key, entityname, newdoc[entityname])
             self.log.debug("Successfully stored entity.")            
         finally:
-            self.persist.lock.release()        
+            self.persist.locks.release_write(key)        
 
     def mergeentity(self, key, entityname, edoc):
         '''
         merges contents of (update-only) JSON doc string by entity level. 
         Within entity, uses merge that replaces attributes with new values.
         '''
-        self.log.debug("input entity doc to merge is %s" % edoc)       
+        self.log.debug("input entity doc to merge is %s", edoc)       
         # e.g. {"SPT": {"allocations": ["lincolnb.uchicago-midway"]}}
-        self.log.debug("input JSON doc to merge is type %s" % type(edoc))
-        entitydict = json.loads(edoc)
-        self.persist.lock.acquire()
+        self.log.debug("input JSON doc to merge is type %s", type(edoc))
+        entitydict = jsondecode(edoc)
+        if self.entitylevel:
+            return self._mergeentity(key, entityname, entitydict)
+        self.persist.locks.acquire_write(key)
         try:
+            self._invalidate(key, entityname)
             currentdoc = self.persist.getdocument(key)
             existingentity = currentdoc[entityname]
             newentity = entitydict[entityname]
@@ -123,12 +176,111 @@ class InfoHandler(object):
             self.entitymerge(newentity, existingentity)
             #self.log.debug("Resulting existing: %s" % existingentity)
             self.persist.storedocument(key, currentdoc)
+            self._updated(key, entityname, existingentity)
             self.log.debug("Successfully stored entity.")            
         except KeyError:
             cherrypy.response.status = 405
             return "Attempt to update (PUT) non-existent Entity. Name: %s. " % entityname
         finally:
-            self.persist.lock.release()        
+            self.persist.locks.release_write(key)        
+
+    def _storeentity(self, key, entityname, entitydict):
+        '''
+        storeentity() for entity-level persistence backends. 
+        '''
+        self.persist.locks.acquire_write(key)
+        try:
+            self._invalidate(key, entityname)
+            try:
+                self.persist.getentity(key, entityname)
+                cherrypy.response.status = 405
+                return "Attempt to create (POST) already-existing Entity. Name: %s. " % entityname
+            except KeyError:
+                self.log.debug("No existing entity %s. As expected...", entityname)
+            self.persist.storeentity(key, entityname, entitydict[entityname])
+            self._updated(key, entityname, entitydict[entityname])
+            self.log.debug("Successfully stored entity.")
+        finally:
+            self.persist.locks.release_write(key)
+
+    def _mergeentity(self, key, entityname, entitydict):
+        '''
+        mergeentity() for entity-level persistence backends. 
+        '''
+        self.persist.locks.acquire_write(key)
+        try:
+            self._invalidate(key, entityname)
+            existingentity = self.persist.getentity(key, entityname)
+            newentity = entitydict[entityname]
+            self.entitymerge(newentity, existingentity)
+            self.persist.storeentity(key, entityname, existingentity)
+            self._updated(key, entityname, existingentity)
+            self.log.debug("Successfully stored entity.")
+        except KeyError:
+            cherrypy.response.status = 405
+            return "Attempt to update (PUT) non-existent Entity. Name: %s. " % entityname
+        finally:
+            self.persist.locks.release_write(key)
+
+    def patchentity(self, key, entityname, path, value):
+        '''
+        Sets the value at <path>, a list of nested attribute names, within entity 
+        <entityname> to Python object <value>, creating missing intermediate dictionaries. 
+        A <value> of None removes it instead. The rest of the entity is left alone, so 
+        writers of different subtrees (e.g. statusraw/<factoryid>) do not overwrite 
+        each other. 
+        '''
+        self.persist.locks.acquire_write(key)
+        try:
+            self._invalidate(key, entityname)
+            if self.entitylevel:
+                entity = self.persist.getentity(key, entityname)
+            else:
+                currentdoc = self.persist.getdocument(key)
+                entity = currentdoc[entityname]
+            if not self._canpatch(entity, path):
+                cherrypy.response.status = 405
+                return "Attempt to PATCH path %s through a non-dictionary value. Entity: %s. " % (path, entityname)
+            self._setpath(entity, path, value)
+            if self.entitylevel:
+                self.persist.storeentity(key, entityname, entity)
+            else:
+                self.persist.storedocument(key, currentdoc)
+            self._updated(key, entityname, entity)
+            self.log.debug("Successfully patched entity.")
+        except KeyError:
+            cherrypy.response.status = 405
+            return "Attempt to PATCH non-existent Entity. Name: %s. " % entityname
+        finally:
+            self.persist.locks.release_write(key)
+
+    def _canpatch(self, entity, path):
+        '''
+        Checks, before anything is changed, that <path> only goes through dictionaries. 
+        '''
+        if len(path) < 1:
+            return False
+        node = entity
+        for p in path[:-1]:
+            if not isinstance(node, dict):
+                return False
+            node = node.get(p)
+            if node is None:
+                return True
+        return isinstance(node, dict)
+
+    def _setpath(self, entity, path, value):
+        node = entity
+        for p in path[:-1]:
+            if node.get(p) is None:
+                if value is None:
+                    return
+                node[p] = {}
+            node = node[p]
+        if value is None:
+            node.pop(path[-1], None)
+        else:
+            node[path[-1]] = value
 
     def entitymerge(self, src, dest):
             ''' 
@@ -146,7 +298,7 @@ class InfoHandler(object):
              u'blueprints': []}
              
             '''
-            self.log.debug("Handling merging %s into %s " % (src, dest))
+            self.log.debug("Handling merging %s into %s ", src, dest)
             for attributename in src.keys():
                 dest[attributename] = src[attributename]
 
@@ -158,35 +310,188 @@ class InfoHandler(object):
           'key1'  : '<val1>'
         }        
         '''
-        currentdoc = self.persist.getdocument(key)
-        self.log.debug("Current doc for %s is %s" % (key, currentdoc))
+        self.persist.locks.acquire_read(key)
         try:
-            ed = currentdoc[entityname]
-            je = json.dumps(ed)
-            self.log.debug("JSON entity is %s" % str(je))
-            return je
+            (etag, je) = self._entityjson(key, entityname)
+            self.log.debug("JSON entity is %s", je)
+            return self._conditional(etag, je)
         except KeyError:
             cherrypy.response.status = 405
             return "Attempt to GET non-existent Entity. Name: %s. " % entityname
             #raise InfoEntityMissingException("Attempt to update or get a non-existent Entity.")
+        finally:
+            self.persist.locks.release_read(key)
+
+    def getentities(self, pairs):
+        '''
+        Gets JSON representation of several entities, possibly of different keys, 
+        given as list of [ key, entityname ] pairs. Missing entities are left out. 
+
+        { '<key>' : { '<entityname>' : { 'name' : '<entityname>', 'key1' : '<val1>' },
+                      ... },
+          ...
+        }
+        '''
+        bykey = {}
+        for (key, entityname) in pairs:
+            bykey.setdefault(key, [])
+            if entityname not in bykey[key]:
+                bykey[key].append(entityname)
+
+        keyparts = []
+        for key in sorted(bykey.keys()):
+            entityparts = []
+            self.persist.locks.acquire_read(key)
+            try:
+                for entityname in bykey[key]:
+                    try:
+                        (etag, je) = self._entityjson(key, entityname)
+                        entityparts.append('%s: %s' % (jsonencode(entityname), je))
+                    except KeyError:
+                        self.log.debug("No entity %s in key %s, leaving out.", entityname, key)
+            finally:
+                self.persist.locks.release_read(key)
+            keyparts.append('%s: {%s}' % (jsonencode(key), ', '.join(entityparts)))
+        # assembled from cached entity JSON, so nothing is re-encoded
+        jd = '{%s}' % ', '.join(keyparts)
+        return self._conditional(self._etag(jd), jd)
+
+    def _entityjson(self, key, entityname):
+        '''
+        Returns (etag, JSON) for entity, from cache if possible. Raises KeyError if 
+        there is no such entity. Caller holds the key's read lock. 
+        '''
+        try:
+            return self.entitycache[key][entityname]
+        except KeyError:
+            if self.entitylevel:
+                ed = self.persist.getentity(key, entityname)
+            else:
+                currentdoc = self.persist.getdocument(key)
+                self.log.debug("Current doc for %s is %s", key, currentdoc)
+                ed = currentdoc[entityname]
+            je = jsonencode(ed)
+            etag = self._etag(je)
+            self.entitycache.setdefault(key, {})[entityname] = (etag, je)
+            return (etag, je)
 
 
     def deleteentity(self, key, entityname):
         '''
         deletes relevant entity, if it exists. 
         '''
-        self.persist.lock.acquire()
+        self.persist.locks.acquire_write(key)
         try:
-            doc = self.persist.getdocument(key)
-            self.log.debug("Deleting entity %s in key %s" % (entityname, key))
-            doc.pop(entityname)
-            self.persist.storedocument(key, doc)
+            self._invalidate(key, entityname)
+            self.log.debug("Deleting entity %s in key %s", entityname, key)
+            if self.entitylevel:
+                self.persist.deleteentity(key, entityname)
+            else:
+                doc = self.persist.getdocument(key)
+                doc.pop(entityname)
+                self.persist.storedocument(key, doc)
+            self._updated(key, entityname, None)
             self.log.debug("Successfully stored.")            
         except KeyError:
             cherrypy.response.status = 405
             return "Entity %s not found, so can't delete it." % entityname
         finally:
-            self.persist.lock.release()   
+            self.persist.locks.release_write(key)   
+
+    def batch(self, ops):
+        '''
+        Applies a list of entity operations as a unit: if any of them would fail, none 
+        is applied. 
+
+        [ { "op" : "store",  "key" : "<key>", "entityname" : "<name>", "data" : { "<name>" : {...} } },
+          { "op" : "merge",  "key" : "<key>", "entityname" : "<name>", "data" : { "<name>" : {...} } },
+          { "op" : "delete", "key" : "<key>", "entityname" : "<name>" },
+          ...
+        ]
+
+        Each operation behaves as storeentity(), mergeentity() or deleteentity() would, 
+        and sees the effect of earlier ones in the list. All keys involved stay write-locked 
+        until the whole batch is written, so no reader sees part of it. 
+
+        On failure answers 405 with JSON { "index" : <failed op>, "reason" : "<text>" }.
+        '''
+        keys = [ op.get('key') for op in ops ]
+        self.persist.locks.acquire_write_many(keys)
+        try:
+            docs = {}        # key documents, for document-level back ends
+            existed = {}     # (key, entityname) : entity existed before the batch
+            staged = {}      # (key, entityname) : new entity, or None if deleted
+            order = []
+            for (i, op) in enumerate(ops):
+                try:
+                    (opname, key, entityname) = (op['op'], op['key'], op['entityname'])
+                    ke = (key, entityname)
+                    if ke in staged:
+                        current = staged[ke]
+                    else:
+                        current = self._batchcurrent(key, entityname, docs)
+                        existed[ke] = current is not None
+                        order.append(ke)
+
+                    if opname == 'store':
+                        if current is not None:
+                            return self._batchfailed(i, "Attempt to create (POST) already-existing Entity. Name: %s. " % entityname)
+                        staged[ke] = op['data'][entityname]
+                    elif opname == 'merge':
+                        if current is None:
+                            return self._batchfailed(i, "Attempt to update (PUT) non-existent Entity. Name: %s. " % entityname)
+                        newentity = dict(current)
+                        self.entitymerge(op['data'][entityname], newentity)
+                        staged[ke] = newentity
+                    elif opname == 'delete':
+                        if current is None:
+                            return self._batchfailed(i, "Entity %s not found, so can't delete it." % entityname)
+                        staged[ke] = None
+                    else:
+                        return self._batchfailed(i, "Unknown operation '%s'. " % opname)
+                except (KeyError, TypeError, AttributeError):
+                    return self._batchfailed(i, "Malformed operation %s. " % op)
+
+            for (key, entityname) in order:
+                self._invalidate(key, entityname)
+            if self.entitylevel:
+                for ke in order:
+                    if staged[ke] is not None:
+                        self.persist.storeentity(ke[0], ke[1], staged[ke])
+                    elif existed[ke]:
+                        self.persist.deleteentity(ke[0], ke[1])
+            else:
+                for ke in order:
+                    if staged[ke] is not None:
+                        docs[ke[0]][ke[1]] = staged[ke]
+                    else:
+                        docs[ke[0]].pop(ke[1], None)
+                for key in docs.keys():
+                    self.persist.storedocument(key, docs[key])
+            for ke in order:
+                self._updated(ke[0], ke[1], staged[ke])
+            self.log.debug("Successfully applied batch of %d operations.", len(ops))
+            return "Applied %d operations\n" % len(ops)
+        finally:
+            self.persist.locks.release_write_many(keys)
+
+    def _batchcurrent(self, key, entityname, docs):
+        '''
+        Returns stored entity, or None if there is none. Caller holds the key's write lock. 
+        '''
+        if self.entitylevel:
+            try:
+                return self.persist.getentity(key, entityname)
+            except KeyError:
+                return None
+        if key not in docs:
+            docs[key] = self.persist.getdocument(key)
+        return docs[key].get(entityname)
+
+    def _batchfailed(self, index, reason):
+        self.log.debug("Batch operation %d failed: %s", index, reason)
+        cherrypy.response.status = 405
+        return jsonencode({ 'index' : index, 'reason' : reason })
 
 ################################################################################
 #                     Category document-oriented methods
@@ -196,60 +501,255 @@ class InfoHandler(object):
         '''
         Overwrites existing document with new.
         '''
-        self.log.debug("Storing document for key %s" % key)
-        pd = json.loads(doc)
-        self.persist.lock.acquire()
+        self.log.debug("Storing document for key %s", key)
+        pd = jsondecode(doc)
+        self.persist.locks.acquire_write(key)
         try:
+            self._invalidate(key)
             self.persist.storedocument(key, pd)
+            self._replaced(key, pd)
         finally:
-            self.persist.lock.release()
+            self.persist.locks.release_write(key)
     
     def mergedocument(self, key, doc):
-        self.log.debug("Merging document for key %s" % key)
-        self.persist.lock.acquire()
-        try:
-            dcurrent = self.persist.getdocument(key)
-            #pd = json.loads(doc)
-            
-            self.persist.storedocument(key, pd)
-        finally:
-            self.persist.lock.release()
-
-        self.persist.lock.acquire()
+        self.log.debug("Merging document for key %s", key)
+        self.persist.locks.acquire_write(key)
         try:
+            self._invalidate(key)
             dcurrent = self.persist.getdocument(key)
-            self.log.debug("current retrieved doc is type %s" % type(dcurrent))
-            md = json.loads(doc)
-            self.log.debug("doc to merge is type %s" % type(md))
+            self.log.debug("current retrieved doc is type %s", type(dcurrent))
+            md = jsondecode(doc)
+            self.log.debug("doc to merge is type %s", type(md))
             newdoc = self.merge( md, dcurrent)
-            self.log.debug("Merging document for key %s" % key)
+            self.log.debug("Merging document for key %s", key)
             self.persist.storedocument(key, newdoc)
+            self._replaced(key, newdoc)
         finally:
-            self.persist.lock.release()      
+            self.persist.locks.release_write(key)      
 
     def deletedocument(self, key):
-        self.log.debug("Deleting document for key %s" % key)
-        #pd = json.loads(doc)
-        self.persist.lock.acquire()
+        self.log.debug("Deleting document for key %s", key)
+        #pd = jsondecode(doc)
+        self.persist.locks.acquire_write(key)
         emptydict = {}
         try:
+            self._invalidate(key)
             self.persist.storedocument(key, emptydict)
+            self._replaced(key, emptydict)
         finally:
-            self.persist.lock.release()
+            self.persist.locks.release_write(key)
 
     def getdocument(self, key):
         '''
         Gets JSON representation of document. 
         '''
-        pd = self.persist.getdocument(key)
-        jd = json.dumps(pd)
-        self.log.debug("d is type %s" % type(jd))
+        self.persist.locks.acquire_read(key)
+        try:
+            try:
+                (etag, jd) = self.doccache[key]
+            except KeyError:
+                pd = self.persist.getdocument(key)
+                jd = jsonencode(pd)
+                etag = self._etag(jd)
+                self.doccache[key] = (etag, jd)
+        finally:
+            self.persist.locks.release_read(key)
+        self.log.debug("d is type %s", type(jd))
+        return self._conditional(etag, jd)
+
+    def querydocument(self, key, where=None, fields=None):
+        '''
+        Gets JSON representation of the entities of document <key> that match all 
+        conditions in <where>, with only the attributes in <fields>. 
+
+        <where> is a list of "<attribute>:<value>" strings. An entity matches if the
+        attribute equals the value or, for a list attribute, contains it. 
+        <fields> is a list of attribute names, or None for all of them. 
+
+        Conditions on name or on an indexed attribute select the candidate entities 
+        directly, so only those are looked at. 
+
+        { '<entityname>' : { '<field1>' : '<val1>', ... },
+          ...
+        }
+        '''
+        conditions = self._conditions(where)
+        result = {}
+        self.persist.locks.acquire_read(key)
+        try:
+            candidates = self._candidates(key, conditions)
+            if candidates is None:
+                entities = self.persist.getdocument(key).iteritems()
+            else:
+                entities = self._entities(key, candidates)
+            for (entityname, entity) in entities:
+                if self._matches(entity, conditions):
+                    result[entityname] = self._project(entity, fields)
+            jd = jsonencode(result)
+        finally:
+            self.persist.locks.release_read(key)
+        self.log.debug("%d entities in %s match %s", len(result), key, where)
+        return self._conditional(self._etag(jd), jd)
+
+    def _candidates(self, key, conditions):
+        '''
+        Returns set of names of the entities of <key> that may match <conditions>, 
+        from the name and index conditions among them, or None if there are none. 
+        '''
+        candidates = None
+        for (attribute, value) in conditions:
+            if attribute == 'name':
+                names = set([value])
+            elif self.index.indexed(key, attribute):
+                names = self.index.lookup(key, attribute, value)
+            else:
+                continue
+            if candidates is None:
+                candidates = names
+            else:
+                candidates &= names
+        return candidates
+
+    def _entities(self, key, names):
+        '''
+        Yields (entityname, entity) for those of <names> that exist in <key>. 
+        '''
+        if self.entitylevel:
+            for entityname in names:
+                try:
+                    yield (entityname, self.persist.getentity(key, entityname))
+                except KeyError:
+                    pass
+        else:
+            pd = self.persist.getdocument(key)
+            for entityname in names:
+                if entityname in pd:
+                    yield (entityname, pd[entityname])
+
+    def _conditions(self, where):
+        '''
+        Parses list of "<attribute>:<value>" into list of (attribute, value). 
+        '''
+        conditions = []
+        for w in where or []:
+            try:
+                (attribute, value) = w.split(':', 1)
+            except ValueError:
+                raise cherrypy.HTTPError(400, "Invalid condition '%s'. Expected <attribute>:<value>" % w)
+            conditions.append((attribute, value))
+        return conditions
+
+    def _matches(self, entity, conditions):
+        for (attribute, value) in conditions:
+            v = entity.get(attribute)
+            if isinstance(v, list):
+                if value not in [ unicode(x) for x in v ]:
+                    return False
+            elif v is None or unicode(v) != value:
+                return False
+        return True
+
+    def _project(self, entity, fields):
+        if fields is None:
+            return entity
+        pe = {}
+        for f in fields:
+            if f in entity:
+                pe[f] = entity[f]
+        return pe
+
+    def getchanges(self, key, since, timeout):
+        '''
+        Gets JSON of the entities of <key> changed after revision <since>, waiting up to 
+        <timeout> seconds for a change if there is none yet. 
+
+        { 'key'      : '<key>',
+          'revision' : <current revision of key>,
+          'reset'    : <true if 'changed' is the whole document>,
+          'changed'  : { '<entityname>' : { 'name' : '<entityname>', ... }, ... },
+          'deleted'  : [ '<entityname>', ... ]
+        }
+
+        Pass the returned revision as <since> of the next call. A <since> of 0, or one
+        from before a restart of the infoservice, gets the whole document. 
+        '''
+        self.changes.wait(key, since, timeout)
+        changed = {}
+        deleted = []
+        self.persist.locks.acquire_read(key)
+        try:
+            (revision, names) = self.changes.since(key, since)
+            if names is None:
+                changed = self.persist.getdocument(key)
+            else:
+                changed = dict(self._entities(key, names))
+                deleted = [ n for n in names if n not in changed ]
+            jd = jsonencode({ 'key'      : key,
+                              'revision' : revision,
+                              'reset'    : names is None,
+                              'changed'  : changed,
+                              'deleted'  : deleted })
+        finally:
+            self.persist.locks.release_read(key)
+        self.log.debug("%d changed and %d deleted entities in %s since revision %d", len(changed), len(deleted), key, since)
         return jd
 
+    def getrevisions(self, keys):
+        '''
+        Gets JSON of the current revision of each of <keys>, as getchanges() returns it, 
+        without any entities. 
+
+        { '<key>' : <revision>, ... }
+        '''
+        return jsonencode(dict([ (key, self.changes.revision(key)) for key in keys ]))
+
 ################################################################################
 #                     Utility methods
 ################################################################################
 
+    def _updated(self, key, entityname, entity):
+        '''
+        Records new value <entity> (None if deleted) of <entityname> in the indexes 
+        and change feed. Caller holds the key's write lock. 
+        '''
+        self.index.update(key, entityname, entity)
+        self.changes.changed(key, entityname, entity is None)
+
+    def _replaced(self, key, doc):
+        '''
+        Like _updated() for a write of the whole document <key>. 
+        '''
+        self.index.reindex(key, doc)
+        self.changes.replaced(key)
+
+    def _invalidate(self, key, entityname=None):
+        '''
+        Drops cached JSON for document <key> and for entity <entityname>, or 
+        for all its entities if no entityname is given. Caller holds the key's write lock.
+        '''
+        self.doccache.pop(key, None)
+        if entityname is None:
+            self.entitycache.pop(key, None)
+        else:
+            self.entitycache.get(key, {}).pop(entityname, None)
+
+    def _etag(self, jsonstr):
+        return '"%s"' % hashlib.md5(jsonstr).hexdigest()
+
+    def _conditional(self, etag, body):
+        '''
+        Sets ETag on the response. If the client already has this version 
+        (If-None-Match), answers 304 with no body. 
+        '''
+        cherrypy.response.headers['ETag'] = etag
+        inm = cherrypy.request.headers.get('If-None-Match')
+        if inm:
+            tags = [ t.strip() for t in inm.split(',') ]
+            if etag in tags or '*' in tags:
+                cherrypy.response.status = 304
+                return ''
+        return body
+
 #    def _getpythondocument(self, key):
 #        '''
 #        Gets Python object. 
@@ -278,45 +778,75 @@ class InfoHandler(object):
             Primitive values are overwritten. 
             NOTE: tuples and arbitrary objects are not handled as it is totally ambiguous what should happen
             https://stackoverflow.com/questions/7204805/dictionaries-of-dictionaries-merge/15836901
+
+            Nested dictionaries are merged from a stack rather than by recursion, and 
+            list items are de-duplicated through a set where they are hashable. 
+            '''
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("Handling merging %s into %s ", src, dest)
+            stack = []
+            merged = self._mergevalue(src, dest, stack)
+            while stack:
+                (s, d) = stack.pop()
+                for key in s:
+                    if key in d:
+                        d[key] = self._mergevalue(s[key], d[key], stack, key)
+                    else:
+                        d[key] = s[key]
+            return merged
+
+    def _mergevalue(self, src, dest, stack, key=None):
+            '''
+            Merges src into dest for merge() and returns the result. Pairs of dictionaries 
+            are pushed onto <stack>, to be merged in place by the caller. 
             '''
-            key = None
-            # ## debug output
-            # sys.stderr.write("DEBUG: %s to %s\n" %(b,a))
-            self.log.debug("Handling merging %s into %s " % (src, dest))
             try:
-                if dest is None or isinstance(dest, str) or isinstance(dest, unicode) or isinstance(dest, int) \
-                             or isinstance(dest, long) or isinstance(dest, float):
+                if dest is None or isinstance(dest, (str, unicode, int, long, float)):
                     # border case for first run or if a is a primitive
-                    dest = src
+                    return src
                 elif isinstance(dest, list):
                     # lists can be only appended
                     if isinstance(src, list):
-                        # merge lists
-                        for item in src:
-                            if item not in dest:
-                                dest.append(item)
-                        #dest.extend(src)
+                        self._mergelist(src, dest)
                     else:
-                        self.log.error("Refusing to add non-list %s to list %s" % (src, dest))
-                        # append to list
-                        #dest.append(src)
+                        self.log.error("Refusing to add non-list %s to list %s", src, dest)
+                    return dest
                 elif isinstance(dest, dict):
                     # dicts must be merged
                     if isinstance(src, dict):
-                        for key in src:
-                            if key in dest:
-                                dest[key] = self.merge(src[key], dest[key])
-                            else:
-                                dest[key] = src[key]
+                        stack.append((src, dest))
+                        return dest
                     elif src is None:
-                        dest = None
+                        return None
                     else:
-                        self.log.warning("Cannot merge non-dict %s into dict %s" % (src, dest))
+                        self.log.warning("Cannot merge non-dict %s into dict %s", src, dest)
+                        return dest
                 else:
                     raise Exception('NOT IMPLEMENTED "%s" into "%s"' % (src, dest))
             except TypeError, e:
                 raise Exception('TypeError "%s" in key "%s" when merging "%s" into "%s"' % (e, key, src, dest))
-            return dest
+
+    def _mergelist(self, src, dest):
+            '''
+            Appends the items of list src not already in list dest to it, in order. 
+            '''
+            seen = set()
+            unhashable = []
+            for item in dest:
+                try:
+                    seen.add(item)
+                except TypeError:
+                    unhashable.append(item)
+            for item in src:
+                try:
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                except TypeError:
+                    if item in unhashable:
+                        continue
+                    unhashable.append(item)
+                dest.append(item)
 
 
 ##################################################################################
@@ -331,25 +861,25 @@ class InfoHandler(object):
         failmsg="Invalid pairing code or not satisfied yet. Try in 30 seconds."
         prd = None
         pd = self._getpythondocument(key)
-        self.log.debug("Received dict: %s" % pd)
+        self.log.debug("Received dict: %s", pd)
         try:        
-            self.log.debug("Entries are %s" % pd[key] )
+            self.log.debug("Entries are %s", pd[key])
             for p in pd[key].keys():
-                self.log.debug("Checking entry %s for pairingcode..." % p)
+                self.log.debug("Checking entry %s for pairingcode...", p)
                 if pd[key][p]['pairingcode'] == pairingcode:
-                    self.log.debug("Found matching entry %s value %s" % (p, pd[key][p]))
+                    self.log.debug("Found matching entry %s value %s", p, pd[key][p])
                     if pd[key][p]['cert'] is not None:
-                        prd = json.dumps(pd[key][p])
+                        prd = jsonencode(pd[key][p])
                         try:
-                            self.log.debug("Attempting to delete entry %s from pairing." % p)
+                            self.log.debug("Attempting to delete entry %s from pairing.", p)
                             pd[key].pop(p, None)
-                            self.log.debug("Deleted entry %s from pairing. Re-storing.." % p)
+                            self.log.debug("Deleted entry %s from pairing. Re-storing..", p)
                         except KeyError:
                             self.log.warning("Failed to delete entry %s from pairing." % p)
                         self._storepythondocument(key, pd)
                     else:
                         self.log.info("Certificate for requested pairing not generated yet.")
-            self.log.debug("Returning pairing entry JSON %s" % prd)
+            self.log.debug("Returning pairing entry JSON %s", prd)
             if prd is None:
                 cherrypy.response.headers["Status"] = "404"
                 return failmsg
@@ -375,9 +905,27 @@ class InfoRoot(object):
     def generate(self, length=8):
         return ''.join(random.sample(string.hexdigits, int(length)))
 
+def requestdata(data):
+    '''
+    JSON text sent with a PUT or POST. Clients send it as the request body, gzip-compressed
+    if marked with Content-Encoding: gzip. The older form, a 'data' query (or form) 
+    parameter, is still accepted and used if given. 
+    '''
+    if data is not None:
+        return data
+    body = cherrypy.request.body.read()
+    if cherrypy.request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        try:
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        except zlib.error, e:
+            raise cherrypy.HTTPError(400, "Could not decompress request body. (%s)" % e)
+    return body.decode('utf-8')
+
+
 class InfoServiceAPI(object):
     ''' 
         Data at this level is assumed to be  JSON text/plain. 
+        PUT and POST take it as request body, or as 'data' parameter. 
     
     '''
     exposed = True 
@@ -386,33 +934,41 @@ class InfoServiceAPI(object):
         self.log = logging.getLogger()
         self.log.debug("Initting InfoServiceAPI...")
         self.infohandler = InfoHandler(config)
+        self.batch = InfoBatchAPI(self.infohandler)
+        self.changes = InfoChangesAPI(self.infohandler)
+        self.revisions = InfoRevisionsAPI(self.infohandler)
         self.log.debug("InfoServiceAPI init done." )
     
-    def GET(self, key, pairingcode=None, entityname=None):
-        if pairingcode is None and entityname is None:
+    def GET(self, key, pairingcode=None, entityname=None, where=None, fields=None):
+        if pairingcode is None and entityname is None and (where is not None or fields is not None):
+            d = self.infohandler.querydocument(key, self.aslist(where), self.fieldlist(fields))
+            self.log.debug("Query done for key %s", key)
+            return d
+        elif pairingcode is None and entityname is None:
             d = self.infohandler.getdocument(key) 
-            self.log.debug("Document retrieved for key %s " % key)
+            self.log.debug("Document retrieved for key %s ", key)
             return d
         elif pairingcode is None:
             e = self.infohandler.getentity(key, entityname) 
-            self.log.debug("Entity retrieved for key %s and name %s" % (key,entityname))
+            self.log.debug("Entity retrieved for key %s and name %s", key, entityname)
             return e
         else:
             self.log.debug("Handling pairing retrieval")
             d = self.infohandler.getpairing(key, pairingcode)
-            self.log.debug("Pairing retrieved for code %s with val %s" % (pairingcode,d))
+            self.log.debug("Pairing retrieved for code %s with val %s", pairingcode, d)
             return d
 
     @cherrypy.tools.accept(media='text/plain')
     def PUT(self, key, entityname=None, data=None):
         rtext = "Something went wrong..."
+        data = requestdata(data)
         if entityname is None:
-            self.log.debug("Storing document %s" % data)
+            self.log.debug("Storing document %s", data)
             self.infohandler.mergedocument(key, data)
-            self.log.debug("Document stored for key %s" % key)
+            self.log.debug("Document stored for key %s", key)
             rtext= "Document stored for key %s\n" % key
         else:
-            self.log.debug("Storing key %s entityname %s " % (key, entityname))
+            self.log.debug("Storing key %s entityname %s ", key, entityname)
             self.infohandler.mergeentity(key, entityname, data)
             rtext= "Entity %s stored in key %s\n" % (entityname, key )
         return rtext
@@ -420,17 +976,33 @@ class InfoServiceAPI(object):
         
     def POST(self, key, entityname=None, data=None):
         rtext = "Something went wrong..."
+        data = requestdata(data)
         if entityname is None:
-            self.log.debug("Storing document %s" % data)
+            self.log.debug("Storing document %s", data)
             self.infohandler.storedocument(key, data)
-            self.log.debug("Document stored for key %s" % key)
+            self.log.debug("Document stored for key %s", key)
             rtext= "Document stored for key %s\n" % key
         else:
-            self.log.debug("Storing key %s entityname %s " % (key, entityname))
+            self.log.debug("Storing key %s entityname %s ", key, entityname)
             self.infohandler.storeentity(key, entityname, data)
             rtext= "Entity %s stored in key %s\n" % (entityname, key )
         return rtext
         
+    def PATCH(self, key, entityname, path, data=None):
+        '''
+        Sets the value at <path> within the entity to the JSON value sent. <path> is a
+        JSON pointer, e.g. /statusraw/<factoryid>. See InfoHandler.patchentity(). 
+        '''
+        value = jsondecode(requestdata(data))
+        if not path.startswith('/'):
+            raise cherrypy.HTTPError(400, "Invalid path '%s'. Expected /<attribute>[/<key>...]" % path)
+        plist = [ p.replace('~1', '/').replace('~0', '~') for p in path[1:].split('/') ]
+        self.log.debug("Patching key %s entityname %s path %s", key, entityname, plist)
+        rtext = self.infohandler.patchentity(key, entityname, plist, value)
+        if rtext is None:
+            rtext = "Entity %s patched at %s in key %s\n" % (entityname, path, key)
+        return rtext
+
     def DELETE(self, key, entityname ):
         '''
         Deletes specified entity from <key> document. 
@@ -444,6 +1016,96 @@ class InfoServiceAPI(object):
         rs = s.replace("'","")
         return rs
 
+    def aslist(self, param):
+        '''
+        Values of a query parameter that may be repeated. 
+        '''
+        if param is None:
+            return []
+        if isinstance(param, list):
+            return param
+        return [param]
+
+    def fieldlist(self, fields):
+        '''
+        Comma-separated (or repeated) fields parameter as list, or None if not given. 
+        '''
+        if fields is None:
+            return None
+        fl = []
+        for f in self.aslist(fields):
+            fl.extend([ x.strip() for x in f.split(',') if x.strip() ])
+        return fl
+
+
+class InfoBatchAPI(object):
+    '''
+        /info/batch
+        Operations on several entities in one call. 
+
+        GET  ?entities=[["<key>", "<entityname>"], ...]   (JSON)
+        POST [{"op" : ..., "key" : ..., "entityname" : ..., "data" : ...}, ...]   
+             (JSON body or data parameter, see InfoHandler.batch())
+    '''
+    exposed = True
+
+    def __init__(self, infohandler):
+        self.log = logging.getLogger()
+        self.infohandler = infohandler
+
+    def GET(self, entities):
+        pairs = jsondecode(entities)
+        self.log.debug("Retrieving %d entities", len(pairs))
+        return self.infohandler.getentities(pairs)
+
+    def POST(self, data=None):
+        ops = jsondecode(requestdata(data))
+        self.log.debug("Applying batch of %d operations", len(ops))
+        return self.infohandler.batch(ops)
+
+
+class InfoChangesAPI(object):
+    '''
+        /info/changes
+        Long-poll for changes of a key. 
+
+        GET ?key=<key>&since=<revision>[&timeout=<seconds>]
+            Returns as soon as <key> has changed after <revision>, or after <timeout>
+            seconds (default 30, at most MAXCHANGESTIMEOUT) with no changes. 
+            See InfoHandler.getchanges().
+    '''
+    exposed = True
+
+    def __init__(self, infohandler):
+        self.log = logging.getLogger()
+        self.infohandler = infohandler
+
+    def GET(self, key, since=0, timeout=30):
+        try:
+            since = int(since)
+            timeout = min(float(timeout), MAXCHANGESTIMEOUT)
+        except ValueError, e:
+            raise cherrypy.HTTPError(400, "Invalid since or timeout. (%s)" % e)
+        return self.infohandler.getchanges(key, since, timeout)
+
+
+class InfoRevisionsAPI(object):
+    '''
+        /info/revisions
+        Current revisions of keys, as returned by /info/changes. 
+
+        GET ?keys=<key>,<key>,...
+            See InfoHandler.getrevisions().
+    '''
+    exposed = True
+
+    def __init__(self, infohandler):
+        self.log = logging.getLogger()
+        self.infohandler = infohandler
+
+    def GET(self, keys):
+        return self.infohandler.getrevisions([ k.strip() for k in keys.split(',') if k.strip() ])
+
 
 class InfoService(object):
     
@@ -458,9 +1120,9 @@ class InfoService(object):
         self.httpsport = int(config.get('netcomm','httpsport'))
         self.sslmodule = config.get('netcomm','sslmodule')
         
-        self.log.debug("certfile=%s" % self.certfile)
-        self.log.debug("keyfile=%s" % self.keyfile)
-        self.log.debug("chainfile=%s" % self.chainfile)
+        self.log.debug("certfile=%s", self.certfile)
+        self.log.debug("keyfile=%s", self.keyfile)
+        self.log.debug("chainfile=%s", self.chainfile)
         
         self.log.debug('InfoService class done.')
         
@@ -468,9 +1130,13 @@ class InfoService(object):
         self.log.debug('Infoservice running...')
           
         cherrypy.tree.mount(InfoRoot())
-        cherrypy.tree.mount(InfoServiceAPI(self.config),'/info',
+        api = InfoServiceAPI(self.config)
+        if hasattr(api.infohandler.persist, 'shutdown'):
+            cherrypy.engine.subscribe('stop', api.infohandler.persist.shutdown)
+        cherrypy.tree.mount(api,'/info',
                                 {'/':
-        {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
+        {'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+         'request.methods_with_bodies': ('POST', 'PUT', 'PATCH')}
     })
         #cherrypy.tree.mount(InfoServiceAPI(self.config))
         
@@ -633,7 +1299,7 @@ John Hover <jhover@bnl.gov>
                 console.setLevel(self.options.logLevel)
                 self.log.addHandler(console)
         self.log.setLevel(self.options.logLevel)
-        self.log.info('Logging initialized at level %s.' % self.options.logLevel)
+        self.log.info('Logging initialized at level %s.', self.options.logLevel)
 
 
     def _printenv(self):
@@ -641,16 +1307,16 @@ John Hover <jhover@bnl.gov>
         envmsg = ''        
         for k in sorted(os.environ.keys()):
             envmsg += '\n%s=%s' %(k, os.environ[k])
-        self.log.debug('Environment : %s' %envmsg)
+        self.log.debug('Environment : %s', envmsg)
 
 
     def __platforminfo(self):
         '''
         display basic info about the platform, for debugging purposes 
         '''
-        self.log.info('platform: uname = %s %s %s %s %s %s' %platform.uname())
-        self.log.info('platform: platform = %s' %platform.platform())
-        self.log.info('platform: python version = %s' %platform.python_version())
+        self.log.info('platform: uname = %s %s %s %s %s %s', *platform.uname())
+        self.log.info('platform: platform = %s', platform.platform())
+        self.log.info('platform: python version = %s', platform.python_version())
         self._printenv()
 
     def __checkroot(self): 
@@ -664,7 +1330,7 @@ John Hover <jhover@bnl.gov>
         hostname = socket.gethostname()
         
         if os.getuid() != 0:
-            self.log.info("Already running as unprivileged user %s at %s" % (starting_uid_name, hostname))
+            self.log.info("Already running as unprivileged user %s at %s", starting_uid_name, hostname)
             
         if os.getuid() == 0:
             try:
@@ -680,7 +1346,7 @@ John Hover <jhover@bnl.gov>
                 self._changehome()
                 self._changewd()
 
-                self.log.info("Now running as user %d:%d at %s..." % (runuid, rungid, hostname))
+                self.log.info("Now running as user %d:%d at %s...", runuid, rungid, hostname)
                 self._printenv()
 
             
@@ -698,7 +1364,7 @@ John Hover <jhover@bnl.gov>
         '''
         runAs_home = pwd.getpwnam(self.options.runAs).pw_dir 
         os.environ['HOME'] = runAs_home
-        self.log.debug('Setting up environment variable HOME to %s' %runAs_home)
+        self.log.debug('Setting up environment variable HOME to %s', runAs_home)
 
 
     def _changewd(self):
@@ -707,7 +1373,7 @@ John Hover <jhover@bnl.gov>
         '''
         runAs_home = pwd.getpwnam(self.options.runAs).pw_dir
         os.chdir(runAs_home)
-        self.log.debug('Switching working directory to %s' %runAs_home)
+        self.log.debug('Switching working directory to %s', runAs_home)
 
 
     def __createconfig(self):
@@ -715,10 +1381,10 @@ John Hover <jhover@bnl.gov>
         """
         if self.options.confFiles != None:
             try:
-                self.log.debug("Conf file list %s" % self.options.confFiles)
+                self.log.debug("Conf file list %s", self.options.confFiles)
                 self.config = ConfigParser()
                 rfs = self.config.read(self.options.confFiles)
-                self.log.debug("Read config file(s) %s" % rfs)
+                self.log.debug("Read config file(s) %s", rfs)
             except Exception, e:
                 self.log.error('Config failure')
                 sys.exit(1)
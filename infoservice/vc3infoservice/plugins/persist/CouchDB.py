@@ -17,12 +17,12 @@ class CouchDB(InfoPersistencePlugin):
         self.log.debug("CouchDB persistence plugin initialized...")
         
     def storedocument(self, key, doc):
-        self.log.debug("Storing doc for key %s..." % key)
+        self.log.debug("Storing doc for key %s...", key)
         
         
         
     def getdocument(self, key):
-        self.log.debug("Getting doc for key %s..." % key)
+        self.log.debug("Getting doc for key %s...", key)
         
 
         
\ No newline at end of file
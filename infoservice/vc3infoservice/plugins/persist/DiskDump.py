@@ -1,16 +1,17 @@
 import errno
-import json
 import logging
 import os
 import time
 import tempfile
 
-from vc3infoservice.core import InfoPersistencePlugin
+from vc3infoservice.core import InfoPersistencePlugin, KeyLockManager, jsonencode, jsondecode
 
 class DiskDump(InfoPersistencePlugin):
     
     def __init__(self, parent, config, section ):
         super(DiskDump, self).__init__(parent, config, section)
+        # every store rewrites the whole file, so writes are serialized store-wide.
+        self.locks = KeyLockManager(perkey=False)
         self.documents = {}
 
         try:
@@ -22,14 +23,14 @@ class DiskDump(InfoPersistencePlugin):
         self.log.debug("DiskDump persistence plugin initialized...")
         
     def storedocument(self, key, doc):
-        self.log.debug("Storing doc for key %s..." % key)
+        self.log.debug("Storing doc for key %s...", key)
         self.documents[key] = doc
 
         self.store_db()
         return self.documents[key]
 
     def getdocument(self, key):
-        self.log.debug("Getting doc for key %s..." % key)
+        self.log.debug("Getting doc for key %s...", key)
         try:
             s = self.documents[key]
         except KeyError, e:
@@ -37,7 +38,7 @@ class DiskDump(InfoPersistencePlugin):
         return s
 
     def deletesubtree(self, path):
-        self.log.debug("Deleting path %s..." % str(path))
+        self.log.debug("Deleting path %s...", path)
 
         if len(path) < 1:
             return None
@@ -62,7 +63,7 @@ class DiskDump(InfoPersistencePlugin):
             self.log.warn('Diskdump could not be performed. Could not open temporary file. (%s)', e)
 
         try:
-            dump    = json.dumps(self.documents, sort_keys=True, indent=4, separators=(',', ': ')).encode('utf-8')
+            dump    = jsonencode(self.documents).encode('utf-8')
             tmpfile.write(dump)
             tmpfile.flush()
             tmpfile.close()
@@ -71,7 +72,7 @@ class DiskDump(InfoPersistencePlugin):
             written = os.stat(tmpfile.name).st_size
 
             if towrite == written:
-                self.log.debug('renaming Diskdump %s to %s' % (tmpfile.name, self.dbname))
+                self.log.debug('renaming Diskdump %s to %s', tmpfile.name, self.dbname)
                 os.rename(tmpfile.name, self.dbname)
             else:
                 self.log.warn('Diskdump could not be performed. Could not write the whole file. (%d != %d)', towrite, written)
@@ -82,7 +83,7 @@ class DiskDump(InfoPersistencePlugin):
     def load_db(self):
         try:
             with open(self.dbname, 'r') as infile:
-                self.documents = json.load(infile)
+                self.documents = jsondecode(infile.read())
         except IOError, e:
             if e.errno == errno.ENOENT:
                 self.log.warn("Could not load db file %s. (%s)" % (self.dbname, e))
@@ -0,0 +1,260 @@
+import errno
+import logging
+import os
+import threading
+import time
+import tempfile
+
+from vc3infoservice.core import InfoPersistencePlugin, jsonencode, jsondecode
+
+class Journal(InfoPersistencePlugin):
+    '''
+    Write-ahead log persistence plugin. Documents are kept in memory, as with DiskDump, but
+    each store appends a single compact record for the changed key or entity to a log file
+    rather than rewriting the whole store. A background thread periodically folds the log into a
+    snapshot file.
+
+    On startup the snapshot is loaded and the log replayed on top of it. Records hold
+    absolute values (not increments), so replaying a record twice is harmless.
+
+    The snapshot has the same format as a DiskDump file, so an existing diskdump can be
+    used as the initial snapshot.
+
+    Log record:
+        {"k": "<key>", "d": <document>}                  Document for <key> replaced
+        {"k": "<key>", "n": "<name>", "e": <entity>}     Entity <name> in <key> replaced
+        {"p": ["<key>", "<name>", ...]}                  Subtree at path deleted
+
+    '''
+    entitylevel = True
+
+    def __init__(self, parent, config, section ):
+        super(Journal, self).__init__(parent, config, section)
+        self.documents = {}
+        self.journallock = threading.Lock()
+        self.journal = None
+        self.records = 0
+
+        self.dbname = os.path.expanduser(self._getopt('filename', '~/var/infoservice.journal'))
+        self.logname = self.dbname + '.log'
+        self.compactname = self.dbname + '.compacting'
+        self.fsync = self._getopt('fsync', 'false').lower() in ['true', 'yes', '1']
+        self.compact_interval = int(self._getopt('compact_interval', '300'))
+        self.compact_records = int(self._getopt('compact_records', '1000'))
+
+        self.load_db()
+        if self.records > 0:
+            self.compact()
+        else:
+            self._openjournal()
+
+        self.stopevent = threading.Event()
+        self.compactor = threading.Thread(target=self._compactloop, name='journal-compactor')
+        self.compactor.daemon = True
+        self.compactor.start()
+        self.log.debug("Journal persistence plugin initialized...")
+
+    def _getopt(self, option, default):
+        if self.config.has_section(self.section) and self.config.has_option(self.section, option):
+            return self.config.get(self.section, option)
+        return default
+
+    def storedocument(self, key, doc):
+        self.log.debug("Storing doc for key %s...", key)
+        self.documents[key] = doc
+        self._append({'k' : key, 'd' : doc})
+        return self.documents[key]
+
+    def getdocument(self, key):
+        self.log.debug("Getting doc for key %s...", key)
+        try:
+            s = self.documents[key]
+        except KeyError, e:
+            s = {}
+        return s
+
+    def deletesubtree(self, path):
+        self.log.debug("Deleting path %s...", path)
+
+        if len(path) < 1:
+            return None
+
+        value = self._deletepath(self.documents, path)
+        self._append({'p' : list(path)})
+        return value
+
+    def getentity(self, key, entityname):
+        return self.documents[key][entityname]
+
+    def storeentity(self, key, entityname, entity):
+        self.log.debug("Storing entity %s for key %s...", entityname, key)
+        self.documents.setdefault(key, {})[entityname] = entity
+        self._append({'k' : key, 'n' : entityname, 'e' : entity})
+        return entity
+
+    def deleteentity(self, key, entityname):
+        self.log.debug("Deleting entity %s for key %s...", entityname, key)
+        value = self.documents[key].pop(entityname)
+        self._append({'p' : [key, entityname]})
+        return value
+
+    def shutdown(self):
+        '''
+        Stops the compaction thread and folds any outstanding log into the snapshot.
+        '''
+        self.stopevent.set()
+        self.locks.acquire_exclusive()
+        try:
+            if self.records > 0:
+                self.compact(locked=True)
+        finally:
+            self.locks.release_exclusive()
+
+################################################################################
+#                     Log and snapshot handling
+################################################################################
+
+    def _deletepath(self, documents, path):
+        last_dict = documents
+        for key in path[0 : -1]:
+            last_dict = last_dict[key]
+        value = last_dict[path[-1]]
+        del last_dict[path[-1]]
+        return value
+
+    def _openjournal(self):
+        self.journal = open(self.logname, 'a')
+
+    def _append(self, record):
+        line = jsonencode(record)
+        self.journallock.acquire()
+        try:
+            self.journal.write(line)
+            self.journal.write('\n')
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+            self.records += 1
+        except IOError, e:
+            self.log.error('Journal record could not be written. (%s)' % e)
+        finally:
+            self.journallock.release()
+
+    def _compactloop(self):
+        while not self.stopevent.wait(self.compact_interval):
+            if self.records >= self.compact_records:
+                try:
+                    self.compact()
+                except Exception, e:
+                    self.log.warn('Journal compaction failed. (%s)' % e)
+
+    def compact(self, locked=False):
+        '''
+        Writes the current documents as a new snapshot and starts an empty log.
+
+        The live log is set aside as <filename>.compacting while the snapshot is written,
+        so a crash at any point leaves snapshot + logs that replay to the current state.
+        '''
+        if not locked:
+            self.locks.acquire_exclusive()
+        try:
+            self.journallock.acquire()
+            try:
+                dump = jsonencode(self.documents).encode('utf-8')
+                if self.journal is not None:
+                    self.journal.close()
+                self._setaside()
+                self._openjournal()
+                compacted = self.records
+                self.records = 0
+            finally:
+                self.journallock.release()
+        finally:
+            if not locked:
+                self.locks.release_exclusive()
+
+        try:
+            tmpfile = tempfile.NamedTemporaryFile(mode = 'w', prefix = self.dbname, delete = False)
+        except IOError, e:
+            self.log.warn('Journal snapshot could not be written. Could not open temporary file. (%s)' % e)
+            return
+        try:
+            tmpfile.write(dump)
+            tmpfile.flush()
+            os.fsync(tmpfile.fileno())
+            tmpfile.close()
+            os.rename(tmpfile.name, self.dbname)
+        except Exception, e:
+            self.log.warn('Journal snapshot could not be written. (%s)' % e)
+            tmpfile.close()
+            os.remove(tmpfile.name)
+            return
+        if os.path.exists(self.compactname):
+            os.remove(self.compactname)
+        self.log.debug('Compacted %d journal records into %s', compacted, self.dbname)
+
+    def _setaside(self):
+        '''
+        Moves the live log to <filename>.compacting. If a previous compaction failed
+        and left one behind, the live log is appended to it instead.
+        '''
+        if not os.path.exists(self.logname):
+            return
+        if os.path.exists(self.compactname):
+            with open(self.compactname, 'a') as outfile:
+                with open(self.logname, 'r') as infile:
+                    outfile.write(infile.read())
+            os.remove(self.logname)
+        else:
+            os.rename(self.logname, self.compactname)
+
+    def load_db(self):
+        try:
+            with open(self.dbname, 'r') as infile:
+                self.documents = jsondecode(infile.read())
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                self.log.warn("Could not load snapshot file %s. (%s)" % (self.dbname, e))
+            else:
+                raise e
+        except ValueError, e:
+            self.log.error("Could not load snapshot file %s. (%s)" % (self.dbname, e))
+            os.rename(self.dbname, self.dbname + '.invalid.' + time.strftime('%Y%m%d.%H%M%S'))
+
+        for logname in [self.compactname, self.logname]:
+            self.records += self._replay(logname)
+
+    def _replay(self, logname):
+        '''
+        Applies records of log file <logname> to the in-memory documents.
+        Returns number of records applied.
+        '''
+        n = 0
+        try:
+            infile = open(logname, 'r')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return 0
+            raise e
+        try:
+            for line in infile:
+                try:
+                    record = jsondecode(line)
+                except ValueError, e:
+                    # only expected for a torn final write
+                    self.log.warn("Skipping unreadable record in %s. (%s)" % (logname, e))
+                    continue
+                if 'n' in record:
+                    self.documents.setdefault(record['k'], {})[record['n']] = record['e']
+                elif 'k' in record:
+                    self.documents[record['k']] = record['d']
+                elif 'p' in record:
+                    try:
+                        self._deletepath(self.documents, record['p'])
+                    except (KeyError, TypeError):
+                        pass
+                n += 1
+        finally:
+            infile.close()
+        self.log.debug("Replayed %d records from %s", n, logname)
+        return n
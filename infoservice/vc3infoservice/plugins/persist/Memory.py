@@ -1,31 +1,43 @@
 import logging
-import threading
 from vc3infoservice.core import InfoPersistencePlugin
 
 class Memory(InfoPersistencePlugin):
     '''
     Memory persistence plugin. Takes inbound Python primitive documents and simply keeps them in memory. 
     '''
+    entitylevel = True
+
     def __init__(self, parent, config, section ):
         super(Memory, self).__init__(parent, config, section)
-        self.lock = threading.Lock()
         self.documents = {}
         self.log.debug("Memory persistence plugin initialized...")
         
     def storedocument(self, key, doc):
-        self.log.debug("Storing doc for key %s..." % key)
+        self.log.debug("Storing doc for key %s...", key)
         self.documents[key] = doc
 
     def getdocument(self, key):
-        self.log.debug("Getting doc for key %s..." % key)
+        self.log.debug("Getting doc for key %s...", key)
         try:
             s = self.documents[key]
         except KeyError, e:
             s = {}
         return s
 
+    def getentity(self, key, entityname):
+        return self.documents[key][entityname]
+
+    def storeentity(self, key, entityname, entity):
+        self.log.debug("Storing entity %s for key %s...", entityname, key)
+        self.documents.setdefault(key, {})[entityname] = entity
+        return entity
+
+    def deleteentity(self, key, entityname):
+        self.log.debug("Deleting entity %s for key %s...", entityname, key)
+        return self.documents[key].pop(entityname)
+
     def _deletesubtree(self, path):
-        self.log.debug("Deleting path %s..." % str(path))
+        self.log.debug("Deleting path %s...", path)
 
         if len(path) < 1:
             return None
@@ -1,20 +1,131 @@
+'''
+
+SQLite persistence. Each entity of each key (document) is kept as its own row, indexed by
+(key, name), so entity operations only read or write a single row.
+
+'''
 
 import logging
-from vc3infoservice.core import InfoPersistencePlugin
+import os
+import sqlite3
+import threading
+
+from vc3infoservice.core import InfoPersistencePlugin, jsonencode, jsondecode
 
 class SQLite(InfoPersistencePlugin):
-    
+
+    entitylevel = True
+
     def __init__(self, parent, config, section ):
-        super(Memory, self).__init__(parent, config, section)
+        super(SQLite, self).__init__(parent, config, section)
+        self.local = threading.local()
+
+        self.dbname = '~/var/infoservice.sqlite'
+        if config.has_section(section) and config.has_option(section, 'filename'):
+            self.dbname = config.get(section, 'filename')
+        self.dbname = os.path.expanduser(self.dbname)
 
+        conn = self._connection()
+        conn.execute('''CREATE TABLE IF NOT EXISTS entities (
+                            key  TEXT NOT NULL,
+                            name TEXT NOT NULL,
+                            doc  TEXT NOT NULL,
+                            PRIMARY KEY (key, name)
+                        )''')
+        conn.commit()
         self.log.debug("SQLite persistence plugin initialized...")
-        
+
+    def _connection(self):
+        '''
+        sqlite3 connections may not be shared between threads, so each CherryPy
+        worker thread gets its own. WAL mode lets readers proceed while a write 
+        is in progress.
+        '''
+        try:
+            return self.local.conn
+        except AttributeError:
+            conn = sqlite3.connect(self.dbname, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            return conn
+
+################################################################################
+#                     Category document-oriented methods
+################################################################################
+
     def storedocument(self, key, doc):
-        self.log.debug("Storing doc for key %s..." % key)
+        self.log.debug("Storing doc for key %s...", key)
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM entities WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO entities (key, name, doc) VALUES (?, ?, ?)',
+                             [ (key, name, jsonencode(doc[name])) for name in doc.keys() ])
+        return doc
 
-        
-        
     def getdocument(self, key):
-        self.log.debug("Getting doc for key %s..." % key)
+        self.log.debug("Getting doc for key %s...", key)
+        doc = {}
+        cur = self._connection().execute('SELECT name, doc FROM entities WHERE key = ?', (key,))
+        for (name, edoc) in cur:
+            doc[name] = jsondecode(edoc)
+        return doc
+
+    def deletesubtree(self, path):
+        self.log.debug("Deleting path %s...", path)
+
+        if len(path) < 1:
+            return None
+        if len(path) == 1:
+            value = self.getdocument(path[0])
+            self.storedocument(path[0], {})
+            return value
+        if len(path) == 2:
+            return self.deleteentity(path[0], path[1])
+
+        entity = self.getentity(path[0], path[1])
+        last_dict = entity
+        for key in path[2 : -1]:
+            last_dict = last_dict[key]
+        value = last_dict[path[-1]]
+        del last_dict[path[-1]]
+        self.storeentity(path[0], path[1], entity)
+        return value
+
+################################################################################
+#                     Entity-oriented methods
+################################################################################
+
+    def getentity(self, key, entityname):
+        '''
+        Returns Python object for entity <entityname> in <key>.
+        Raises KeyError if there is no such entity.
+        '''
+        cur = self._connection().execute('SELECT doc FROM entities WHERE key = ? AND name = ?', (key, entityname))
+        row = cur.fetchone()
+        if row is None:
+            raise KeyError(entityname)
+        return jsondecode(row[0])
+
+    def storeentity(self, key, entityname, entity):
+        '''
+        Creates or replaces entity <entityname> in <key>.
+        '''
+        self.log.debug("Storing entity %s for key %s...", entityname, key)
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO entities (key, name, doc) VALUES (?, ?, ?)',
+                         (key, entityname, jsonencode(entity)))
+        return entity
 
-        
+    def deleteentity(self, key, entityname):
+        '''
+        Deletes entity <entityname> in <key> and returns its last value.
+        Raises KeyError if there is no such entity.
+        '''
+        self.log.debug("Deleting entity %s for key %s...", entityname, key)
+        conn = self._connection()
+        with conn:
+            value = self.getentity(key, entityname)
+            conn.execute('DELETE FROM entities WHERE key = ? AND name = ?', (key, entityname))
+        return value
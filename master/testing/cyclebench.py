@@ -0,0 +1,217 @@
+#!/bin/env python
+#
+# Benchmark of a master task cycle.
+#
+#   Runs the vcluster-lifecycle (InitResources, HandleAllocations) and the
+#   vcluster-requestcycle (HandleRequests) tasksets, laid out as in etc/tasks.conf and
+#   each with its own cycle cache, over N running virtual clusters, each with two
+#   nodesets, two allocations and an environment. A cycle starts the tasks of both at
+#   once. It is run without the cycle caches, with them, and with them and WORKERS
+#   request workers. The infoservice is an InfoHandler
+#   in this process behind a LocalInfoClient, so the time is the master's own cost,
+#   and each call the master makes is counted as one round trip, delayed by LATENCY
+#   milliseconds to stand in for the network. Between cycles one nodeset changes, so
+#   HandleRequests, which skips requests whose inputs are unchanged, sees every
+#   request as changed.
+#
+#   Usage:  cyclebench.py [N] [cycles] [latency_ms] [workers]
+#
+import logging
+import sys
+import threading
+import time
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.core import InfoEntityMissingException, jsonencode, jsondecode
+from vc3infoservice.infoclient import InfoClient
+from vc3infoservice.infoservice import InfoHandler
+from vc3client.client import VC3ClientAPI
+from vc3client.entities import Allocation, Cluster, Environment, Nodeinfo, Nodeset, Request, Resource
+from vc3master.task import VC3TaskSet
+
+# taskset : task plugins, as in etc/tasks.conf
+TASKSETS = [ ('vcluster-lifecycle', 'InitResources,HandleAllocations'),
+             ('vcluster-requestcycle', 'HandleRequests') ]
+
+
+class LocalInfoClient(InfoClient):
+    '''
+    InfoClient whose entity calls go straight to an InfoHandler. Counts reads and
+    writes, which may come from several request workers.
+    '''
+    def __init__(self, handler, latency):
+        self.log = logging.getLogger()
+        self.ih = handler
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def _roundtrip(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _getentitydict(self, key, entityname):
+        self._roundtrip('reads')
+        d = jsondecode(self.ih.getentities([[key, entityname]]))
+        try:
+            return d[key][entityname]
+        except KeyError:
+            raise InfoEntityMissingException("Attempted to get an Entity that doesn't exist. Name: %s" % entityname)
+
+    def _getentitiesdict(self, pairs):
+        self._roundtrip('reads')
+        return jsondecode(self.ih.getentities([ list(p) for p in pairs ]))
+
+    def getdocumentdict(self, key):
+        self._roundtrip('reads')
+        return jsondecode(self.ih.getdocument(key))
+
+    def _querydocumentdict(self, key, where=None, fields=None):
+        self._roundtrip('reads')
+        return jsondecode(self.ih.querydocument(key, [ '%s:%s' % (a, v) for (a, v) in (where or {}).items() ], fields))
+
+    def getchanges(self, key, since=0, timeout=30):
+        return jsondecode(self.ih.getchanges(key, since, timeout))
+
+    def getrevisions(self, keys):
+        self._roundtrip('reads')
+        return jsondecode(self.ih.getrevisions(keys))
+
+    def _storeentitydict(self, key, edict):
+        self._roundtrip('writes')
+        self.ih.storeentity(key, edict.keys()[0], jsonencode(edict))
+
+    def _mergeentitydict(self, key, edict):
+        self._roundtrip('writes')
+        self.ih.mergeentity(key, edict.keys()[0], jsonencode(edict))
+
+    def deleteentity(self, entityclass, entityname):
+        self._roundtrip('writes')
+        self.ih.deleteentity(entityclass.infokey, entityname)
+
+    def _sendbatch(self, ops):
+        self._roundtrip('writes')
+        self.ih.batch(ops)
+
+
+class Master(object):
+    def __init__(self, client):
+        self.client = client
+
+
+def makehandler():
+    config = ConfigParser()
+    config.add_section('persistence')
+    config.set('persistence', 'plugin', 'Memory')
+    config.add_section('plugin-memory')
+    return InfoHandler(config)
+
+
+def store(ih, klass, attributes):
+    entity = dict([ (a, None) for a in klass.infoattributes ])
+    entity.update(attributes)
+    ih.storeentity(klass.infokey, entity['name'], jsonencode({ entity['name'] : entity }))
+
+
+def fill(ih, n):
+    for i in range(4):
+        store(ih, Nodeinfo, { 'name' : 'nodeinfo%d' % i, 'cores' : 4, 'memory_mb' : 2048, 'storage_mb' : 4096 })
+        store(ih, Resource, { 'name' : 'resource%d' % i, 'accesstype' : 'batch', 'accessmethod' : 'ssh',
+                                'accessflavor' : 'slurm', 'accesshost' : 'login%d.example.org' % i, 'accessport' : 22,
+                                'nodeinfo' : 'nodeinfo%d' % i })
+        store(ih, Environment, { 'name' : 'env%d' % i, 'packagelist' : [ 'cctools' ], 'envmap' : { 'A' : 'B' },
+                                   'required_os' : None, 'builder_extra_args' : None, 'command' : None })
+    for u in range(max(1, n / 5)):
+        for i in range(2):
+            store(ih, Allocation, { 'name' : 'user%d.resource%d' % (u, i), 'owner' : 'user%d' % u, 'state' : 'ready',
+                                      'resource' : 'resource%d' % i, 'accountname' : 'user%d' % u,
+                                      'sectype' : 'ssh-rsa', 'pubtoken' : 'cHVi', 'privtoken' : 'cHJpdg==' })
+    for r in range(n):
+        u = r % max(1, n / 5)
+        name = 'request%d' % r
+        nodesets = [ '%s-nodeset%d' % (name, j) for j in range(2) ]
+        for ns in nodesets:
+            store(ih, Nodeset, { 'name' : ns, 'state' : 'new', 'node_number' : 5, 'app_type' : 'htcondor',
+                                   'app_role' : 'worker-nodes', 'environment' : 'env%d' % (r % 4) })
+        store(ih, Nodeset, { 'name' : 'headnode-for-' + name, 'state' : 'running', 'app_host' : '10.0.0.1',
+                               'app_sectoken' : 'c2VjcmV0', 'app_role' : 'head-node' })
+        store(ih, Cluster, { 'name' : name + '-cluster', 'nodesets' : nodesets })
+        statusraw = { 'factory1' : dict([ (ns, { 'user%d.resource0' % u : { 'aggregated' : { 'running' : 5, 'idle' : 0, 'error' : 0 } } })
+                                          for ns in nodesets ]) }
+        store(ih, Request, { 'name' : name, 'owner' : 'user%d' % u, 'state' : 'running', 'state_reason' : None,
+                               'action' : 'run', 'expiration' : None, 'cluster' : name + '-cluster',
+                               'allocations' : [ 'user%d.resource0' % u, 'user%d.resource1' % u ],
+                               'environments' : [ 'env%d' % (r % 4) ], 'headnode' : 'headnode-for-' + name,
+                               'statusraw' : statusraw, 'statusinfo' : None })
+
+
+def runcycle(tasksets):
+    '''
+    Starts every task of <tasksets> at once, the way VC3TaskSet.run() starts the tasks
+    that are due, and waits for them to finish. 
+    '''
+    schedules = [ s for ts in tasksets for s in ts.schedules ]
+    for s in schedules:
+        s.start(0)
+    for s in schedules:
+        s.join()
+
+
+def run(n, cycles, cache, latency, workers=1):
+    ih = makehandler()
+    fill(ih, n)
+    ic = LocalInfoClient(ih, latency)
+    client = VC3ClientAPI.__new__(VC3ClientAPI)
+    client.config = None
+    client.log = logging.getLogger('vc3client')
+    client.ic = ic
+
+    taskconfig = ConfigParser()
+    taskconfig.set('DEFAULT', 'polling_interval', '60')
+    taskconfig.set('DEFAULT', 'cache', str(cache))
+    for (section, plugins) in TASKSETS:
+        taskconfig.add_section(section)
+        taskconfig.set(section, 'taskplugins', plugins)
+    taskconfig.set('vcluster-requestcycle', 'request_workers', str(workers))
+    master = Master(client)
+    tasksets = [ VC3TaskSet(master, taskconfig, section) for (section, plugins) in TASKSETS ]
+
+    start = time.time()
+    for i in range(cycles):
+        ih.mergeentity('nodes', 'request0-nodeset0', jsonencode({ 'request0-nodeset0' : { 'node_number' : 5 + i % 2 } }))
+        runcycle(tasksets)
+    elapsed = time.time() - start
+    print("cache %-5s %2d workers %4d requests  %6.1f reads/cycle  %6.1f writes/cycle  %8.2fms/cycle" % (cache, workers, n,
+                                                                                           float(ic.reads) / cycles,
+                                                                                           float(ic.writes) / cycles,
+                                                                                           1000.0 * elapsed / cycles))
+    for ts in tasksets:
+        if ts.cache is not None:
+            print("    %-22s last cycle: %s" % (ts.section, ts.cache.counters()))
+    return elapsed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    n = 100
+    cycles = 5
+    latency = 1.0
+    workers = 8
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        cycles = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        workers = int(sys.argv[4])
+
+    print("%.1fms per round trip" % latency)
+    uncached = run(n, cycles, False, latency / 1000.0)
+    cached = run(n, cycles, True, latency / 1000.0)
+    parallel = run(n, cycles, True, latency / 1000.0, workers)
+    print("speedup %.1fx cached, %.1fx cached with %d workers" % (uncached / cached, uncached / parallel, workers))
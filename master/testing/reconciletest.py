@@ -0,0 +1,123 @@
+#!/bin/env python
+#
+# Test of the skipping of unchanged requests in HandleRequests.
+#
+#   Runs the request cycle over N running virtual clusters in an InfoHandler in this
+#   process, counting the requests HandleRequests processes, and checks that:
+#     - after the first cycle, unchanged requests are skipped,
+#     - a change to a request processes that request only,
+#     - a change to a nodeset processes every request but the parked ones,
+#     - terminated requests are parked and looked at every cold_passes cycles,
+#     - a parked request that changes is processed in the next cycle,
+#     - a request processed for a change of its status reuses its queues.conf and
+#       auth.conf, which are generated again when an allocation changes.
+#
+#   Usage:  reconciletest.py [N]
+#
+import logging
+import sys
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.core import jsonencode
+from vc3master.task import VC3TaskSet
+from vc3client.client import VC3ClientAPI
+
+from cyclebench import LocalInfoClient, Master, makehandler, fill, runcycle
+
+COLDPASSES = 4
+
+
+def maketaskset(ih):
+    client = VC3ClientAPI.__new__(VC3ClientAPI)
+    client.config = None
+    client.log = logging.getLogger('vc3client')
+    client.ic = LocalInfoClient(ih, 0)
+    config = ConfigParser()
+    config.add_section('test')
+    config.set('test', 'taskplugins', 'HandleRequests')
+    config.set('test', 'polling_interval', '60')
+    config.set('test', 'cold_passes', str(COLDPASSES))
+    ts = VC3TaskSet(Master(client), config, 'test')
+    hr = ts.tasks[0]
+    hr.processed = []
+    process_request = hr.process_request
+    def counting(request, *args):
+        hr.processed.append(request.name)
+        return process_request(request, *args)
+    hr.process_request = counting
+    hr.generated = []
+    for m in ['generate_queues_section', 'generate_auth_section']:
+        setattr(hr, m, generating(hr, getattr(hr, m)))
+    return (ts, hr)
+
+
+def generating(hr, generate):
+    def f(config, request, *args):
+        hr.generated.append(request.name)
+        return generate(config, request, *args)
+    return f
+
+
+def cycle(ts, hr):
+    hr.processed = []
+    runcycle([ts])
+    return sorted(hr.processed)
+
+
+def change(ih, key, name, **attributes):
+    ih.mergeentity(key, name, jsonencode({ name : attributes }))
+
+
+def check(label, ok):
+    print("%-60s %s" % (label, ok and 'OK' or 'FAIL'))
+    return ok
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    n = 20
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    ih = makehandler()
+    fill(ih, n)
+    (ts, hr) = maketaskset(ih)
+    results = []
+
+    results.append(check("first cycle processes every request", len(cycle(ts, hr)) == n))
+    cycle(ts, hr)
+    results.append(check("unchanged requests are skipped", cycle(ts, hr) == []))
+
+    change(ih, 'request', 'request3', action='terminate')
+    results.append(check("a changed request is processed alone", cycle(ts, hr) == ['request3']))
+
+    for r in range(5):
+        change(ih, 'request', 'request%d' % r, state='terminated', action='run')
+    cycle(ts, hr)
+    cycle(ts, hr)
+    change(ih, 'nodes', 'request10-nodeset0', node_number=7)
+    p = cycle(ts, hr)
+    results.append(check("a nodeset change processes all but the %d parked (%d)" % (5, len(p)),
+                         len(p) == n - 5 and 'request0' not in p))
+
+    seen = 0
+    for i in range(2 * COLDPASSES):
+        seen += cycle(ts, hr).count('request0')
+    results.append(check("parked request looked at every %d cycles (%d in %d)" % (COLDPASSES, seen, 2 * COLDPASSES),
+                         seen == 2))
+
+    change(ih, 'request', 'request1', action='relaunch')
+    results.append(check("a changed parked request is processed", 'request1' in cycle(ts, hr)))
+
+    hr.generated = []
+    change(ih, 'request', 'request7', statusraw={ 'factory1' : { 'request7-nodeset0' : {} } })
+    p = cycle(ts, hr)
+    results.append(check("a status change reuses the request's confs (%d generated)" % len(hr.generated),
+                         'request7' in p and hr.generated == []))
+    change(ih, 'allocation', 'user2.resource0', accountname='other')
+    p = cycle(ts, hr)
+    results.append(check("an allocation change generates them again (%d requests)" % len(set(hr.generated)),
+                         len(set(hr.generated)) == len(p) > 0))
+
+    if not all(results):
+        sys.exit(1)
@@ -0,0 +1,138 @@
+#!/bin/env python
+#
+# Test of the VC3TaskSet scheduler.
+#
+#   Runs a taskset of two task plugins whose runtask() is replaced by a counter, one
+#   taking longer than its interval, over an InfoHandler in this process, and checks
+#   that:
+#     - the fast task keeps its own interval while the slow one overruns,
+#     - overruns are counted instead of piling up runs of the slow task,
+#     - a change to a key in 'triggers' runs the tasks long before their interval,
+#     - the entity cache is not emptied while a task is running, though others start,
+#     - join() stops the scheduler and waits for the running tasks.
+#
+#   Usage:  schedtest.py
+#
+import logging
+import sys
+import threading
+import time
+
+from ConfigParser import ConfigParser
+
+from vc3infoservice.core import jsonencode
+from vc3master.task import VC3TaskSet
+
+from cyclebench import LocalInfoClient, Master, makehandler, store, fill
+from vc3client.client import VC3ClientAPI
+from vc3client.entities import Request
+
+
+class CountingTask(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.starts = []
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.maxbusy = 0
+
+    def runtask(self):
+        with self.lock:
+            self.starts.append(time.time())
+            self.busy += 1
+            self.maxbusy = max(self.maxbusy, self.busy)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.busy -= 1
+
+
+class ReadingTask(CountingTask):
+    '''
+    Reads a request before and after sleeping, and counts the second reads that 
+    had to go to the infoservice. 
+    '''
+    def __init__(self, seconds, client):
+        CountingTask.__init__(self, seconds)
+        self.client = client
+        self.refetched = 0
+
+    def runtask(self):
+        self.client.getRequest('request0')
+        before = self.client.ic.ic.reads
+        CountingTask.runtask(self)
+        self.client.getRequest('request0')
+        self.refetched += self.client.ic.ic.reads - before
+
+
+def maketaskset(ih, options):
+    client = VC3ClientAPI.__new__(VC3ClientAPI)
+    client.config = None
+    client.log = logging.getLogger('vc3client')
+    client.ic = LocalInfoClient(ih, 0)
+    config = ConfigParser()
+    config.add_section('test')
+    config.set('test', 'taskplugins', 'HandleRequests,HandleAllocations')
+    for (o, v) in options.items():
+        config.set('test', o, v)
+    ts = VC3TaskSet(Master(client), config, 'test')
+    return ts
+
+
+def check(label, ok):
+    print("%-60s %s" % (label, ok and 'OK' or 'FAIL'))
+    return ok
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    ih = makehandler()
+    fill(ih, 5)
+    results = []
+
+    # intervals and overruns
+    ts = maketaskset(ih, { 'polling_interval'                  : '0.2',
+                           'polling_interval.HandleAllocations' : '0.1',
+                           'deadline.HandleRequests'            : '0.1' })
+    (slow, fast) = (CountingTask(0.5), CountingTask(0.01))
+    ts.schedules[0].task = slow
+    ts.schedules[1].task = fast
+    ts.start()
+    time.sleep(2.05)
+    ts.join()
+    results.append(check("fast task ran every 0.1s while the slow one overran (%d runs)" % len(fast.starts),
+                         15 <= len(fast.starts) <= 25))
+    results.append(check("slow task ran back to back, never twice at once (%d runs)" % len(slow.starts),
+                         3 <= len(slow.starts) <= 5 and slow.maxbusy == 1))
+    results.append(check("overruns counted (%d)" % ts.schedules[0].overruns, ts.schedules[0].overruns >= 3))
+    results.append(check("join() stopped the scheduler and its tasks",
+                         not ts.isAlive() and not ts.schedules[0].running() and not ts.schedules[1].running()))
+
+    # cache cycles
+    ts = maketaskset(ih, { 'polling_interval'                  : '0.3',
+                           'polling_interval.HandleAllocations' : '0.05' })
+    (reading, fast) = (ReadingTask(0.25, ts.client), CountingTask(0.01))
+    ts.schedules[0].task = reading
+    ts.schedules[1].task = fast
+    ts.start()
+    time.sleep(1.0)
+    ts.join()
+    results.append(check("cache kept while other tasks ran (%d runs, %d refetched)" % (len(reading.starts), reading.refetched),
+                         len(reading.starts) >= 2 and len(fast.starts) > 2 * len(reading.starts) and reading.refetched == 0))
+
+    # triggers
+    ts = maketaskset(ih, { 'polling_interval' : '60', 'triggers' : 'request' })
+    tasks = [ CountingTask(0.01), CountingTask(0.01) ]
+    for (sch, t) in zip(ts.schedules, tasks):
+        sch.task = t
+    ts.start()
+    time.sleep(0.5)
+    store(ih, Request, { 'name' : 'triggered', 'owner' : 'user0', 'state' : 'new', 'action' : 'run' })
+    time.sleep(0.5)
+    start = time.time()
+    ts.join()
+    results.append(check("change to request ran the tasks again (%s runs)" % [ len(t.starts) for t in tasks ],
+                         [ len(t.starts) for t in tasks ] == [2, 2]))
+    results.append(check("join() returned at once (%.2fs)" % (time.time() - start), time.time() - start < 1))
+
+    if not all(results):
+        sys.exit(1)
@@ -98,6 +98,8 @@ class VC3Master(object):
       
     def shutdown(self):
         self.log.debug("Got shutdown command...")
+        for ts in self.tasksets:
+            ts.stop()
         for ts in self.tasksets:
             ts.join()
         self.log.debug("Done.")
@@ -3,6 +3,7 @@
 
 from vc3master.task import VC3Task
 from vc3infoservice.infoclient import InfoConnectionFailure, InfoEntityMissingException
+from vc3infoservice.core import ChangeTracker
 
 from base64 import b64encode
 import pluginmanager as pm
@@ -16,6 +17,9 @@ import time
 
 from novaclient import client as novaclient
 
+# Request states nothing happens in until the request itself changes. 
+TERMINAL = ['terminated', 'failure']
+
 class HandleHeadNodes(VC3Task):
     '''
     Plugin to manage the head nodes lifetime.
@@ -67,6 +71,13 @@ class HandleHeadNodes(VC3Task):
         # number of times we have tries to initialize a node. After node_max_initializing_count, declare failure.
         self.initializing_count = {}
 
+        # Requests in a TERMINAL state whose headnode is gone are only looked at again 
+        # if they change or every cold_passes cycles. 
+        coldpasses = 10
+        if self.config.has_option(section, 'cold_passes'):
+            coldpasses = max(1, self.config.getint(section, 'cold_passes'))
+        self.tracker = ChangeTracker(coldpasses)
+
         self.log.debug("HandleHeadNodes VC3Task initialized.")
 
     def runtask(self):
@@ -78,16 +89,31 @@ class HandleHeadNodes(VC3Task):
             n = len(requests) if requests else 0
             self.log.debug("Processing %d requests" % n)
             if requests:
+                self.tracker.newpass([ r.name for r in requests ])
                 for r in requests:
+                    fp = None
+                    if r.state in TERMINAL:
+                        fp = ChangeTracker.fingerprint(r.state, r.action, r.headnode)
+                    if not self.tracker.changed(r.name, fp):
+                        continue
+                    done = False
                     try:
-                        self.process_request(r)
+                        done = self.process_request(r)
                     except Exception, e:
                         self.log.warning("Request %s had an exception (%s)", r.name, e)
                         self.log.debug(traceback.format_exc(None))
+                    if done and fp is not None:
+                        self.tracker.handled(r.name, fp, cold=True)
+                    else:
+                        self.tracker.forget(r.name)
         except InfoConnectionFailure, e:
             self.log.warning("Could not read requests from infoservice. (%s)", e)
 
     def process_request(self, request):
+        '''
+        Returns True if there is no headnode for request, and none is needed in its 
+        current state. 
+        '''
         self.log.debug("Processing headnode for '%s'", request.name)
 
         headnode    = None
@@ -97,7 +123,7 @@ class HandleHeadNodes(VC3Task):
         if not request.headnode:
             # Request has not yet indicated the name it wants for the headnode,
             # so we simply return.
-            return
+            return True
 
         try:
             headnode = self.client.getNodeset(request.headnode)
@@ -112,7 +138,11 @@ class HandleHeadNodes(VC3Task):
                     headnode = self.create_headnode_nodeset(request)
                 elif request.state == 'cleanup' or request.state == 'terminated':
                     # Nothing to do, the headnode has been cleaned-up
-                    return
+                    return True
+                elif request.state == 'failure':
+                    # Nothing to do, the request failed before its headnode was created,
+                    # or the headnode has been cleaned-up
+                    return True
                 else:
                     # Something went wrong, the headnode should still be there.
                     self.log.error("Could not find headnode information for %s", request.name)
@@ -413,14 +443,14 @@ class HandleHeadNodes(VC3Task):
     def _get_members_attributes(self, request, attribute):
         members    = self.get_members_names(request)
 
-        attributes = {}
-        for member in members:
-            try:
-                user = self.client.getUser(member)
-            except Exception, e:
-                self.log.warning("Could not find user: %s", member)
-                raise e
+        try:
+            users = self.client.getUsers(members)
+        except Exception, e:
+            self.log.warning("Could not find users: %s", members)
+            raise e
 
+        attributes = {}
+        for (member, user) in zip(members, users):
             attr_value = getattr(user, attribute, None)
             if not attr_value:
                 self.log.warning('Could not find attribute: %s, for user %s',
@@ -444,8 +474,7 @@ class HandleHeadNodes(VC3Task):
 
     def get_builder_options(self, request):
         packages = []
-        for env_name in request.environments:
-            env = self.client.getEnvironment(env_name)
+        for env in self.client.getEnvironments(request.environments):
             if env.packagelist:
                 packages.extend(env.packagelist)
         return " ".join([ "--require %s" % p for p in packages ])
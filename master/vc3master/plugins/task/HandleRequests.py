@@ -8,14 +8,29 @@ import socket
 import os
 import json
 import math
+import threading
+import time
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 from vc3master.task import VC3Task
 from vc3infoservice.infoclient import InfoConnectionFailure,InfoEntityMissingException
+from vc3infoservice.core import ChangeTracker
+from vc3client.entities import Allocation, Environment, Nodeinfo, Resource
 
 import pluginmanager as pm
 import traceback
 
+# Infoservice keys of the entities process_request() reads besides the request. 
+DEPENDENCIES = ['nodes', 'cluster', 'allocation', 'resource', 'environment', 'project', 'user']
+
+# Request states nothing happens in until the request itself changes. 
+TERMINAL = ['terminated', 'failure']
+
+# Keys of the entities queues.conf and auth.conf are generated from. 
+QUEUESCONF_DEPENDENCIES = ['nodes', 'cluster', 'allocation', 'resource', 'environment']
+AUTHCONF_DEPENDENCIES = ['allocation', 'resource']
+
 class HandleRequests(VC3Task):
     '''
     Plugin to manage the life cycle of all requests.
@@ -25,40 +40,115 @@ class HandleRequests(VC3Task):
     def __init__(self, parent, config, section):
         super(HandleRequests, self).__init__(parent, config, section)
         self.client = parent.client
-        self.log.debug("HandleRequests VC3Task initialized.")
+
+        # Requests do not depend on each other. With request_workers > 1, that many are 
+        # processed at once by a pool of threads. A request is always processed and then 
+        # stored by the same worker, so its own steps keep their order. 
+        self.workers = 1
+        if self.config.has_option(self.section, 'request_workers'):
+            self.workers = max(1, self.config.getint(self.section, 'request_workers'))
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ThreadPool(self.workers)
+
+        # A request is processed again only if it, or a key in DEPENDENCIES, changed 
+        # since it was last handled. Requests in a TERMINAL state are only looked at 
+        # again if they change or every cold_passes cycles. 
+        coldpasses = 10
+        if self.config.has_option(self.section, 'cold_passes'):
+            coldpasses = max(1, self.config.getint(self.section, 'cold_passes'))
+        self.tracker = ChangeTracker(coldpasses)
+
+        # { (attribute, request name) : (fingerprint of inputs, encoded conf) } of the
+        # last queuesconf and authconf generated for each request. 
+        self.confs = {}
+        self.confslock = threading.Lock()
+        self.log.debug("HandleRequests VC3Task initialized with %d workers.", self.workers)
 
     def runtask(self):
-        self.log.info("Running task %s" % self.section)
+        self.log.info("Running task %s", self.section)
         self.log.debug("Polling master....")
 
+        start = time.time()
         try:
             requests = self.client.listRequests()
             n = len(requests) if requests else 0
-            self.log.debug("Processing %d requests" % n)
+            self.log.debug("Processing %d requests", n)
             if requests:
-                for r in requests:
-                    try:
-                        self.process_request(r)
-                    except VC3InvalidRequest, e:
-                        self.log.warning("Request %s is not valid. (%s)", r.name, e)
-                        r.state = 'failure'
-                        r.state_reason = 'Request invalid: ' + str(e)
-                    except Exception, e:
-                        self.log.warning("Request %s had a exception (%s)", r.name, e)
-                        self.log.debug(traceback.format_exc(None))
-                        r.state = 'failure'
-                        r.state_reason = str(e)
-
-                    try:
-                        self.client.storeRequest(r)
-                    except Exception, e:
-                        self.log.warning("Storing the new request state failed. (%s)", e)
-                        self.log.warning(traceback.format_exc(None))
+                revisions = self.dependency_revisions()
+                self.tracker.newpass([ r.name for r in requests ])
+                self.forget_confs([ r.name for r in requests ])
+                handle = lambda r: self.handle_request(r, revisions)
+                if self.pool:
+                    latencies = self.pool.map(handle, requests, 1)
+                else:
+                    latencies = map(handle, requests)
+                latencies = [ l for l in latencies if l is not None ]
+                self.log.info("Processed %d requests, skipped %d unchanged (%d parked), in %.2fs with %d workers (per request: mean %.2fs, max %.2fs)",
+                              len(latencies), n - len(latencies), self.tracker.counts()[1], time.time() - start, self.workers,
+                              sum(latencies) / max(1, len(latencies)), max(latencies or [0]))
 
         except InfoConnectionFailure, e:
             self.log.warning("Could not read requests from infoservice. (%s)", e)
 
-    def process_request(self, request):
+    def dependency_revisions(self):
+        '''
+        Returns { key : revision } of the keys in DEPENDENCIES, or None if the 
+        infoservice could not tell. 
+        '''
+        try:
+            revisions = self.client.ic.getrevisions(DEPENDENCIES)
+            return dict([ (key, revisions[key]) for key in DEPENDENCIES ])
+        except Exception, e:
+            self.log.debug("Could not get revisions of %s, processing every request. (%s)", DEPENDENCIES, e)
+            return None
+
+    def request_inputs(self, request, revisions):
+        '''
+        Fingerprint of what processing request depends on, or None if it also depends 
+        on the time. 
+        '''
+        values = [ getattr(request, a, None) for a in request.infoattributes ]
+        if request.state in TERMINAL:
+            return ChangeTracker.fingerprint(values)
+        if request.expiration or revisions is None:
+            return None
+        return ChangeTracker.fingerprint(values, revisions)
+
+    def handle_request(self, r, revisions=None):
+        '''
+        Processes request r and stores its new state. Returns the seconds it took, or 
+        None if r was skipped as unchanged. 
+        '''
+        if not self.tracker.changed(r.name, self.request_inputs(r, revisions)):
+            return None
+
+        start = time.time()
+        try:
+            self.process_request(r, revisions)
+        except VC3InvalidRequest, e:
+            self.log.warning("Request %s is not valid. (%s)", r.name, e)
+            r.state = 'failure'
+            r.state_reason = 'Request invalid: ' + str(e)
+        except Exception, e:
+            self.log.warning("Request %s had a exception (%s)", r.name, e)
+            self.log.debug(traceback.format_exc(None))
+            r.state = 'failure'
+            r.state_reason = str(e)
+
+        try:
+            self.client.storeRequest(r)
+            self.tracker.handled(r.name, self.request_inputs(r, revisions), r.state in TERMINAL)
+        except Exception, e:
+            self.log.warning("Storing the new request state failed. (%s)", e)
+            self.log.warning(traceback.format_exc(None))
+            self.tracker.forget(r.name)
+
+        latency = time.time() - start
+        self.log.debug("Request %s handled in %.3fs", r.name, latency)
+        return latency
+
+    def process_request(self, request, revisions=None):
         next_state  = None
         reason      = None
 
@@ -116,8 +206,10 @@ class HandleRequests(VC3Task):
             self.log.debug("request '%s' remained in state '%s'", request.name, request.state)
 
         if self.is_configuring_state(request.state):
-            self.add_queues_conf(request, nodesets)
-            self.add_auth_conf(request)
+            # filled by the first conf that is generated again, see request_dependencies()
+            deps = {}
+            self.add_queues_conf(request, nodesets, revisions, deps)
+            self.add_auth_conf(request, revisions, deps)
         else:
             request.queuesconf = None
             request.authconf = None
@@ -278,22 +370,106 @@ class HandleRequests(VC3Task):
             return ('terminated', 'Virtual cluster terminated succesfully')
 
 
-    def add_queues_conf(self, request, nodesets):
+    def conf_inputs(self, attribute, request, revisions):
+        '''
+        Fingerprint of what the <attribute> conf of request is generated from, or None 
+        if the revisions of its keys are not known. 
+        '''
+        if revisions is None:
+            return None
+        if attribute == 'queuesconf':
+            return ChangeTracker.fingerprint(request.name,
+                                             self.is_finishing_state(request.state),
+                                             request.allocations,
+                                             request.environments,
+                                             request.headnode,
+                                             request.cluster,
+                                             [ revisions[k] for k in QUEUESCONF_DEPENDENCIES ])
+        return ChangeTracker.fingerprint(request.allocations,
+                                         [ revisions[k] for k in AUTHCONF_DEPENDENCIES ])
+
+    def cached_conf(self, attribute, request, fp):
+        '''
+        Sets the <attribute> conf of request to the one last generated for it, and 
+        returns it, if that was generated from inputs with fingerprint fp. 
+        '''
+        if fp is None:
+            return None
+        with self.confslock:
+            (cfp, conf) = self.confs.get((attribute, request.name), (None, None))
+        if cfp != fp:
+            return None
+        self.log.debug("Reusing %s of request %s", attribute, request.name)
+        setattr(request, attribute, conf)
+        return conf
+
+    def keep_conf(self, attribute, request, fp):
+        if fp is not None:
+            with self.confslock:
+                self.confs[(attribute, request.name)] = (fp, getattr(request, attribute))
+
+    def forget_confs(self, names):
+        '''
+        Drops the confs of requests not in names. 
+        '''
+        names = set(names)
+        with self.confslock:
+            for k in [ k for k in self.confs if k[1] not in names ]:
+                del self.confs[k]
+
+    def request_dependencies(self, request, nodesets=None, deps=None):
+        '''
+        Fetches the allocations, environments, resources and node sizes the confs of 
+        request are generated from into deps, in three calls, and returns it:
+            { (entityclass, entityname) : object }
+        Missing allocations and environments are left out. Does nothing if deps is 
+        already filled. 
+        '''
+        if deps is None:
+            deps = {}
+        if deps:
+            return deps
+
+        envs = set(request.environments or [])
+        for nodeset in nodesets or []:
+            if nodeset.environment is not None:
+                envs.add(nodeset.environment)
+        deps.update(self.client.ic.getentitymap([ (Allocation, a) for a in request.allocations or [] ] + 
+                                                [ (Environment, e) for e in envs ]))
+
+        allocations = [ o for ((klass, n), o) in deps.items() if klass is Allocation ]
+        resources = self.client.getResources(list(set([ a.resource for a in allocations if a.resource ])))
+        for r in resources:
+            deps[(Resource, r.name)] = r
+        for ni in self.client.getNodeinfos(list(set([ r.nodeinfo for r in resources if r.nodeinfo ]))):
+            deps[(Nodeinfo, ni.name)] = ni
+        return deps
+
+    def add_queues_conf(self, request, nodesets, revisions=None, deps=None):
         '''
             request.allocations = [ alloc1, alloc2 ]
                    .cluster.nodesets = [ nodeset1, nodeset2 ]                                       
              nodeset.node_number   # total number to launch. 
+
+        The conf is only generated again if its inputs have changed, see conf_inputs(). 
+        The entities it is generated from are taken from deps, or fetched into it. 
         '''
+        fp = self.conf_inputs('queuesconf', request, revisions)
+        if self.cached_conf('queuesconf', request, fp) is not None:
+            return request.queuesconf
+
         config = ConfigParser.RawConfigParser()
 
         try:
+            deps = self.request_dependencies(request, nodesets, deps)
             for allocation_name in request.allocations:
-                self.generate_queues_section(config, request, nodesets, allocation_name)
+                self.generate_queues_section(config, request, nodesets, allocation_name, deps)
 
             conf_as_string = StringIO.StringIO()
             config.write(conf_as_string)
 
             request.queuesconf = b64encode(conf_as_string.getvalue())
+            self.keep_conf('queuesconf', request, fp)
             return request.queuesconf
         except Exception, e:
             self.log.error('Failure to generate queuesconf: %s', e)
@@ -301,38 +477,46 @@ class HandleRequests(VC3Task):
             request.queuesconf = None
             raise e
 
-    def add_auth_conf(self, request):
+    def add_auth_conf(self, request, revisions=None, deps=None):
+        fp = self.conf_inputs('authconf', request, revisions)
+        if self.cached_conf('authconf', request, fp) is not None:
+            return request.authconf
+
         config = ConfigParser.RawConfigParser()
 
         try:
+            deps = self.request_dependencies(request, None, deps)
             for allocation_name in request.allocations:
-                self.generate_auth_section(config, request, allocation_name)
+                self.generate_auth_section(config, request, allocation_name, deps)
 
             conf_as_string = StringIO.StringIO()
             config.write(conf_as_string)
 
             request.authconf = b64encode(conf_as_string.getvalue())
+            self.keep_conf('authconf', request, fp)
             return request.authconf
         except Exception, e:
             self.log.error('Failure generating auth.conf: %s', e)
             request.authconf = None
             return None
 
-    def generate_queues_section(self, config, request, nodesets, allocation_name):
-        allocation = self.client.getAllocation(allocation_name)
+    def generate_queues_section(self, config, request, nodesets, allocation_name, deps=None):
+        deps = self.request_dependencies(request, nodesets, deps)
+
+        allocation = deps.get((Allocation, allocation_name))
         if not allocation:
             raise VC3InvalidRequest("Allocation '%s' has not been declared." % allocation_name, request = request)
 
-        resource = self.client.getResource(allocation.resource)
+        resource = deps.get((Resource, allocation.resource))
         if not resource:
             raise VC3InvalidRequest("Resource '%s' has not been declared." % allocation.resource, request = request)
 
-        resource_nodesize = self.client.getNodeinfo(resource.nodeinfo)
+        resource_nodesize = deps.get((Nodeinfo, resource.nodeinfo))
         if not resource_nodesize:
             raise VC3InvalidRequest("Resource node size '%s' has not been declared." % resource.nodeinfo, request = request)
         
         for nodeset in nodesets:
-            self.add_nodeset_to_queuesconf(config, request, resource, resource_nodesize, allocation, nodeset)
+            self.add_nodeset_to_queuesconf(config, request, resource, resource_nodesize, allocation, nodeset, deps)
 
     def __get_ip(self, request):
         try:
@@ -358,7 +542,7 @@ class HandleRequests(VC3Task):
         return None
 
 
-    def add_nodeset_to_queuesconf(self, config, request, resource, resource_nodesize, allocation, nodeset):
+    def add_nodeset_to_queuesconf(self, config, request, resource, resource_nodesize, allocation, nodeset, deps=None):
         node_number  = self.jobs_to_run_by_policy(request, allocation, nodeset)
         section_name = request.name + '.' + nodeset.name + '.' + allocation.name
 
@@ -448,7 +632,7 @@ class HandleRequests(VC3Task):
         else:
             raise VC3InvalidRequest("Unknown resource access type '%s'" % str(resource.accesstype), request = request)
 
-        self.add_environment_to_queuesconf(config, request, section_name, nodeset, resource, resource_nodesize)
+        self.add_environment_to_queuesconf(config, request, section_name, nodeset, resource, resource_nodesize, deps)
 
         self.log.debug("Completed filling in config for allocation %s" % allocation.name)
 
@@ -495,19 +679,20 @@ class HandleRequests(VC3Task):
         return encoded_pub, encoded_priv
          
 
-    def generate_auth_section(self, config, request, allocation_name):
+    def generate_auth_section(self, config, request, allocation_name, deps=None):
 
         name = allocation_name
         config.add_section(name)
 
-        allocation = self.client.getAllocation(allocation_name)
+        deps = self.request_dependencies(request, None, deps)
+        allocation = deps.get((Allocation, allocation_name))
         if not allocation:
             raise VC3InvalidRequest("Allocation '%s' has not been declared." % allocation_name, request = request)
 
         if allocation.privtoken is None:
             raise VC3InvalidRequest("Allocation '%s' doesn't have priv token." % allocation_name, request = request)
 
-        resource = self.client.getResource(allocation.resource)
+        resource = deps.get((Resource, allocation.resource))
         if not resource:
             raise VC3InvalidRequest("Resource '%s' has not been declared." % allocation.resource, request = request)
 
@@ -567,7 +752,7 @@ class HandleRequests(VC3Task):
         return s
 
 
-    def add_environment_to_queuesconf(self, config, request, section_name, nodeset, resource, resource_nodesize):
+    def add_environment_to_queuesconf(self, config, request, section_name, nodeset, resource, resource_nodesize, deps=None):
         #s  = " --revar 'VC3_.*'"
         s  = '" ' # trying to quote the thing
         s += ' --home=.'
@@ -598,8 +783,9 @@ class HandleRequests(VC3Task):
         if nodeset.environment is not None:
             envs.append(nodeset.environment)
 
+        deps = self.request_dependencies(request, [nodeset], deps)
         for env_name in envs:
-            environment = self.client.getEnvironment(env_name)
+            environment = deps.get((Environment, env_name))
             if environment is None:
                 raise VC3InvalidRequest("Unknown environment '%s' for '%s'" % (env_name, section_name), request = request)
 
@@ -692,10 +878,7 @@ class HandleRequests(VC3Task):
             raise VC3InvalidRequest("No nodesets have been added to Cluster '%s' " % cluster.name, request = request)
 
         total_jobs = 0
-        for nodeset_name in cluster.nodesets:
-            nodeset = self.client.getNodeset(nodeset_name)
-            if not nodeset:
-                raise VC3InvalidRequest("Nodeset '%s' has not been declared." % nodeset_name, request = request)
+        for nodeset in self.client.getNodesets(cluster.nodesets):
             if nodeset.node_number is not None:
                 total_jobs += nodeset.node_number
         return total_jobs
@@ -751,14 +934,9 @@ class HandleRequests(VC3Task):
         if len(cluster.nodesets) < 1:
             raise VC3InvalidRequest("No nodesets have been added to Cluster '%s' " % cluster.name, request = request)
 
-        nodesets = []
-        for nodeset_name in cluster.nodesets:
-            self.log.debug("retrieving nodeset %s for cluster %s " % (nodeset_name, cluster.name))
-            nodeset = self.client.getNodeset(nodeset_name)
-            if not nodeset:
-                raise VC3InvalidRequest("Nodeset '%s' has not been declared." % nodeset_name, request = request)
-            self.log.debug("Retrieved %s for name %s" % ( nodeset, nodeset_name))
-            nodesets.append(nodeset)
+        self.log.debug("retrieving nodesets %s for cluster %s " % (cluster.nodesets, cluster.name))
+        nodesets = self.client.getNodesets(cluster.nodesets)
+        self.log.debug("Retrieved %s for names %s" % (nodesets, cluster.nodesets))
         return nodesets
 
     def request_has_expired(self, request):
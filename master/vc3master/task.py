@@ -2,33 +2,58 @@
 # Classes and interfaces for periodic tasks/processing.
 #  
 
+import copy
+import heapq
 import logging
+import random
 import threading
-import datetime
 import traceback
 import time
 
 import pluginmanager as pm
 
+from vc3infoservice.core import InfoEntityMissingException, jsonencode, jsondecode
+from vc3infoservice.infoclient import InfoBatch, EntityView
+
 class VC3TaskSet(threading.Thread):
     '''
-    This object contains Tasks to be run sequentiall every 
-    
+    This object contains Tasks to be run every <polling_interval> seconds. 
+
+    Every task plugin has its own schedule, kept in a heap ordered by the time each is 
+    next due, and runs in its own thread, so a slow task does not hold back the others.
+    Per section, and per task with '<option>.<TaskPlugin>', these can be set:
+
+        polling_interval      seconds between runs of a task
+        jitter                up to this many seconds are added at random to every wait
+        deadline              seconds a run may take, polling_interval by default. A run
+                              that takes longer is reported, and a task still running 
+                              when it is next due skips that run. 
+        triggers              infoservice keys (e.g. request,nodes) whose changes make 
+                              the tasks due at once, 
+        trigger_min_interval  but not sooner than this many seconds after their last run.
     '''
     def __init__(self, parent, config, section):
         '''
-        Contains one or more task plugins, which are run sequentially every <polling_interval> seconds. 
+        Contains one or more task plugins, which are run every <polling_interval> seconds. 
         '''
         self.log = logging.getLogger()
-        threading.Thread.__init__(self) # init the thread
+        threading.Thread.__init__(self, name='taskset-%s' % section) # init the thread
         self.stopevent = threading.Event()
-        self.thread_loop_interval = 1
         self.parent = parent
         self.config = config
         self.section = section
-        self.polling_interval = int(self.config.get(self.section, 'polling_interval')) 
+        self.polling_interval = self.config.getfloat(self.section, 'polling_interval') 
         self.client = parent.client
 
+        # Task plugins get their client from the taskset. Unless disabled, it reads 
+        # entities through a cache that is emptied when a task starts while none of 
+        # the taskset's tasks is running. 
+        self.cache = None
+        if not self.config.has_option(self.section, 'cache') or self.config.getboolean(self.section, 'cache'):
+            self.cache = CycleCache(parent.client.ic)
+            self.client = copy.copy(parent.client)
+            self.client.ic = self.cache
+
         pil = self.config.get(self.section, 'taskplugins').split(',')
         self.pluginstrs=[]
         for pis in pil:
@@ -44,33 +69,177 @@ class VC3TaskSet(threading.Thread):
             self.tasks.append(p)
         self.log.debug("Task plugins initialized.")
 
+        self.schedules = []
+        for (pn, p) in zip(self.pluginstrs, self.tasks):
+            interval = self._taskoption(pn, 'polling_interval', self.polling_interval)
+            self.schedules.append(TaskSchedule(self, pn, p,
+                                               interval,
+                                               self._taskoption(pn, 'jitter', 0),
+                                               self._taskoption(pn, 'deadline', interval),
+                                               self._taskoption(pn, 'trigger_min_interval', 0)))
+
+        # Changes to these infoservice keys make the tasks due. 
+        self.triggers = []
+        if self.config.has_option(self.section, 'triggers'):
+            self.triggers = [ k.strip() for k in self.config.get(self.section, 'triggers').split(',') if k.strip() ]
+        self.cond = threading.Condition(threading.Lock())
+        self.triggered = False
+
+
+    def _taskoption(self, taskname, option, default):
+        for o in ['%s.%s' % (option, taskname), option]:
+            if self.config.has_option(self.section, o):
+                return self.config.getfloat(self.section, o)
+        return float(default)
+
 
     def run(self):
         '''
+        Starts each task when it is due, until stop() is called. Waits for the running 
+        tasks before returning. 
         '''
         self.log.debug("Running Taskset %s" % self.section)
-        tdinterval = datetime.timedelta(seconds = self.polling_interval)
-        lastrun = datetime.datetime(2000, 12, 1)
+        for key in self.triggers:
+            w = threading.Thread(target=self._watch, args=(key,), name='taskset-%s-watch-%s' % (self.section, key))
+            w.daemon = True
+            w.start()
+
+        now = time.time()
+        heap = [ (now, i, ts) for (i, ts) in enumerate(self.schedules) ]
+        heapq.heapify(heap)
+        while not self.stopevent.isSet():
+            with self.cond:
+                while not (self.stopevent.isSet() or self.triggered or heap[0][0] <= time.time()):
+                    self.cond.wait(heap[0][0] - time.time())
+                triggered = self.triggered
+                self.triggered = False
+            if self.stopevent.isSet():
+                break
+
+            now = time.time()
+            if triggered:
+                heap = [ (due if ts.running() else min(due, ts.earliest(now)), i, ts) for (due, i, ts) in heap ]
+                heapq.heapify(heap)
+
+            due = []
+            while heap and heap[0][0] <= now:
+                due.append(heapq.heappop(heap))
+            for (t, i, ts) in due:
+                ts.start(now - t)
+                heapq.heappush(heap, (ts.nextdue(now), i, ts))
+
+        for ts in self.schedules:
+            ts.join()
+        self.log.debug("Taskset %s stopped.", self.section)
+
+
+    def trigger(self, reason):
+        '''
+        Makes the tasks due now, or as soon as their trigger_min_interval allows. 
+        '''
+        self.log.debug("Taskset %s triggered by %s", self.section, reason)
+        with self.cond:
+            self.triggered = True
+            self.cond.notify()
+
+
+    def _watch(self, key):
+        '''
+        Triggers the taskset on every change of the entities of <key>. 
+        '''
+        since = 0
         while not self.stopevent.isSet():
-            #self.log.debug("Checking interval...")
-            if datetime.datetime.now() - lastrun > tdinterval:
-                for p in self.tasks:
-                    try:            
-                        p.runtask()
-                    except Exception, e:
-                        self.log.warning("Exception during runtask(): %s " % traceback.format_exc(None))
-                lastrun = datetime.datetime.now()
-                self.log.debug("Waiting for %s seconds..." % self.polling_interval)    
-            time.sleep(self.thread_loop_interval)
-
-
-    def join(self,timeout=None):
+            try:
+                d = self.parent.client.ic.getchanges(key, since)
+            except Exception, e:
+                self.log.warning("Could not watch %s for taskset %s. (%s)", key, self.section, e)
+                self.stopevent.wait(self.polling_interval)
+                continue
+            if since and (d['changed'] or d['deleted'] or d['reset']):
+                self.trigger(key)
+            since = d['revision']
+
+
+    def stop(self):
         if not self.stopevent.isSet():
-            self.log.debug('joining thread')
+            self.log.debug('stopping taskset %s', self.section)
             self.stopevent.set()
-            #self._join()
-            #threading.Thread.join(self, timeout)
+            with self.cond:
+                self.cond.notify()
+
+
+    def join(self, timeout=None):
+        self.stop()
+        if self.isAlive():
+            threading.Thread.join(self, timeout)
+
+
+
+class TaskSchedule(object):
+    '''
+    When one task plugin of a VC3TaskSet runs, and the thread it runs in. 
+    '''
+    def __init__(self, taskset, name, task, interval, jitter, deadline, mininterval):
+        self.log = logging.getLogger()
+        self.taskset = taskset
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.jitter = jitter
+        self.deadline = deadline
+        self.mininterval = mininterval
+        self.thread = None
+        self.laststart = 0
+        self.runs = 0
+        self.overruns = 0
+
+    def nextdue(self, now):
+        return now + self.interval + random.uniform(0, self.jitter)
+
+    def earliest(self, now):
+        return max(now, self.laststart + self.mininterval)
+
+    def running(self):
+        return self.thread is not None and self.thread.isAlive()
 
+    def start(self, late):
+        '''
+        Runs the task in a new thread, <late> seconds after it was due, unless its 
+        previous run has not finished. 
+        '''
+        if self.running():
+            self.overruns += 1
+            self.log.warning("Task %s of taskset %s still running after %.1fs (deadline %.1fs). Skipping this run. (%d overruns)",
+                             self.name, self.taskset.section, time.time() - self.laststart, self.deadline, self.overruns)
+            return
+        if late > self.deadline:
+            self.log.warning("Task %s of taskset %s started %.1fs late.", self.name, self.taskset.section, late)
+        self.laststart = time.time()
+        self.thread = threading.Thread(target=self._run, name='taskset-%s-%s' % (self.taskset.section, self.name))
+        self.thread.start()
+
+    def _run(self):
+        start = time.time()
+        cache = self.taskset.cache
+        if cache is not None:
+            cache.begin()
+        try:
+            self.task.runtask()
+        except Exception, e:
+            self.log.warning("Exception during runtask(): %s " % traceback.format_exc(None))
+        if cache is not None:
+            cache.end()
+        self.runs += 1
+        elapsed = time.time() - start
+        if elapsed > self.deadline:
+            self.log.warning("Task %s of taskset %s took %.1fs, past its deadline of %.1fs.",
+                             self.name, self.taskset.section, elapsed, self.deadline)
+        else:
+            self.log.debug("Task %s of taskset %s took %.1fs.", self.name, self.taskset.section, elapsed)
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
 
 
 class VC3Task(object):
@@ -87,3 +256,255 @@ class VC3Task(object):
         '''
         '''
         raise NotImplementedError
+
+
+
+class CycleCache(object):
+    '''
+    Read-through cache of infoservice entities for one cycle of a VC3TaskSet. It is
+    used in place of the InfoClient of the taskset's client, so an entity read by one
+    task plugin, or many times by one plugin and its workers, is fetched once per 
+    cycle. Each taskset has its own cache, so a busy taskset does not keep another's 
+    reads from being refreshed. A cycle 
+    starts when a task run begins while no other run is under way, and lasts until 
+    the last run under way ends, so the cache is never emptied in the middle of a run. 
+
+    Entities are kept as JSON, and every read returns new objects, so plugins do not 
+    see each other's unstored changes. Stores, merges, patches and deletes made 
+    through the cache are sent to the infoservice and then applied to the cache, 
+    or drop the entity from it where the infoservice merge cannot be followed 
+    locally. Changes made by others show up in the next cycle. 
+
+    Any other InfoClient call passes through uncached. 
+    '''
+    def __init__(self, infoclient):
+        self.log = logging.getLogger()
+        self.ic = infoclient
+        self.lock = threading.Lock()
+        self.running = 0    # task runs under way
+        self.newcycle()
+
+    def __getattr__(self, name):
+        return getattr(self.ic, name)
+
+    def begin(self):
+        '''
+        Called when a task run starts. Starts a new cycle if no other run is under way. 
+        '''
+        with self.lock:
+            if self.running == 0:
+                self._reset()
+            self.running += 1
+
+    def end(self):
+        '''
+        Called when a task run ends. 
+        '''
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            self.log.debug("Cycle cache: %s", self.counters())
+
+    def newcycle(self):
+        '''
+        Empties the cache and resets its counters. 
+        '''
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
+        self.entities = {}      # infokey -> { entityname : JSON, or None if missing }
+        self.complete = set()   # infokeys whose every entity is in self.entities
+        self.hits = 0           # entities read from the cache
+        self.misses = 0         # entities fetched from the infoservice
+        self.roundtrips = 0     # reads sent to the infoservice
+        self.avoided = 0        # reads answered from the cache alone
+
+    def counters(self):
+        with self.lock:
+            return "%d hits, %d misses, %d round trips, %d round trips avoided" % (self.hits,
+                                                                                    self.misses,
+                                                                                    self.roundtrips,
+                                                                                    self.avoided)
+
+    def _lookup(self, key, names, read=True):
+        '''
+        Returns ({ entityname : JSON or None } of the <names> in the cache, [ names not in it ]).
+        Unless <read> is False, the lookup is counted as one read. 
+        '''
+        found = {}
+        missing = []
+        with self.lock:
+            cached = self.entities.get(key, {})
+            complete = key in self.complete
+            for n in names:
+                if n in cached:
+                    found[n] = cached[n]
+                elif complete:
+                    found[n] = None
+                else:
+                    missing.append(n)
+            self.hits += len(found)
+            self.misses += len(missing)
+            if read:
+                self._count(missing)
+        return (found, missing)
+
+    def _count(self, missing):
+        if missing:
+            self.roundtrips += 1
+        else:
+            self.avoided += 1
+
+    def _fill(self, key, edicts, missing=[]):
+        '''
+        Adds entity dictionaries { entityname : dict } of <key> to the cache, and marks
+        the names in <missing> as missing. Returns { entityname : JSON }.
+        '''
+        filled = dict([ (n, jsonencode(ed)) for (n, ed) in edicts.iteritems() ])
+        with self.lock:
+            cached = self.entities.setdefault(key, {})
+            cached.update(filled)
+            for n in missing:
+                cached[n] = None
+        return filled
+
+    def _drop(self, key, entityname):
+        with self.lock:
+            self.entities.get(key, {}).pop(entityname, None)
+            self.complete.discard(key)
+
+    def getentity(self, entityclass, entityname):
+        key = entityclass.infokey
+        (found, missing) = self._lookup(key, [entityname])
+        if missing:
+            try:
+                ed = self.ic._getentitydict(key, entityname)
+            except InfoEntityMissingException:
+                self._fill(key, {}, [entityname])
+                raise
+            found = self._fill(key, { entityname : ed })
+        je = found[entityname]
+        if je is None:
+            raise InfoEntityMissingException("Attempted to get an Entity that doesn't exist. Name: %s" % entityname)
+        return entityclass.objectFromDict(jsondecode(je))
+
+    def getentities(self, entityclass, entitynames):
+        key = entityclass.infokey
+        if not entitynames:
+            return []
+        (found, missing) = self._lookup(key, entitynames)
+        if missing:
+            ed = self.ic._getentitiesdict([ (key, n) for n in missing ]).get(key, {})
+            found.update(self._fill(key, ed, [ n for n in missing if n not in ed ]))
+        olist = []
+        for n in entitynames:
+            if found.get(n) is None:
+                raise InfoEntityMissingException("Attempted to get an Entity that doesn't exist. Name: %s" % n)
+            olist.append(entityclass.objectFromDict(jsondecode(found[n])))
+        return olist
+
+    def getentitymap(self, classnames):
+        if not classnames:
+            return {}
+        bykey = {}
+        for (klass, n) in classnames:
+            bykey.setdefault(klass.infokey, []).append(n)
+        found = {}
+        pairs = []
+        for (key, names) in bykey.iteritems():
+            (found[key], missing) = self._lookup(key, names, False)
+            pairs.extend([ (key, n) for n in missing ])
+        with self.lock:
+            self._count(pairs)
+        if pairs:
+            d = self.ic._getentitiesdict(pairs)
+            for (key, names) in bykey.iteritems():
+                missing = [ n for (k, n) in pairs if k == key ]
+                if missing:
+                    ed = d.get(key, {})
+                    found[key].update(self._fill(key, ed, [ n for n in missing if n not in ed ]))
+        omap = {}
+        for (klass, n) in classnames:
+            je = found[klass.infokey].get(n)
+            if je is not None:
+                omap[(klass, n)] = klass.objectFromDict(jsondecode(je))
+        return omap
+
+    def listentities(self, klass, where=None, lazy=False):
+        key = klass.infokey
+        if where is not None:
+            with self.lock:
+                self.roundtrips += 1
+            docobj = self.ic._querydocumentdict(key, where) or {}
+            self._fill(key, docobj)
+        else:
+            with self.lock:
+                cached = None
+                if key in self.complete:
+                    cached = dict([ (n, je) for (n, je) in self.entities[key].iteritems() if je is not None ])
+                    self.hits += len(cached)
+                    self.avoided += 1
+                else:
+                    self.roundtrips += 1
+            if cached is None:
+                docobj = self.ic.getdocumentdict(key) or {}
+                cached = self._fill(key, docobj)
+                with self.lock:
+                    self.misses += len(docobj)
+                    self.complete.add(key)
+            docobj = dict([ (n, jsondecode(je)) for (n, je) in cached.iteritems() ])
+        if lazy:
+            return ( EntityView(klass, n, ed) for (n, ed) in docobj.iteritems() )
+        return [ klass.objectFromDict(ed) for ed in docobj.values() ]
+
+    def _storeentitydict(self, key, edict):
+        self.ic._storeentitydict(key, edict)
+        self._fill(key, edict)
+
+    def _mergeentitydict(self, key, edict):
+        self.ic._mergeentitydict(key, edict)
+        self._merged(key, edict)
+
+    def _merged(self, key, edict):
+        '''
+        Applies a merge the infoservice has done to the cache. Values that replace a 
+        missing, None or plain value are set as the infoservice sets them; if a list or
+        dictionary was merged into, the entity is dropped, to be fetched again. 
+        '''
+        for (entityname, attributes) in edict.iteritems():
+            with self.lock:
+                je = self.entities.get(key, {}).get(entityname)
+            if je is None:
+                self._drop(key, entityname)
+                continue
+            ed = jsondecode(je)
+            for (a, v) in attributes.iteritems():
+                if isinstance(ed.get(a), (list, dict)):
+                    self._drop(key, entityname)
+                    break
+                ed[a] = v
+            else:
+                self._fill(key, { entityname : ed })
+
+    def patchentity(self, entityclass, entityname, path, value):
+        self.ic.patchentity(entityclass, entityname, path, value)
+        self._drop(entityclass.infokey, entityname)
+
+    def deleteentity(self, entityclass, entityname):
+        self.ic.deleteentity(entityclass, entityname)
+        self._fill(entityclass.infokey, {}, [entityname])
+
+    def batch(self):
+        return InfoBatch(self)
+
+    def _sendbatch(self, ops):
+        self.ic._sendbatch(ops)
+        for op in ops:
+            if op['op'] == 'store':
+                self._fill(op['key'], op['data'])
+            elif op['op'] == 'merge':
+                self._merged(op['key'], op['data'])
+            else:
+                self._fill(op['key'], {}, [op['entityname']])
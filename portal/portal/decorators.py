@@ -27,7 +27,7 @@ def allocation_validated(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         vc3_client = get_vc3_client()
-        allocations = vc3_client.listAllocations()
+        allocations = vc3_client.listAllocations(lazy=True)
         for allocation in allocations:
             if (session['name'] == allocation.owner and
                     allocation.state == "ready"):
@@ -42,7 +42,7 @@ def project_exists(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         vc3_client = get_vc3_client()
-        projects = vc3_client.listProjects()
+        projects = vc3_client.listProjects(lazy=True)
         for project in projects:
             if (session['name'] == project.owner or
                     session['name'] in project.members):
@@ -18,37 +18,46 @@ def virtual_cluster(name):
     """
     result = {}
     vc3_client = get_vc3_client()
-    virtual_clusters = vc3_client.listRequests()
-    nodesets = vc3_client.listNodesets()
+    # only the matching request and its headnode, without queuesconf/authconf blobs
+    virtual_clusters = vc3_client.queryRequests(
+        where={'name': name},
+        fields=['name', 'state', 'cluster', 'statusraw', 'statusinfo', 'displayname',
+                'description', 'state_reason', 'action', 'headnode'])
     for vc in virtual_clusters:
-        if vc.name == name:
-            sanitized_obj = {'name': vc.name,
-                             'state': vc.state,
-                             'cluster': vc.cluster,
-                             'statusraw': vc.statusraw,
-                             'statusinfo': vc.statusinfo,
-                             'displayname': vc.displayname,
-                             'description': vc.description,
-                             'statereason': vc.state_reason,
-                             'action': vc.action,
-                             'headnode': vc.headnode}
-            if vc.statusinfo is not None:
-                sanitized_obj['statusinfo_error'] = vc.statusinfo[vc.statusinfo.keys()[
+        if vc.get('name') == name:
+            sanitized_obj = {'name': vc.get('name'),
+                             'state': vc.get('state'),
+                             'cluster': vc.get('cluster'),
+                             'statusraw': vc.get('statusraw'),
+                             'statusinfo': vc.get('statusinfo'),
+                             'displayname': vc.get('displayname'),
+                             'description': vc.get('description'),
+                             'statereason': vc.get('state_reason'),
+                             'action': vc.get('action'),
+                             'headnode': vc.get('headnode')}
+            statusinfo = vc.get('statusinfo')
+            if statusinfo is not None:
+                sanitized_obj['statusinfo_error'] = statusinfo[statusinfo.keys()[
                     0]]['error']
-                sanitized_obj['statusinfo_idle'] = vc.statusinfo[vc.statusinfo.keys()[
+                sanitized_obj['statusinfo_idle'] = statusinfo[statusinfo.keys()[
                     0]]['idle']
-                sanitized_obj['statusinfo_node_number'] = vc.statusinfo[vc.statusinfo.keys()[
+                sanitized_obj['statusinfo_node_number'] = statusinfo[statusinfo.keys()[
                     0]]['node_number']
-                sanitized_obj['statusinfo_requested'] = vc.statusinfo[vc.statusinfo.keys()[
+                sanitized_obj['statusinfo_requested'] = statusinfo[statusinfo.keys()[
                     0]]['requested']
-                sanitized_obj['statusinfo_running'] = vc.statusinfo[vc.statusinfo.keys()[
+                sanitized_obj['statusinfo_running'] = statusinfo[statusinfo.keys()[
                     0]]['running']
+            nodesets = []
+            if vc.get('headnode'):
+                nodesets = vc3_client.queryNodesets(
+                    where={'name': vc.get('headnode')},
+                    fields=['name', 'app_host', 'app_type', 'state', 'state_reason'])
             for nodeset in nodesets:
-                if nodeset.name == vc.headnode:
-                    sanitized_obj['headnode_app_host'] = nodeset.app_host
-                    sanitized_obj['headnode_app_type'] = nodeset.app_type
-                    sanitized_obj['headnode_state'] = nodeset.state
-                    sanitized_obj['headnode_state_reason'] = nodeset.state_reason
+                if nodeset.get('name') == vc.get('headnode'):
+                    sanitized_obj['headnode_app_host'] = nodeset.get('app_host')
+                    sanitized_obj['headnode_app_type'] = nodeset.get('app_type')
+                    sanitized_obj['headnode_state'] = nodeset.get('state')
+                    sanitized_obj['headnode_state_reason'] = nodeset.get('state_reason')
 
             return flask.jsonify(sanitized_obj)
     return flask.jsonify(result), 404
@@ -65,7 +74,7 @@ def allocation(name):
     """
     result = {}
     vc3_client = get_vc3_client()
-    allocations = vc3_client.listAllocations()
+    allocations = vc3_client.listAllocations(where={'name': name})
     for x in allocations:
         if x.name == name:
             sanitized_obj = {'name': x.name,
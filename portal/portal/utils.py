@@ -130,13 +130,8 @@ def project_in_vc(name):
     :return: True if user exists in project or False otherwise
     """
     vc3_client = get_vc3_client()
-    projects = vc3_client.listProjects()
     vc = vc3_client.getRequest(requestname=name)
-    vc_owner_projects = []
-
-    for project in projects:
-        if vc.owner == project.owner:
-            vc_owner_projects.append(project)
+    vc_owner_projects = vc3_client.listProjects(where={'owner': vc.owner}, lazy=True)
 
     for p in vc_owner_projects:
         if (session['name'] in p.members or session['name'] == p.owner):
@@ -646,8 +646,7 @@ def remove_member_from_project(name):
     user = request.form['submit']
 
     # List of user's allocations
-    allocations = vc3_client.listAllocations()
-    user_allocations = [a.name for a in allocations if user == a.owner]
+    user_allocations = vc3_client.listAllocationNames(where={'owner': user})
 
     # Remove allocation if user has allocation in project
     for allocation in project.allocations:
@@ -774,7 +773,11 @@ def create_cluster():
             nodeset = vc3_client.defineNodeset(name=name, owner=owner,
                                                node_number=node_number, app_type=app_type,
                                                app_role=app_role, environment=None)
-            vc3_client.storeNodeset(nodeset)
+            newcluster = vc3_client.defineCluster(
+                name=name, owner=owner, nodesets=[nodeset.name], displayname=displayname)
+            with vc3_client.batch() as batch:
+                nodeset.store(batch)
+                newcluster.store(batch)
         except:
             node_number = request.form['node_number']
             app_type = request.form['app_type']
@@ -786,12 +789,6 @@ def create_cluster():
                                    projects=projects, nodesets=nodesets,
                                    node_number=node_number, framework=framework)
 
-        newcluster = vc3_client.defineCluster(
-            name=name, owner=owner, nodesets=[], displayname=displayname)
-        vc3_client.storeCluster(newcluster)
-        vc3_client.addNodesetToCluster(nodesetname=nodeset.name,
-                                       clustername=newcluster.name)
-
         # flash('Your cluster template has been successfully defined.', 'success')
         return redirect(url_for('list_clusters'))
 